@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# catalog.py - one database of the packages of all the repositories
+
+"""Catalog keeps the packages of every synchronized repository in a single
+SQLite database, so that questions about the whole fleet ("which repositories
+have openssl", "what was built this week", "who provides libfoo.so.1") are
+indexed queries, instead of parsing dozens of primary.xml files.
+
+A repository is refreshed from its PkgList by difference: the packages are
+identified by their checksum (pkgid), the stored ones that are gone are
+deleted, the new ones are inserted, the others aren't touched, all in one
+transaction. If the primary data set didn't change since the last refresh
+(same checksum), nothing is done at all.
+
+"""
+
+import sys
+import time
+import sqlite3
+
+from version import Version
+from pkglist import Pkg, PkgTime, Size
+from lfs.checksum import Checksum
+
+# Schema version, a database with another one is rejected
+catalog_version = 1
+
+schema = [
+    """CREATE TABLE IF NOT EXISTS catalog_info (version INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS repos (
+        repo_key INTEGER PRIMARY KEY,
+        repo_id TEXT UNIQUE NOT NULL,
+        revision TEXT,
+        primary_checksum TEXT,
+        updated INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS packages (
+        pkg_key INTEGER PRIMARY KEY,
+        repo_key INTEGER NOT NULL REFERENCES repos ON DELETE CASCADE,
+        pkgid TEXT NOT NULL,
+        checksum_type TEXT,
+        name TEXT NOT NULL,
+        arch TEXT,
+        epoch TEXT,
+        version TEXT,
+        release TEXT,
+        summary TEXT,
+        description TEXT,
+        packager TEXT,
+        url TEXT,
+        time_file INTEGER,
+        time_build INTEGER,
+        size_package INTEGER,
+        size_archive INTEGER,
+        size_installed INTEGER,
+        location TEXT,
+        UNIQUE (repo_key, pkgid))""",
+    """CREATE TABLE IF NOT EXISTS provides (
+        pkg_key INTEGER NOT NULL REFERENCES packages ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        flags TEXT,
+        epoch TEXT,
+        version TEXT,
+        release TEXT)""",
+    # UNIQUE (repo_key, pkgid) is the index by repository
+    """CREATE INDEX IF NOT EXISTS packages_name ON packages (name)""",
+    """CREATE INDEX IF NOT EXISTS packages_arch ON packages (arch)""",
+    """CREATE INDEX IF NOT EXISTS packages_time_build
+        ON packages (time_build)""",
+    """CREATE INDEX IF NOT EXISTS provides_name ON provides (name)""",
+    """CREATE INDEX IF NOT EXISTS provides_pkg_key ON provides (pkg_key)""",
+]
+
+#-------------------------------------------------------------------------------
+# Catalog -
+#-------------------------------------------------------------------------------
+
+class Catalog():
+    columns = ('r.repo_id, p.pkgid, p.checksum_type, p.name, p.arch, p.epoch,'
+               + ' p.version, p.release, p.summary, p.description, p.packager,'
+               + ' p.url, p.time_file, p.time_build, p.size_package,'
+               + ' p.size_archive, p.size_installed, p.location')
+
+    def __init__(self, filepath):
+        """Open the catalog database, creating it if needed.
+
+        Raise a RuntimeError if it has an unsupported schema version.
+        """
+        self.filepath = filepath
+        self.db = sqlite3.connect(filepath, check_same_thread=False)
+        try:
+            self.db.execute('PRAGMA foreign_keys = ON')
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+            with self.db:
+                for sql in schema:
+                    self.db.execute(sql)
+                row = self.db.execute(
+                    'SELECT version FROM catalog_info').fetchone()
+                if row is None:
+                    self.db.execute('INSERT INTO catalog_info VALUES (?)',
+                                    (catalog_version,))
+        except sqlite3.DatabaseError as e:
+            self.db.close()
+            raise RuntimeError(f'{filepath}: not a catalog ({e})')
+        if row is not None and row[0] != catalog_version:
+            self.db.close()
+            raise RuntimeError(f'{filepath}: unsupported catalog version'
+                               + f' {row[0]}')
+
+    def __str__(self):
+        s = f'catalog: {self.filepath}, {len(self)} packages\n'
+        for repo_id, revision, cnt in self.repos():
+            s += f'    {repo_id}: revision {revision}, {cnt} packages\n'
+        return s
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM packages').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #---------------------------------------------------------------------------
+    # Incremental update
+    #---------------------------------------------------------------------------
+
+    def update(self, repo_id, pl, revision=None, primary_checksum=None):
+        """Bring the packages of a repository in line with a PkgList.
+
+        primary_checksum identifies the primary data set pl was parsed from:
+        if it's the one of the last update, there's nothing to do. Return the
+        (inserted, deleted) package counts.
+        """
+        row = self.db.execute(
+            'SELECT repo_key, primary_checksum FROM repos WHERE repo_id = ?',
+            (repo_id,)).fetchone()
+        if row and primary_checksum and row[1] == primary_checksum:
+            return 0, 0
+
+        new = {p.checksum.value: p for p in pl.packages}
+        with self.db:
+            if row is None:
+                repo_key = self.db.execute(
+                    'INSERT INTO repos (repo_id) VALUES (?)',
+                    (repo_id,)).lastrowid
+            else:
+                repo_key = row[0]
+            self.db.execute(
+                'UPDATE repos SET revision = ?, primary_checksum = ?,'
+                + ' updated = ? WHERE repo_key = ?',
+                (revision, primary_checksum, int(time.time()), repo_key))
+
+            stored = dict(self.db.execute(
+                'SELECT pkgid, pkg_key FROM packages WHERE repo_key = ?',
+                (repo_key,)))
+            gone = [(k,) for pkgid, k in stored.items() if pkgid not in new]
+            # Their provides go with them (ON DELETE CASCADE)
+            self.db.executemany('DELETE FROM packages WHERE pkg_key = ?', gone)
+
+            # The keys of the new rows are assigned here, so that the packages
+            # and their provides can be inserted in two batches.
+            added = [p for pkgid, p in new.items() if pkgid not in stored]
+            first, = self.db.execute(
+                'SELECT COALESCE(MAX(pkg_key), 0) + 1 FROM packages').fetchone()
+            self.db.executemany(
+                'INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,'
+                + ' ?, ?, ?, ?, ?, ?, ?, ?)',
+                (Catalog.package_row(first + i, repo_key, p)
+                 for i, p in enumerate(added)))
+            self.db.executemany(
+                'INSERT INTO provides VALUES (?, ?, ?, ?, ?, ?)',
+                ((first + i, e.name, e.flags, e.version and e.version.epoch,
+                  e.version and e.version.ver, e.version and e.version.rel)
+                 for i, p in enumerate(added) if p.format
+                 for e in p.format.provides))
+        return len(added), len(gone)
+
+    def package_row(pkg_key, repo_key, p):
+        v = p.version
+        return (pkg_key, repo_key, p.checksum.value, p.checksum.type, p.name,
+                p.arch, v.epoch, v.ver, v.rel, p.summary, p.description,
+                p.packager, p.url, p.pkg_time.file, p.pkg_time.build,
+                p.size.package, p.size.archive, p.size.installed, p.location)
+
+    def remove_repo(self, repo_id):
+        """Remove a repository and its packages from the catalog."""
+        with self.db:
+            self.db.execute('DELETE FROM repos WHERE repo_id = ?', (repo_id,))
+
+    def repo_ids(self):
+        """Return the ids of the repositories in the catalog."""
+        return [row[0] for row in self.db.execute(
+            'SELECT repo_id FROM repos ORDER BY repo_id')]
+
+    #---------------------------------------------------------------------------
+    # Queries, returning (repo_id, Pkg) tuples
+    #---------------------------------------------------------------------------
+
+    def make_pkg(row):
+        (repo_id, pkgid, checksum_type, name, arch, epoch, ver, rel, summary,
+         description, packager, url, time_file, time_build, size_package,
+         size_archive, size_installed, location) = row
+        return repo_id, Pkg('rpm', name, arch, Version(epoch, ver, rel),
+                            Checksum(checksum_type, pkgid, pkgid='YES'),
+                            summary, description, packager, url,
+                            PkgTime(time_file, time_build),
+                            Size(size_package, size_archive, size_installed),
+                            location, None)
+
+    def query(self, where, params=()):
+        sql = (f'SELECT {Catalog.columns} FROM packages p'
+               + f' JOIN repos r ON r.repo_key = p.repo_key WHERE {where}')
+        return [Catalog.make_pkg(row) for row in self.db.execute(sql, params)]
+
+    def repos(self):
+        """Return a list of (repo_id, revision, number of packages)."""
+        return self.db.execute(
+            'SELECT r.repo_id, r.revision, COUNT(p.pkg_key) FROM repos r'
+            + ' LEFT JOIN packages p ON p.repo_key = r.repo_key'
+            + ' GROUP BY r.repo_key ORDER BY r.repo_id').fetchall()
+
+    def find(self, name, arch=None, repo_id=None):
+        """Return the packages with this name, in all the repositories (or
+        in repo_id only)."""
+        where, params = 'p.name = ?', [name]
+        if arch is not None:
+            where += ' AND p.arch = ?'
+            params.append(arch)
+        if repo_id is not None:
+            where += ' AND r.repo_id = ?'
+            params.append(repo_id)
+        return self.query(where, params)
+
+    def find_pkgid(self, pkgid):
+        """Return the repositories having the package with this checksum."""
+        return self.query('p.pkgid = ?', (pkgid,))
+
+    def what_provides(self, capability):
+        """Return the packages providing a capability."""
+        return self.query('p.pkg_key IN (SELECT pkg_key FROM provides'
+                          + ' WHERE name = ?)', (capability,))
+
+    def built_since(self, timestamp, repo_id=None):
+        """Return the packages built at or after timestamp, newest first."""
+        where, params = 'p.time_build >= ?', [timestamp]
+        if repo_id is not None:
+            where += ' AND r.repo_id = ?'
+            params.append(repo_id)
+        return self.query(where + ' ORDER BY p.time_build DESC', params)
+
+    def latest(self, name, arch=None):
+        """Return (repo_id, Pkg) with the highest epoch:version-release over
+        all the repositories, or None."""
+        l = self.find(name, arch)
+        if not l:
+            return None
+        return max(l, key=lambda x: x[1].version.key)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(f'Usage: {sys.argv[0]} <catalog.db> [<name>|<capability>...]')
+        exit(-1)
+
+    with Catalog(sys.argv[1]) as cat:
+        if len(sys.argv) == 2:
+            print(cat, end='')
+        for name in sys.argv[2:]:
+            l = cat.find(name) or cat.what_provides(name)
+            if not l:
+                print(f'{name}: not found')
+            for repo_id, p in l:
+                print(f'{name}: {p.name}-{p.version.evr()}.{p.arch}'
+                      + f'  {repo_id}  {p.location}')
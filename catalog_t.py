@@ -0,0 +1,117 @@
+# catalog_t.py
+
+import os
+import tempfile
+import unittest
+from repo import Repo
+from pkglist import PkgList
+from catalog import Catalog
+from sync import prune_catalog
+from pkgformat_t import package_xml, write_primary
+
+# -----------------------------------------------------------------------------
+# CatalogTest
+# -----------------------------------------------------------------------------
+
+class CatalogTest(unittest.TestCase):
+    """Test incremental updates and queries."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cat = Catalog(os.path.join(self.tmp.name, 'catalog.db'))
+
+    def tearDown(self):
+        self.cat.close()
+        self.tmp.cleanup()
+
+    def pkg_list(self, *packages):
+        filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(filepath, list(packages))
+        return PkgList.from_file(filepath, deps=True)
+
+    def provides(self):
+        return sorted(row[0] for row in self.cat.db.execute(
+            'SELECT name FROM provides'))
+
+    def test_update(self):
+        """Only the difference is written"""
+        pl = self.pkg_list(
+            package_xml('bash', '5.1-2', provides=['bash', 'sh']),
+            package_xml('zsh', '5.8-1', provides=['zsh']))
+        self.assertEqual((2, 0), self.cat.update('r1', pl, '1', 'sha256:a'))
+        keys = dict(self.cat.db.execute('SELECT name, pkg_key FROM packages'))
+
+        # Same primary data set: nothing to do, even if the list differs
+        self.assertEqual((0, 0), self.cat.update('r1', self.pkg_list(),
+                                                 '1', 'sha256:a'))
+        self.assertEqual(2, len(self.cat))
+
+        pl = self.pkg_list(
+            package_xml('bash', '5.1-2', provides=['bash', 'sh']),
+            package_xml('fish', '3.3-1', provides=['fish']))
+        self.assertEqual((1, 1), self.cat.update('r1', pl, '2', 'sha256:b'))
+        self.assertEqual(['bash', 'fish'],
+                         sorted(p.name for _, p in self.cat.query('1')))
+        # The unchanged package kept its row, zsh's provides went with it
+        self.assertEqual(keys['bash'], self.cat.db.execute(
+            "SELECT pkg_key FROM packages WHERE name = 'bash'").fetchone()[0])
+        self.assertEqual(['bash', 'fish', 'sh'], self.provides())
+        self.assertEqual([('r1', '2', 2)], self.cat.repos())
+
+    def test_queries(self):
+        """Across repositories"""
+        self.cat.update('r1', self.pkg_list(
+            package_xml('bash', '5.1-2', provides=['bash', 'sh']),
+            package_xml('bash', '5.1-2', arch='i686', provides=['bash'])))
+        self.cat.update('r2', self.pkg_list(
+            package_xml('bash', '5.1-10', provides=['bash']),
+            package_xml('bash', '5.1-2', provides=['bash', 'sh'])))
+
+        self.assertEqual(4, len(self.cat.find('bash')))
+        self.assertEqual(3, len(self.cat.find('bash', 'x86_64')))
+        self.assertEqual(2, len(self.cat.find('bash', repo_id='r2')))
+        repo_id, p = self.cat.latest('bash')
+        self.assertEqual(('r2', '5.1-10'), (repo_id, p.version.evr()))
+        self.assertIsNone(self.cat.latest('fish'))
+
+        # The same package in both repositories
+        pkgid = self.cat.find('bash', 'i686')[0][1].checksum.value
+        self.assertEqual(['r1'], [r for r, p in self.cat.find_pkgid(pkgid)])
+        pkgid = self.cat.find('bash', repo_id='r2')[1][1].checksum.value
+        self.assertEqual(['r1', 'r2'],
+                         sorted(r for r, p in self.cat.find_pkgid(pkgid)))
+        self.assertEqual(['r1', 'r2'],
+                         sorted(r for r, p in self.cat.what_provides('sh')))
+        self.assertEqual(4, len(self.cat.built_since(2)))
+        self.assertEqual([], self.cat.built_since(3))
+        self.assertEqual(2, len(self.cat.built_since(0, 'r1')))
+
+    def test_remove(self):
+        """Removing a repository removes its packages and provides"""
+        pl = self.pkg_list(package_xml('bash', provides=['bash']))
+        self.cat.update('r1', pl)
+        self.cat.update('r2', pl)
+        prune_catalog(self.cat, [Repo('r2')])
+        self.assertEqual(['r2'], self.cat.repo_ids())
+        self.assertEqual(1, len(self.cat))
+        self.assertEqual(['bash'], self.provides())
+
+    def test_reopen(self):
+        """The schema version is checked"""
+        self.cat.update('r1', self.pkg_list(package_xml('bash')))
+        self.cat.close()
+        self.cat = Catalog(self.cat.filepath)
+        self.assertEqual(1, len(self.cat))
+
+        with self.cat.db:
+            self.cat.db.execute('UPDATE catalog_info SET version = 99')
+        with self.assertRaises(RuntimeError):
+            Catalog(self.cat.filepath)
+        path = os.path.join(self.tmp.name, 'text.db')
+        with open(path, 'w') as f:
+            f.write('not a database' * 100)
+        with self.assertRaises(RuntimeError):
+            Catalog(path)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,375 @@
+#!/usr/bin/python
+# createrepo.py - generate the metadata of a directory of rpm packages
+
+"""Scan a directory tree of .rpm files and write its repodata: repomd.xml,
+primary.xml.gz and filelists.xml.gz, as Repomd and PkgList read them.
+
+Each package's header is read straight from the file, mapped in memory (see
+rpmheader.py), and the files are scanned in a process pool, since decoding
+headers and hashing packages is CPU bound. The worker processes return the
+package's <package> elements as XML text, ready to be written out.
+
+When the directory already has repodata, the entries of the packages whose
+size and modification time didn't change are taken from it as they are, so
+only the new or modified packages are read. The data set files are named
+after their checksum, and repomd.xml is replaced last, atomically: clients
+always see a consistent repository.
+
+"""
+
+import os
+import re
+import sys
+import gzip
+import mmap
+import stat
+import time
+import struct
+import hashlib
+from xml.sax.saxutils import escape, quoteattr
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+
+from repomd import Repomd
+from rpmheader import package_headers
+from datastream import iter_elements
+
+# Checksum type of the packages and of the data sets
+checksum_type = 'sha256'
+
+# Number of packages read by a worker process in one task
+batch_size = 64
+
+# Files listed in primary.xml too, the ones most often required by path
+primary_files_pat = re.compile(r'^/etc/|bin/|^/usr/lib/sendmail$')
+
+# Dependency kinds, as in the primary.xml <format> element
+dep_kinds = ['provides', 'requires', 'conflicts', 'obsoletes', 'suggests',
+             'enhances', 'recommends', 'supplements']
+
+# File flags and signature tags
+RPMFILE_GHOST = 0x40
+SIGTAG_PAYLOADSIZE = 1007
+
+ns_common = 'http://linux.duke.edu/metadata/common'
+ns_filelists = 'http://linux.duke.edu/metadata/filelists'
+ns_repo = 'http://linux.duke.edu/metadata/repo'
+ns_rpm = 'http://linux.duke.edu/metadata/rpm'
+
+# Characters that can't appear in XML 1.0 documents
+invalid_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Namespace declarations that lxml repeats on serialized elements
+xmlns_pat = re.compile(r' xmlns(:\w+)?="[^"]*"')
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def text(s):
+    return escape(invalid_chars.sub('', s)) if s else ''
+
+def attr(s):
+    return quoteattr(invalid_chars.sub('', s or ''))
+
+def evr_attrs(evr):
+    s = f' epoch={attr(evr.epoch or "0")} ver={attr(evr.ver)}'
+    if evr.rel:
+        s += f' rel={attr(evr.rel)}'
+    return s
+
+def element_text(nd):
+    """Return an element as XML text, without its namespace declarations."""
+    s = etree.tostring(nd, encoding='unicode', with_tail=False)
+    head, _, rest = s.partition('>')
+    return xmlns_pat.sub('', head) + '>' + rest + '\n'
+
+def find_rpms(dirpath):
+    """Return the sorted locations of the .rpm files under dirpath."""
+    l = []
+    for root, dirs, files in os.walk(dirpath):
+        dirs[:] = sorted(d for d in dirs
+                         if not d.startswith('.') and d != 'repodata')
+        rel = os.path.relpath(root, dirpath)
+        for filename in files:
+            if filename.endswith('.rpm') and not filename.startswith('.'):
+                l.append(filename if rel == '.' else f'{rel}/{filename}')
+    return sorted(l)
+
+#-------------------------------------------------------------------------------
+# RpmEntry - the metadata of one package
+#-------------------------------------------------------------------------------
+
+class RpmEntry():
+    __slots__ = ('location', 'pkgid', 'size', 'mtime', 'primary', 'filelists')
+
+    def __init__(self, location, pkgid, size, mtime, primary, filelists):
+        self.location = location
+        self.pkgid = pkgid
+        self.size = size
+        self.mtime = mtime
+        # The <package> elements, as XML text
+        self.primary = primary
+        self.filelists = filelists
+
+def scan_rpm(dirpath, location):
+    """Return the RpmEntry of a package, read from its file."""
+    filepath = os.path.join(dirpath, location)
+    with open(filepath, 'rb') as f:
+        st = os.fstat(f.fileno())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            sig, h, start = package_headers(mm)
+            pkgid = hashlib.new(checksum_type, mm).hexdigest()
+    mtime = int(st.st_mtime)
+
+    name = h.get('name')
+    arch = h.get('arch') if h.get('sourcerpm') else 'src'
+    evr = h.evr()
+    archive = h.get('archivesize', sig.get(SIGTAG_PAYLOADSIZE, 0))
+
+    # Files, with their type
+    files = []
+    modes = h.as_list('filemodes')
+    flags = h.as_list('fileflags')
+    for i, path in enumerate(h.files()):
+        if i < len(flags) and flags[i] & RPMFILE_GHOST:
+            type = 'ghost'
+        elif i < len(modes) and stat.S_ISDIR(modes[i]):
+            type = 'dir'
+        else:
+            type = None
+        files.append((path, type))
+
+    def file_elements(files, indent):
+        s = ''
+        for path, type in files:
+            t = f' type="{type}"' if type else ''
+            s += f'{indent}<file{t}>{text(path)}</file>\n'
+        return s
+
+    # primary.xml
+    s = '<package type="rpm">\n'
+    s += f'  <name>{text(name)}</name>\n'
+    s += f'  <arch>{text(arch)}</arch>\n'
+    s += f'  <version{evr_attrs(evr)}/>\n'
+    s += f'  <checksum type="{checksum_type}" pkgid="YES">{pkgid}</checksum>\n'
+    s += f'  <summary>{text(h.get("summary"))}</summary>\n'
+    s += f'  <description>{text(h.get("description"))}</description>\n'
+    s += f'  <packager>{text(h.get("packager"))}</packager>\n'
+    s += f'  <url>{text(h.get("url"))}</url>\n'
+    s += f'  <time file="{mtime}" build="{h.get("buildtime", 0)}"/>\n'
+    s += (f'  <size package="{st.st_size}" installed="{h.get("size", 0)}"'
+          + f' archive="{archive}"/>\n')
+    s += f'  <location href={attr(location)}/>\n'
+    s += '  <format>\n'
+    for tag in ['license', 'vendor', 'group', 'buildhost', 'sourcerpm']:
+        s += f'    <rpm:{tag}>{text(h.get(tag))}</rpm:{tag}>\n'
+    s += f'    <rpm:header-range start="{start}" end="{start + h.size}"/>\n'
+    for kind in dep_kinds:
+        entries = h.deps(kind)
+        if kind == 'requires':
+            # Provided by rpm itself
+            entries = [e for e in entries if not e.name.startswith('rpmlib(')]
+        if not entries:
+            continue
+        s += f'    <rpm:{kind}>\n'
+        seen = set()
+        for e in entries:
+            k = (e.name, e.flags, e.version and e.version.evr())
+            if k in seen:
+                continue
+            seen.add(k)
+            s += f'      <rpm:entry name={attr(e.name)}'
+            if e.flags:
+                s += f' flags="{e.flags}"'
+            if e.version:
+                s += evr_attrs(e.version)
+            if e.pre and kind == 'requires':
+                s += ' pre="1"'
+            s += '/>\n'
+        s += f'    </rpm:{kind}>\n'
+    s += file_elements([f for f in files if primary_files_pat.search(f[0])],
+                       '    ')
+    s += '  </format>\n</package>\n'
+
+    # filelists.xml
+    fl = (f'<package pkgid="{pkgid}" name={attr(name)} arch={attr(arch)}>\n'
+          + f'  <version{evr_attrs(evr)}/>\n'
+          + file_elements(files, '  ') + '</package>\n')
+
+    return RpmEntry(location, pkgid, st.st_size, mtime, s, fl)
+
+def scan_rpms(dirpath, locations):
+    """Return a list of (location, RpmEntry or error message)."""
+    l = []
+    for location in locations:
+        try:
+            l.append((location, scan_rpm(dirpath, location)))
+        except (OSError, RuntimeError, ValueError, struct.error) as e:
+            l.append((location, str(e)))
+    return l
+
+#-------------------------------------------------------------------------------
+# Previous metadata
+#-------------------------------------------------------------------------------
+
+def previous_entries(dirpath):
+    """Return a dictionary of the RpmEntry of the existing repodata, by
+    location. It's empty if there's no usable repodata."""
+    try:
+        md = Repomd.from_file(os.path.join(dirpath, 'repodata', 'repomd.xml'))
+    except (OSError, etree.XMLSyntaxError):
+        return {}
+    primary = md.get_data_set('primary')
+    filelists = md.get_data_set('filelists')
+    if primary is None or filelists is None:
+        return {}
+
+    entries = {}
+    by_pkgid = {}
+    try:
+        filepath = os.path.join(dirpath, primary.location)
+        for nd in iter_elements(filepath, 'package', primary):
+            location = size = mtime = pkgid = None
+            for k in nd:
+                tag = etree.QName(k.tag).localname
+                if tag == 'checksum':
+                    pkgid = k.text
+                elif tag == 'time':
+                    mtime = int(k.attrib['file'])
+                elif tag == 'size':
+                    size = int(k.attrib['package'])
+                elif tag == 'location':
+                    location = k.attrib['href']
+            e = RpmEntry(location, pkgid, size, mtime, element_text(nd), None)
+            entries[location] = by_pkgid[pkgid] = e
+
+        filepath = os.path.join(dirpath, filelists.location)
+        for nd in iter_elements(filepath, 'package', filelists):
+            e = by_pkgid.get(nd.attrib['pkgid'])
+            if e:
+                e.filelists = element_text(nd)
+    except (OSError, RuntimeError, etree.XMLSyntaxError) as e:
+        print(f'Previous metadata not usable: {e}')
+        return {}
+    return {k: e for k, e in entries.items() if e.filelists is not None}
+
+#-------------------------------------------------------------------------------
+# Data set files
+#-------------------------------------------------------------------------------
+
+def write_data_set(repodata, type, head, elements, tail):
+    """Write a compressed data set, return its <data> element for repomd.xml
+    and its location.
+
+    The file is written under a temporary name, then named after its
+    checksum.
+    """
+    tmp_path = os.path.join(repodata, f'.tmp-{type}.xml.gz')
+    open_sum = hashlib.new(checksum_type)
+    open_size = 0
+    with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+        for s in [head, *elements, tail]:
+            data = s.encode('utf-8')
+            open_sum.update(data)
+            open_size += len(data)
+            f.write(data)
+
+    with open(tmp_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            checksum = hashlib.new(checksum_type, mm).hexdigest()
+    location = f'repodata/{checksum}-{type}.xml.gz'
+    filepath = os.path.join(repodata, os.path.basename(location))
+    os.replace(tmp_path, filepath)
+
+    return (f'  <data type="{type}">\n'
+            + f'    <checksum type="{checksum_type}">{checksum}</checksum>\n'
+            + f'    <open-checksum type="{checksum_type}">'
+            + f'{open_sum.hexdigest()}</open-checksum>\n'
+            + f'    <location href="{location}"/>\n'
+            + f'    <timestamp>{int(time.time())}</timestamp>\n'
+            + f'    <size>{os.stat(filepath).st_size}</size>\n'
+            + f'    <open-size>{open_size}</open-size>\n'
+            + '  </data>\n'), location
+
+#-------------------------------------------------------------------------------
+# createrepo -
+#-------------------------------------------------------------------------------
+
+def createrepo(dirpath, jobs=None):
+    """Write the repodata of the packages under dirpath.
+
+    Return (number of packages, number of packages read).
+    """
+    repodata = os.path.join(dirpath, 'repodata')
+    os.makedirs(repodata, exist_ok=True)
+    previous = previous_entries(dirpath)
+
+    entries = {}
+    todo = []
+    for location in find_rpms(dirpath):
+        st = os.stat(os.path.join(dirpath, location))
+        e = previous.get(location)
+        if e and e.size == st.st_size and e.mtime == int(st.st_mtime):
+            entries[location] = e
+        else:
+            todo.append(location)
+
+    # The packages are sent to the workers in batches, one task per package
+    # would cost more in inter-process communication than reading it.
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    if batches:
+        with ProcessPoolExecutor(max_workers=jobs) as ex:
+            for results in ex.map(scan_rpms, [dirpath] * len(batches), batches):
+                for location, e in results:
+                    if isinstance(e, RpmEntry):
+                        entries[location] = e
+                    else:
+                        print(f'{location}: {e}')
+    packages = [entries[l] for l in sorted(entries)]
+    n = len(packages)
+
+    primary, primary_loc = write_data_set(
+        repodata, 'primary',
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        + f'<metadata xmlns="{ns_common}" xmlns:rpm="{ns_rpm}" packages="{n}">\n',
+        (e.primary for e in packages), '</metadata>\n')
+    filelists, filelists_loc = write_data_set(
+        repodata, 'filelists',
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        + f'<filelists xmlns="{ns_filelists}" packages="{n}">\n',
+        (e.filelists for e in packages), '</filelists>\n')
+
+    tmp_path = os.path.join(repodata, '.tmp-repomd.xml')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                + f'<repomd xmlns="{ns_repo}" xmlns:rpm="{ns_rpm}">\n'
+                + f'  <revision>{int(time.time())}</revision>\n'
+                + primary + filelists + '</repomd>\n')
+    os.replace(tmp_path, os.path.join(repodata, 'repomd.xml'))
+
+    # The data sets of the previous metadata can go now
+    keep = {'repomd.xml', os.path.basename(primary_loc),
+            os.path.basename(filelists_loc)}
+    for filename in os.listdir(repodata):
+        if filename not in keep and not filename.startswith('.') and (
+                filename.endswith('-primary.xml.gz')
+                or filename.endswith('-filelists.xml.gz')):
+            os.remove(os.path.join(repodata, filename))
+    return n, len(todo)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) not in [2, 3]:
+        print(f'Usage: {sys.argv[0]} <dirpath> [<jobs>]')
+        exit(-1)
+    dirpath = sys.argv[1]
+    jobs = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+    t = time.perf_counter()
+    n, read = createrepo(dirpath, jobs)
+    print(f'{n} packages, {read} read, {n - read} reused,'
+          + f' in {time.perf_counter() - t:.2f}s')
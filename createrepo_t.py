@@ -0,0 +1,141 @@
+# createrepo_t.py
+
+import os
+import hashlib
+import tempfile
+import unittest
+from repomd import Repomd
+from pkglist import PkgList
+from filelists import FileIndex
+from createrepo import createrepo, find_rpms, text, attr
+from rpmheader import RPMSENSE_GREATER, RPMSENSE_EQUAL, RPMSENSE_LESS
+from rpmheader_t import package_header, make_rpm
+
+# -----------------------------------------------------------------------------
+# CreaterepoTest
+# -----------------------------------------------------------------------------
+
+class CreaterepoTest(unittest.TestCase):
+    """Test the generated repodata, read back with the repo's own parsers."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dirpath = self.tmp.name
+        self.add('Packages/a/alpha-1.0-1.x86_64.rpm', package_header(
+            'alpha', files=['/usr/bin/alpha', '/usr/share/doc/alpha/README'],
+            requires=[('rpmlib(CompressedFileNames)', RPMSENSE_LESS
+                       | RPMSENSE_EQUAL, '3.0.4-1'),
+                      ('beta', RPMSENSE_GREATER | RPMSENSE_EQUAL, '2.0'),
+                      ('beta', RPMSENSE_GREATER | RPMSENSE_EQUAL, '2.0')],
+            provides=[('alpha', RPMSENSE_EQUAL, '1.0-1')]))
+        self.add('Packages/b/beta-2.0-3.noarch.rpm', package_header(
+            'beta', '2.0', '3', 'noarch', epoch=1,
+            provides=[('beta', RPMSENSE_EQUAL, '1:2.0-3')]))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, location, header, payload=b'payload'):
+        data, start, end = make_rpm(header, payload)
+        path = os.path.join(self.dirpath, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self):
+        """Return the PkgList and FileIndex, verified against repomd.xml."""
+        md = Repomd.from_file(os.path.join(self.dirpath, 'repodata',
+                                           'repomd.xml'))
+        primary = md.get_data_set('primary')
+        filelists = md.get_data_set('filelists')
+        pl = PkgList.from_file(os.path.join(self.dirpath, primary.location),
+                               primary, deps=True)
+        fi = FileIndex.from_file(os.path.join(self.dirpath,
+                                              filelists.location), filelists)
+        return pl, fi
+
+    def test_createrepo(self):
+        """Packages, dependencies and files"""
+        self.assertEqual((2, 2), createrepo(self.dirpath, 1))
+        pl, fi = self.read()
+        alpha, beta = sorted(pl.packages, key=lambda p: p.name)
+        self.assertEqual('Packages/a/alpha-1.0-1.x86_64.rpm', alpha.location)
+        with open(os.path.join(self.dirpath, alpha.location), 'rb') as f:
+            data = f.read()
+        self.assertEqual(hashlib.sha256(data).hexdigest(),
+                         alpha.checksum.value)
+        self.assertEqual(len(data), alpha.size.package)
+        self.assertEqual(('1', '2.0', '3', 'noarch'),
+                         (beta.version.epoch, beta.version.ver,
+                          beta.version.rel, beta.arch))
+
+        # rpmlib() requirements are dropped, duplicates merged
+        self.assertEqual([('beta', 'GE')],
+                         [(e.name, e.flags) for e in alpha.format.requires])
+        self.assertEqual('MIT', alpha.format.licence)
+        # Only the files in bin/ or /etc/ go in primary.xml
+        self.assertEqual(['/usr/bin/alpha'], alpha.format.files)
+        self.assertEqual(['alpha'],
+                         [p.name for p in fi.find('/usr/share/doc/alpha/README')])
+
+        # The header range points at the header
+        hr = alpha.format.header_range
+        self.assertEqual(b'\x8e\xad\xe8\x01', data[hr.start:hr.start + 4])
+        self.assertEqual(len(data) - len(b'payload'), hr.end)
+
+    def test_incremental(self):
+        """Only new or modified packages are read again"""
+        createrepo(self.dirpath, 1)
+        before = sorted(os.listdir(os.path.join(self.dirpath, 'repodata')))
+        self.assertEqual((2, 0), createrepo(self.dirpath, 1))
+
+        path = self.add('Packages/b/beta-2.0-3.noarch.rpm',
+                        package_header('beta', '2.0', '3', 'noarch', epoch=1),
+                        b'other payload')
+        os.utime(path, (1, 1))
+        self.add('Packages/g/gamma-1.0-1.x86_64.rpm', package_header('gamma'))
+        self.assertEqual((3, 2), createrepo(self.dirpath, 1))
+        pl, fi = self.read()
+        self.assertEqual(['alpha', 'beta', 'gamma'],
+                         sorted(p.name for p in pl.packages))
+        self.assertEqual([], pl.find('beta')[0].format.provides)
+
+        os.remove(path)
+        self.assertEqual((2, 0), createrepo(self.dirpath, 1))
+        # The old data sets are gone
+        after = os.listdir(os.path.join(self.dirpath, 'repodata'))
+        self.assertEqual(3, len(after))
+        self.assertEqual(['repomd.xml'],
+                         [f for f in before if f in after])
+
+    def test_bad_package(self):
+        """A file that isn't an rpm package is skipped"""
+        path = os.path.join(self.dirpath, 'Packages', 'bad.rpm')
+        with open(path, 'wb') as f:
+            f.write(b'not an rpm')
+        self.assertEqual((2, 3), createrepo(self.dirpath, 1))
+        pl, fi = self.read()
+        self.assertEqual(2, len(pl.packages))
+
+    def test_find_rpms(self):
+        """Hidden files and directories, and repodata, are skipped"""
+        for location in ['.hidden/x.rpm', 'Packages/.tmp-y.rpm',
+                         'repodata/z.rpm', 'top.rpm', 'Packages/a/notes.txt']:
+            path = os.path.join(self.dirpath, location)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'wb').close()
+        self.assertEqual(['Packages/a/alpha-1.0-1.x86_64.rpm',
+                          'Packages/b/beta-2.0-3.noarch.rpm', 'top.rpm'],
+                         find_rpms(self.dirpath))
+
+    def test_escape(self):
+        """Text and attributes are escaped, invalid characters removed"""
+        self.assertEqual('a &lt;b&gt; &amp; c', text('a <b> & c\x01'))
+        self.assertEqual('', text(None))
+        self.assertEqual('"a&lt;b"', attr('a<b\x1f'))
+        self.assertEqual('\'say "hi"\'', attr('say "hi"'))
+        self.assertEqual('""', attr(None))
+
+if __name__ == '__main__':
+    unittest.main()
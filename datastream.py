@@ -0,0 +1,242 @@
+#!/usr/bin/python
+# datastream.py - read compressed repository data sets as a stream
+
+"""The data sets listed in repomd.xml (primary, filelists, other...) are
+published compressed with gzip, xz, bzip2 or zchunk. A DataStream
+decompresses one of them in a producer thread, while the XML parser consumes
+the decompressed bytes through a bounded queue, so the file is read only once
+and no decompressed copy is ever written to disk.
+
+On the same pass, the checksum and size of the compressed file, and the
+open-checksum and open-size of the decompressed data, are verified against the
+values given by repomd.xml.
+
+"""
+
+import bz2
+import lzma
+import zlib
+import queue
+import hashlib
+import threading
+from lxml import etree
+from zchunk import ZckDecompressor
+
+# Size of the blocks read from the compressed file
+block_size = 256*1024
+
+# Number of decompressed chunks that may be waiting for the parser
+queue_size = 16
+
+#-------------------------------------------------------------------------------
+# Decompressors, selected by file extension
+#-------------------------------------------------------------------------------
+
+class Identity():
+    """A pass-through 'decompressor', for uncompressed files."""
+    def __init__(self):
+        self.eof = False
+        self.unused_data = b''
+
+    def decompress(self, data):
+        return data
+
+def get_decompressor(filepath):
+    """Return a new decompressor object suited to the file's extension."""
+    if filepath.endswith('.gz'):
+        # Expect a gzip header
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif filepath.endswith('.xz'):
+        return lzma.LZMADecompressor()
+    elif filepath.endswith('.bz2'):
+        return bz2.BZ2Decompressor()
+    elif filepath.endswith('.zck'):
+        return ZckDecompressor()
+    return Identity()
+
+def is_compressed(filepath):
+    return filepath.endswith(('.gz', '.xz', '.bz2', '.zck'))
+
+#-------------------------------------------------------------------------------
+# DataStream - a file-like object yielding decompressed data
+#-------------------------------------------------------------------------------
+
+class DataStream():
+    def __init__(self, filepath, checksum=None, size=None, open_checksum=None,
+                 open_size=None):
+        self.filepath = filepath
+        self.checksum = checksum
+        self.size = size
+        self.open_checksum = open_checksum
+        self.open_size = open_size
+
+        self.queue = queue.Queue(queue_size)
+        self.stopping = False
+        self.data = b''
+        self.pos = 0
+        self.eof = False
+
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def from_data_set(cls, filepath, ds):
+        """Return a DataStream verifying the values from a repomd DataSet."""
+        return cls(filepath, checksum=ds.checksum, size=ds.size,
+                   open_checksum=getattr(ds, 'open_checksum', None),
+                   open_size=getattr(ds, 'open_size', None))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #---------------------------------------------------------------------------
+    # Producer side, running in its own thread
+    #---------------------------------------------------------------------------
+
+    def put(self, item):
+        # Give up if the consumer has gone away
+        while not self.stopping:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(self):
+        try:
+            self.decompress()
+        except Exception as e:
+            # Hand the exception over to the consumer, it will raise it
+            self.put(e)
+
+    def decompress(self):
+        sh = hashlib.new(self.checksum.type) if self.checksum else None
+        osh = hashlib.new(self.open_checksum.type) if self.open_checksum else None
+        d = get_decompressor(self.filepath)
+        size = open_size = 0
+
+        with open(self.filepath, 'rb') as f:
+            for data in iter(lambda: f.read(block_size), b''):
+                size += len(data)
+                if sh:
+                    sh.update(data)
+                while data:
+                    # Concatenated streams (e.g. multi-member gzip or pbzip2
+                    # files), possibly ending on a block boundary. xz streams
+                    # may be followed by zero bytes of stream padding.
+                    if d.eof:
+                        if self.filepath.endswith('.xz'):
+                            data = data.lstrip(b'\0')
+                            if not data:
+                                break
+                        d = get_decompressor(self.filepath)
+                    out = d.decompress(data)
+                    data = d.unused_data if d.eof else b''
+                    if out:
+                        open_size += len(out)
+                        if osh:
+                            osh.update(out)
+                        if not self.put(out):
+                            return
+
+        # Verify what we've seen, before signaling the end of the data
+        if self.size is not None and size != self.size:
+            raise RuntimeError(f'{self.filepath}: size {size}'
+                               + f', expected {self.size}')
+        if sh and sh.hexdigest() != self.checksum.value:
+            raise RuntimeError(f'{self.filepath}: {self.checksum.type}'
+                               + ' checksum mismatch')
+        if self.open_size is not None and open_size != self.open_size:
+            raise RuntimeError(f'{self.filepath}: open size {open_size}'
+                               + f', expected {self.open_size}')
+        if osh and osh.hexdigest() != self.open_checksum.value:
+            raise RuntimeError(f'{self.filepath}: {self.open_checksum.type}'
+                               + ' open checksum mismatch')
+        self.put(None)
+
+    #---------------------------------------------------------------------------
+    # Consumer side, called by the parser
+    #---------------------------------------------------------------------------
+
+    def next_chunk(self):
+        item = self.queue.get()
+        if item is None:
+            self.eof = True
+            return False
+        if isinstance(item, Exception):
+            self.eof = True
+            raise item
+        self.data = item
+        self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # Read it all
+            chunks = [self.data[self.pos:]]
+            self.data = b''
+            while not self.eof and self.next_chunk():
+                chunks.append(self.data)
+            self.data = b''
+            return b''.join(chunks)
+
+        if self.pos >= len(self.data):
+            if self.eof or not self.next_chunk():
+                return b''
+        out = self.data[self.pos:self.pos + size]
+        self.pos += len(out)
+        return out
+
+    def close(self):
+        self.stopping = True
+        self.thread.join()
+
+#-------------------------------------------------------------------------------
+# open_data - open a data set file for parsing
+#-------------------------------------------------------------------------------
+
+def open_data(filepath, ds=None):
+    """Return a file-like object with the decompressed contents of filepath.
+
+    If a repomd DataSet is given, its checksums and sizes are verified while
+    the data is being read, and a RuntimeError is raised at the end of the
+    data if they don't match.
+    """
+    if ds:
+        return DataStream.from_data_set(filepath, ds)
+    return DataStream(filepath)
+
+#-------------------------------------------------------------------------------
+# iter_elements - stream the elements of a data set file
+#-------------------------------------------------------------------------------
+
+def iter_elements(filepath, tag, ds=None):
+    """Yield each element with the given local name from a data set file.
+
+    The file may be compressed, see open_data(). Each element is discarded
+    once the caller has handled it, so memory use doesn't grow with the size
+    of the file.
+    """
+    if ds or is_compressed(filepath):
+        with open_data(filepath, ds) as f:
+            yield from parse_elements(f, tag)
+    else:
+        # Let lxml read the file directly, it's faster
+        yield from parse_elements(filepath, tag)
+
+def parse_elements(source, tag):
+    for _, nd in etree.iterparse(source, events=('end',), tag=f'{{*}}{tag}'):
+        yield nd
+
+        # Free the element, and the (already handled) preceding siblings that
+        # the root element still holds on to.
+        nd.clear()
+        while nd.getprevious() is not None:
+            del nd.getparent()[0]
+
+if __name__ == '__main__':
+    print("""This module is not meant to run directly.""")
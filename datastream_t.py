@@ -0,0 +1,120 @@
+# datastream_t.py
+
+import os
+import bz2
+import gzip
+import lzma
+import hashlib
+import tempfile
+import unittest
+from unittest import mock
+import datastream
+from lfs.checksum import Checksum
+from datastream import DataStream, iter_elements
+
+xml = (b'<?xml version="1.0" encoding="UTF-8"?>\n<metadata>'
+       + b''.join(b'<package><name>p%d</name></package>' % i
+                  for i in range(1000))
+       + b'</metadata>\n')
+
+def sha256(data):
+    return Checksum('sha256', hashlib.sha256(data).hexdigest())
+
+# -----------------------------------------------------------------------------
+# DataStreamTest
+# -----------------------------------------------------------------------------
+
+class DataStreamTest(unittest.TestCase):
+    """Test decompression and verification of data set files."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, filename, data):
+        filepath = os.path.join(self.tmp.name, filename)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return filepath
+
+    def test_formats(self):
+        """Each compression is recognized by its extension"""
+        for filename, data in [('a.xml', xml),
+                               ('a.xml.gz', gzip.compress(xml)),
+                               ('a.xml.xz', lzma.compress(xml)),
+                               ('a.xml.bz2', bz2.compress(xml))]:
+            filepath = self.write(filename, data)
+            with DataStream(filepath) as f:
+                self.assertEqual(xml, f.read())
+
+    def test_small_reads(self):
+        """Reads of any size put the data back together"""
+        filepath = self.write('a.xml.gz', gzip.compress(xml))
+        chunks = []
+        with DataStream(filepath) as f:
+            for data in iter(lambda: f.read(7), b''):
+                chunks.append(data)
+        self.assertEqual(xml, b''.join(chunks))
+
+    def test_multi_member(self):
+        """Concatenated streams are all decompressed"""
+        filepath = self.write('a.xml.gz', gzip.compress(xml[:100])
+                              + gzip.compress(xml[100:]))
+        with DataStream(filepath) as f:
+            self.assertEqual(xml, f.read())
+
+        # A stream ending exactly at the end of a block, xz stream padding
+        padding = bytes(4)
+        for filename, first, second in [
+                ('a.xml.bz2', bz2.compress(xml[:100]), bz2.compress(xml[100:])),
+                ('a.xml.xz', lzma.compress(xml[:100]) + padding,
+                 lzma.compress(xml[100:]) + padding)]:
+            filepath = self.write(filename, first + second)
+            for size in [len(first), len(first) - 2]:
+                with mock.patch.object(datastream, 'block_size', size):
+                    with DataStream(filepath) as f:
+                        self.assertEqual(xml, f.read(), (filename, size))
+
+    def test_verify(self):
+        """Checksums and sizes, of both the file and its contents"""
+        data = gzip.compress(xml)
+        filepath = self.write('a.xml.gz', data)
+        with DataStream(filepath, sha256(data), len(data), sha256(xml),
+                        len(xml)) as f:
+            self.assertEqual(xml, f.read())
+
+        bad = Checksum('sha256', '0' * 64)
+        for kwargs in [{'checksum': bad}, {'size': len(data) + 1},
+                       {'open_checksum': bad}, {'open_size': len(xml) - 1}]:
+            with DataStream(filepath, **kwargs) as f:
+                with self.assertRaises(RuntimeError):
+                    f.read()
+
+    def test_corrupt(self):
+        """A decompression error reaches the reader"""
+        filepath = self.write('a.xml.xz', lzma.compress(xml)[:-20] + b'x' * 20)
+        with DataStream(filepath) as f:
+            with self.assertRaises(lzma.LZMAError):
+                f.read()
+
+    def test_close_early(self):
+        """Closing before the end stops the producer"""
+        filepath = self.write('a.xml.gz', gzip.compress(xml * 200))
+        f = DataStream(filepath)
+        f.read(10)
+        f.close()
+        self.assertFalse(f.thread.is_alive())
+
+    def test_iter_elements(self):
+        """Elements are streamed from compressed or plain files"""
+        for filename, data in [('a.xml', xml),
+                               ('a.xml.gz', gzip.compress(xml))]:
+            filepath = self.write(filename, data)
+            names = [nd.findtext('name')
+                     for nd in iter_elements(filepath, 'package')]
+            self.assertEqual([f'p{i}' for i in range(1000)], names)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# filelists.py - which package ships a given file
+
+"""The filelists data set lists the files of every package in a repository:
+millions of paths for a full distribution. FileIndex reads it as a stream and
+keeps a compact reverse index, from path to packages.
+
+Paths are split into a directory and a base name. Directories are stored as a
+tree of (parent, name) nodes, so the common prefixes are shared, and all the
+names (of directories and files) are stored once, in a sorted string table
+where a name's id is its position. The files themselves are three parallel
+arrays (key, package, type), sorted by key = (directory, name): a lookup is a
+few binary searches, and the index is saved to disk and loaded back as raw
+arrays, without any parsing or rebuilding.
+
+"""
+
+import os
+import sys
+import time
+import array
+import bisect
+import struct
+
+from version import Version
+from datastream import iter_elements
+
+# File types, as in the type attribute of <file>
+file_types = ['file', 'dir', 'ghost']
+
+#-------------------------------------------------------------------------------
+# FilePkg - a package, as identified in filelists.xml
+#-------------------------------------------------------------------------------
+
+class FilePkg():
+    __slots__ = ('pkgid', 'name', 'arch', 'version')
+
+    def __init__(self, pkgid, name, arch, version):
+        self.pkgid = pkgid
+        self.name = name
+        self.arch = arch
+        self.version = version
+
+    def __str__(self):
+        return f'{self.name}-{self.version.evr()}.{self.arch}'
+
+#-------------------------------------------------------------------------------
+# Binary file helpers
+#-------------------------------------------------------------------------------
+
+magic = b'PKGFIDX1'
+
+def write_strings(f, strings):
+    data = '\0'.join(strings).encode('utf-8')
+    f.write(struct.pack('<QQ', len(strings), len(data)))
+    f.write(data)
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise RuntimeError(f'{f.name}: truncated file index')
+    return data
+
+def read_strings(f):
+    n, size = struct.unpack('<QQ', read_exactly(f, 16))
+    if n == 0:
+        return []
+    return read_exactly(f, size).decode('utf-8').split('\0')
+
+def write_array(f, a):
+    f.write(struct.pack('<cQ', a.typecode.encode(), len(a)))
+    f.write(a.tobytes())
+
+def read_array(f):
+    typecode, n = struct.unpack('<cQ', read_exactly(f, 9))
+    a = array.array(typecode.decode())
+    a.frombytes(read_exactly(f, n * a.itemsize))
+    return a
+
+#-------------------------------------------------------------------------------
+# FileIndex -
+#-------------------------------------------------------------------------------
+
+class FileIndex():
+    def __init__(self):
+        # Packages, by position
+        self.pkgids = []
+        self.pkg_names = []
+        self.pkg_archs = []
+        self.pkg_evrs = []
+
+        # Sorted string table, for directory and file names
+        self.names = []
+
+        # Directory tree, sorted by key = parent << 32 | name id. Directory 0
+        # is the root.
+        self.dir_keys = array.array('Q')
+        self.dir_ids = array.array('I')
+
+        # Files, sorted by key = directory << 32 | name id
+        self.file_keys = array.array('Q')
+        self.file_pkgs = array.array('I')
+        self.file_types = array.array('B')
+
+    def __str__(self):
+        return (f'file index: {len(self.pkgids)} packages,'
+                + f' {len(self.file_keys)} files, {len(self.dir_ids)}'
+                + f' directories, {len(self.names)} names\n')
+
+    #---------------------------------------------------------------------------
+    # Parse filelists.xml
+    #---------------------------------------------------------------------------
+
+    @classmethod
+    def from_file(cls, filepath, ds=None):
+        """Return a FileIndex from a filelists.xml file.
+
+        The file is parsed incrementally, and may be compressed; if the repomd
+        DataSet is given, its checksums and sizes are verified on the same
+        pass (see datastream.py).
+        """
+        fi = cls()
+        name_ids = {}
+        dirs = {}
+
+        def name_id(s):
+            i = name_ids.get(s)
+            if i is None:
+                i = name_ids[s] = len(name_ids)
+            return i
+
+        def dir_id(path):
+            d = dirs.get(path)
+            if d is None:
+                parent, _, name = path.rpartition('/')
+                d = dirs[path] = len(dirs)
+                fi.dir_keys.append(dir_id(parent) << 32 | name_id(name))
+                fi.dir_ids.append(d)
+            return d
+        # The root directory, '/' split into '' and ''
+        dirs[''] = 0
+
+        for nd in iter_elements(filepath, 'package', ds):
+            pkg = len(fi.pkgids)
+            fi.pkgids.append(nd.attrib['pkgid'])
+            fi.pkg_names.append(nd.attrib['name'])
+            fi.pkg_archs.append(sys.intern(nd.attrib['arch']))
+            for k in nd:
+                if k.tag.endswith('}version'):
+                    v = Version(k.attrib.get('epoch'), k.attrib.get('ver'),
+                                k.attrib.get('rel'))
+                    fi.pkg_evrs.append(v.evr())
+                elif k.tag.endswith('}file') and k.text:
+                    dirpath, _, name = k.text.rpartition('/')
+                    type = file_types.index(k.attrib.get('type', 'file'))
+                    fi.file_keys.append(dir_id(dirpath) << 32 | name_id(name))
+                    fi.file_pkgs.append(pkg)
+                    fi.file_types.append(type)
+            if len(fi.pkg_evrs) < len(fi.pkgids):
+                fi.pkg_evrs.append('')
+
+        fi.finalize(name_ids)
+        return fi
+
+    def finalize(self, name_ids):
+        """Sort the names, then the directory and file keys."""
+        self.names = sorted(name_ids)
+        remap = array.array('I', bytes(4 * len(name_ids)))
+        for i, s in enumerate(self.names):
+            remap[name_ids[s]] = i
+
+        def rekey(key):
+            return key & ~0xffffffff | remap[key & 0xffffffff]
+
+        dirs = sorted(zip(map(rekey, self.dir_keys), self.dir_ids))
+        self.dir_keys = array.array('Q', [k for k, _ in dirs])
+        self.dir_ids = array.array('I', [d for _, d in dirs])
+
+        # Sort the parallel arrays through a permutation, a list of tuples for
+        # millions of files would take several times more memory.
+        keys = array.array('Q', map(rekey, self.file_keys))
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.file_keys = array.array('Q', (keys[i] for i in order))
+        self.file_pkgs = array.array('I', (self.file_pkgs[i] for i in order))
+        self.file_types = array.array('B', (self.file_types[i] for i in order))
+
+    #---------------------------------------------------------------------------
+    # Lookups
+    #---------------------------------------------------------------------------
+
+    def name_id(self, s):
+        i = bisect.bisect_left(self.names, s)
+        if i < len(self.names) and self.names[i] == s:
+            return i
+        return None
+
+    def dir_id(self, path):
+        """Return the id of a directory, or None."""
+        d = 0
+        for s in path.strip('/').split('/'):
+            if not s:
+                continue
+            n = self.name_id(s)
+            if n is None:
+                return None
+            key = d << 32 | n
+            i = bisect.bisect_left(self.dir_keys, key)
+            if i == len(self.dir_keys) or self.dir_keys[i] != key:
+                return None
+            d = self.dir_ids[i]
+        return d
+
+    def pkg(self, i):
+        epoch, _, vr = self.pkg_evrs[i].rpartition(':')
+        ver, _, rel = vr.partition('-')
+        return FilePkg(self.pkgids[i], self.pkg_names[i], self.pkg_archs[i],
+                       Version(epoch or '0', ver, rel))
+
+    def find(self, path):
+        """Return the list of FilePkg that ship path (a file or directory)."""
+        dirpath, _, name = path.rstrip('/').rpartition('/')
+        d = self.dir_id(dirpath)
+        n = self.name_id(name)
+        if d is None or n is None:
+            return []
+        key = d << 32 | n
+        i = bisect.bisect_left(self.file_keys, key)
+        j = bisect.bisect_right(self.file_keys, key, lo=i)
+        return [self.pkg(p) for p in self.file_pkgs[i:j]]
+
+    def find_many(self, paths):
+        """Return a dictionary with the list of FilePkg for each path."""
+        return {p: self.find(p) for p in paths}
+
+    #---------------------------------------------------------------------------
+    # Binary save/load
+    #---------------------------------------------------------------------------
+
+    def save(self, filepath):
+        """Write the index to filepath, atomically."""
+        dirpath, filename = os.path.split(os.path.abspath(filepath))
+        tmp_path = os.path.join(dirpath, f'.tmp-{filename}.{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            f.write(magic)
+            for strings in [self.pkgids, self.pkg_names, self.pkg_archs,
+                            self.pkg_evrs, self.names]:
+                write_strings(f, strings)
+            for a in [self.dir_keys, self.dir_ids, self.file_keys,
+                      self.file_pkgs, self.file_types]:
+                write_array(f, a)
+        os.replace(tmp_path, filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """Return a FileIndex from a file written by save()."""
+        fi = cls()
+        with open(filepath, 'rb') as f:
+            if f.read(len(magic)) != magic:
+                raise RuntimeError(f'{filepath}: not a file index')
+            (fi.pkgids, fi.pkg_names, fi.pkg_archs, fi.pkg_evrs,
+             fi.names) = [read_strings(f) for i in range(5)]
+            (fi.dir_keys, fi.dir_ids, fi.file_keys, fi.file_pkgs,
+             fi.file_types) = [read_array(f) for i in range(5)]
+        return fi
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'Usage: {sys.argv[0]} <filelists.xml[.gz]|index> <path>...')
+        exit(-1)
+    filepath = sys.argv[1]
+
+    t = time.perf_counter()
+    with open(filepath, 'rb') as f:
+        is_index = f.read(len(magic)) == magic
+    fi = FileIndex.load(filepath) if is_index else FileIndex.from_file(filepath)
+    print(f'{"Loaded" if is_index else "Parsed"} in'
+          + f' {time.perf_counter() - t:.2f}s: {fi}', end='')
+    for path in sys.argv[2:]:
+        owners = fi.find(path)
+        print(f'{path}: {", ".join(str(p) for p in owners) or "not found"}')
@@ -0,0 +1,120 @@
+# filelists_t.py
+
+import os
+import gzip
+import tempfile
+import unittest
+from filelists import FileIndex
+
+xml = b"""<?xml version="1.0" encoding="UTF-8"?>
+<filelists xmlns="http://linux.duke.edu/metadata/filelists" packages="3">
+<package pkgid="aaa" name="bash" arch="x86_64">
+  <version epoch="0" ver="5.1" rel="2.fc34"/>
+  <file>/usr/bin/bash</file>
+  <file>/usr/bin/sh</file>
+  <file type="dir">/usr/share/doc/bash</file>
+  <file>/usr/share/doc/bash/README</file>
+</package>
+<package pkgid="bbb" name="zsh" arch="x86_64">
+  <version epoch="1" ver="5.8" rel="1.fc34"/>
+  <file>/usr/bin/zsh</file>
+  <file type="dir">/usr/share/doc</file>
+  <file type="ghost">/etc/zshrc</file>
+</package>
+<package pkgid="ccc" name="filesystem" arch="noarch">
+  <version epoch="0" ver="3.14" rel="1"/>
+  <file type="dir">/usr/bin</file>
+  <file type="dir">/usr/share/doc</file>
+  <file>/bin</file>
+</package>
+</filelists>
+"""
+
+# -----------------------------------------------------------------------------
+# FileIndexTest
+# -----------------------------------------------------------------------------
+
+class FileIndexTest(unittest.TestCase):
+    """Test parsing, lookups, and save/load."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp.name, 'filelists.xml.gz')
+        with open(self.filepath, 'wb') as f:
+            f.write(gzip.compress(xml))
+        self.fi = FileIndex.from_file(self.filepath)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def owners(self, fi, path):
+        return sorted(str(p) for p in fi.find(path))
+
+    def check(self, fi):
+        self.assertEqual(['bash-5.1-2.fc34.x86_64'],
+                         self.owners(fi, '/usr/bin/bash'))
+        self.assertEqual(['zsh-1:5.8-1.fc34.x86_64'],
+                         self.owners(fi, '/etc/zshrc'))
+        self.assertEqual(['filesystem-3.14-1.noarch', 'zsh-1:5.8-1.fc34.x86_64'],
+                         self.owners(fi, '/usr/share/doc/'))
+        self.assertEqual(['filesystem-3.14-1.noarch'], self.owners(fi, '/bin'))
+        self.assertEqual(['filesystem-3.14-1.noarch'],
+                         self.owners(fi, '/usr/bin'))
+        for path in ['/usr/bin/fish', '/usr/lib/bash', '/nowhere/bash', '/',
+                     '/usr/share']:
+            self.assertEqual([], fi.find(path))
+
+        p = fi.find('/usr/bin/zsh')[0]
+        self.assertEqual(('bbb', 'zsh', 'x86_64'), (p.pkgid, p.name, p.arch))
+        self.assertEqual(('1', '5.8', '1.fc34'),
+                         (p.version.epoch, p.version.ver, p.version.rel))
+        d = fi.find_many(['/usr/bin/sh', '/usr/bin/ksh'])
+        self.assertEqual([1, 0], [len(d['/usr/bin/sh']), len(d['/usr/bin/ksh'])])
+
+    def test_find(self):
+        """Lookups of files and directories"""
+        self.assertEqual(3, len(self.fi.pkgids))
+        self.assertEqual(10, len(self.fi.file_keys))
+        self.assertEqual(sorted(self.fi.names), self.fi.names)
+        self.check(self.fi)
+
+    def test_save_load(self):
+        """The loaded index answers the same, from the same arrays"""
+        path = os.path.join(self.tmp.name, 'filelists.idx')
+        self.fi.save(path)
+        self.assertEqual(['filelists.idx', 'filelists.xml.gz'],
+                         sorted(os.listdir(self.tmp.name)))
+        fi = FileIndex.load(path)
+        for attr in ['pkgids', 'pkg_names', 'pkg_archs', 'pkg_evrs', 'names',
+                     'dir_keys', 'dir_ids', 'file_keys', 'file_pkgs',
+                     'file_types']:
+            self.assertEqual(getattr(self.fi, attr), getattr(fi, attr), attr)
+        self.check(fi)
+
+    def test_load_errors(self):
+        """Not an index, or a truncated one"""
+        with self.assertRaises(RuntimeError):
+            FileIndex.load(self.filepath)
+        path = os.path.join(self.tmp.name, 'filelists.idx')
+        self.fi.save(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:-5])
+        with self.assertRaises(RuntimeError):
+            FileIndex.load(path)
+
+    def test_empty(self):
+        """An index with no packages"""
+        path = os.path.join(self.tmp.name, 'empty.xml')
+        with open(path, 'wb') as f:
+            f.write(b'<filelists packages="0"/>')
+        fi = FileIndex.from_file(path)
+        idx = os.path.join(self.tmp.name, 'empty.idx')
+        fi.save(idx)
+        fi = FileIndex.load(idx)
+        self.assertEqual([], fi.pkgids)
+        self.assertEqual([], fi.find('/usr/bin/bash'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,204 @@
 # checksum.py - verify checksums
 
+import os
 import sys
+import json
+import mmap
+import atexit
 import hashlib
-            
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: concurrent saves of the verification cache
+    # may lose entries, which are then computed again.
+    fcntl = None
+
+# Size of the blocks handed to the hash functions
+block_size = 1024*1024
+
+# Above this size, when several algorithms are needed, each one runs in its own
+# thread (hashlib releases the GIL while hashing large buffers).
+thread_threshold = 16*1024*1024
+
+#-------------------------------------------------------------------------------
+# multi_hash - compute several digests with a single read of the file
+#-------------------------------------------------------------------------------
+
+def hash_buffer(type, buf):
+    sh = hashlib.new(type)
+    for i in range(0, len(buf), block_size):
+        with buf[i:i + block_size] as block:
+            sh.update(block)
+    return sh.hexdigest()
+
+def multi_hash(types, filepath, force=False):
+    """Return a dictionary with the hex digest of filepath for each type.
+
+    The file is mapped in memory and read only once, all the hashers being
+    fed from the same pages. If the verification cache is enabled, digests of
+    unchanged files come from the cache, unless force is True.
+    """
+    types = list(dict.fromkeys(types))
+    if verify_cache is None:
+        return compute_hashes(types, filepath)
+
+    st = os.stat(filepath)
+    digests = {} if force else verify_cache.lookup(filepath, st, types)
+    missing = [t for t in types if t not in digests]
+    if missing:
+        digests.update(compute_hashes(missing, filepath))
+        # Don't record digests of a file that changed while we were reading
+        if stat_key(os.stat(filepath)) == stat_key(st):
+            verify_cache.store(filepath, st, digests)
+    return digests
+
+def compute_hashes(types, filepath):
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return {t: hashlib.new(t).hexdigest() for t in types}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buf = memoryview(mm)
+            try:
+                if len(types) > 1 and size >= thread_threshold:
+                    with ThreadPoolExecutor(max_workers=len(types)) as ex:
+                        digests = ex.map(lambda t: hash_buffer(t, buf), types)
+                        return dict(zip(types, digests))
+
+                hashers = [hashlib.new(t) for t in types]
+                for i in range(0, size, block_size):
+                    with buf[i:i + block_size] as block:
+                        for sh in hashers:
+                            sh.update(block)
+                return {t: sh.hexdigest() for t, sh in zip(types, hashers)}
+            finally:
+                buf.release()
+
+def check_many(checksums, filepath, force=False):
+    """Verify several checksums of a file, reading it once.
+
+    Return a dictionary with True or False for each checksum type.
+    """
+    digests = multi_hash([c.type for c in checksums], filepath, force)
+    return {c.type: digests[c.type] == c.value for c in checksums}
+
+#-------------------------------------------------------------------------------
+# VerifyCache - persistent cache of file digests
+#-------------------------------------------------------------------------------
+
+def stat_key(st):
+    return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+class VerifyCache():
+    """Digests of files that have already been hashed.
+
+    An entry is only valid for the same (device, inode, size, mtime_ns) as
+    when the file was hashed, so a file that was modified or replaced is
+    hashed again. The entries are kept in a json file, written out by save()
+    and when the program exits. Several processes may share the file: save()
+    merges the entries stored since the last save into its current contents.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.hits = 0
+        self.misses = 0
+        # Paths stored since the last save
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __str__(self):
+        return (f'verify cache: {self.filepath}, {len(self.entries)} files,'
+                + f' hits={self.hits}, misses={self.misses}\n')
+
+    def lookup(self, filepath, st, types):
+        """Return the cached digests of filepath, for the types we have."""
+        path = os.path.realpath(filepath)
+        with self.lock:
+            e = self.entries.get(path)
+            if e is None or e['stat'] != stat_key(st):
+                self.misses += 1
+                return {}
+            digests = {t: e['digests'][t] for t in types if t in e['digests']}
+            if len(digests) == len(types):
+                self.hits += 1
+            else:
+                self.misses += 1
+            return digests
+
+    def store(self, filepath, st, digests):
+        path = os.path.realpath(filepath)
+        with self.lock:
+            e = self.entries.get(path)
+            if e is None or e['stat'] != stat_key(st):
+                e = self.entries[path] = {'stat': stat_key(st), 'digests': {}}
+            e['digests'].update(digests)
+            self.changed.add(path)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            # Serialize the read-merge-write with the other processes
+            with open(f'{self.filepath}.lock', 'a') as lock:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                entries = self.load()
+                for path in self.changed:
+                    entries[path] = self.entries[path]
+                tmp_path = f'{self.filepath}.{os.getpid()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(json.dumps(entries))
+                os.replace(tmp_path, self.filepath)
+            self.entries = entries
+            self.changed = set()
+
+# The verification cache is opt-in: call enable_cache(), or set the
+# PKG_VERIFY_CACHE environment variable to the path of the cache file.
+verify_cache = None
+
+def save_cache():
+    if verify_cache:
+        verify_cache.save()
+
+atexit.register(save_cache)
+
+def enable_cache(filepath):
+    """Start caching digests in filepath, return the VerifyCache instance."""
+    global verify_cache
+    disable_cache()
+    verify_cache = VerifyCache(filepath)
+    return verify_cache
+
+def disable_cache():
+    global verify_cache
+    if verify_cache:
+        verify_cache.save()
+    verify_cache = None
+
+if os.environ.get('PKG_VERIFY_CACHE'):
+    enable_cache(os.environ['PKG_VERIFY_CACHE'])
+
 #-------------------------------------------------------------------------------
 # Checksum - 
 #-------------------------------------------------------------------------------
 
 class Checksum():
+    __slots__ = ('type', 'pkgid', 'value')
+
     def __init__(self, type, value=None, pkgid=None):
-        self.type = type
-        self.pkgid = pkgid
+        self.type = sys.intern(type)
+        self.pkgid = sys.intern(pkgid) if pkgid else pkgid
         self.value = value
    
     #---------------------------------------------------------------------------
@@ -21,7 +209,8 @@ class Checksum():
         """Create a json-encodable object representing this object."""
         # print('  Checksum: to_json_encodable')
         d = {}
-        for k, v in self.__dict__.items():
+        for k in self.__slots__:
+            v = getattr(self, k)
             if not (v is None or v == '' or v == [] or v == {}):
                 d[k] = v
         return d
@@ -46,22 +235,15 @@ class Checksum():
     def csv_header(cls):
         return f'type\tpkgid\tvalue'
 
-    def check(self, filepath):
-        sh = hashlib.__dict__[self.type]()
-        with open(filepath, 'rb') as f:
-            for data in iter(lambda: f.read(4096), b''):
-                sh.update(data)
+    def check(self, filepath, force=False):
+        digest = multi_hash([self.type], filepath, force)[self.type]
         # print(f'Checksum: expected={self.value}')
-        # print(f'Checksum:   actual={sh.hexdigest()}')
+        # print(f'Checksum:   actual={digest}')
 
-        return self.value == sh.hexdigest()
+        return self.value == digest
 
-    def get_hash(self, filepath):
-        sh = hashlib.__dict__[self.type]()
-        with open(filepath, 'rb') as f:
-            for data in iter(lambda: f.read(4096), b''):
-                sh.update(data)
-        self.value = sh.hexdigest()
+    def get_hash(self, filepath, force=False):
+        self.value = multi_hash([self.type], filepath, force)[self.type]
         return self.value
 
 #===============================================================================
@@ -84,13 +266,15 @@ if __name__ == '__main__':
     # print(f'checksum: {"ok" if c.check(filepath) else "NOK"}')
 
     if len(sys.argv) != 3:
-        print(f'Usage: {sys.argv[0]} <type> <filepath>')
+        print(f'Usage: {sys.argv[0]} <type>[,<type>...] <filepath>')
         print('Supported types include md5, sha1, sha256, sha512. See python hashlib doc')
         print('for the complete list of supported types.')
         exit(-1)
-    type = sys.argv[1]
+    types = sys.argv[1].split(',')
     filepath = sys.argv[2]
 
-    c = Checksum(type)
-    print(f'checksum: {c.get_hash(filepath)}')
+    for type, digest in multi_hash(types, filepath).items():
+        print(f'{type}: {digest}')
+    if verify_cache:
+        print(verify_cache, end='')
 
@@ -0,0 +1,291 @@
+# download.py - download files, verifying them while they're being written
+
+"""The data is streamed to a temporary file in the destination directory, and
+every expected checksum is computed on the fly. The file only gets its final
+name, atomically, once its size and checksums have been verified: there's a
+single pass over the data, memory use doesn't depend on the file size, and a
+file with the final name is always a complete and verified one.
+
+This module is shared by the LFS and the repository code, so it only depends
+on the standard library, requests and checksum.py. Expected checksums are
+given as objects with 'type' (a hashlib algorithm name) and 'value' (hex
+digest) attributes, such as Checksum instances.
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+from urllib.parse import urlparse
+
+# Imported as lfs.download by the repository code
+try:
+    from checksum import compute_hashes
+except ImportError:
+    from lfs.checksum import compute_hashes
+
+chunk_size = 256*1024
+
+# HTTP (connect, read) timeouts in seconds, for all the requests made by this
+# package: a stalled server raises an exception instead of blocking forever.
+timeout = (10, 30)
+
+#-------------------------------------------------------------------------------
+# save_chunks - write out data, verify it, and move it into place
+#-------------------------------------------------------------------------------
+
+def save_chunks(chunks, filepath, hashes=(), size=None, name=None):
+    """Write the data from an iterable of bytes to filepath.
+
+    Return a dictionary with the hex digest for each type in hashes. Raise a
+    RuntimeError, leaving filepath untouched, if the size or a checksum
+    doesn't match.
+    """
+    name = name or filepath
+    hashers = {h.type: hashlib.new(h.type) for h in hashes}
+    dirpath = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.tmp-')
+    try:
+        n = 0
+        with os.fdopen(fd, 'wb') as f:
+            for data in chunks:
+                n += len(data)
+                for sh in hashers.values():
+                    sh.update(data)
+                f.write(data)
+
+        if size is not None and n != size:
+            raise RuntimeError(f'{name}: size {n}, expected {size}')
+        digests = {t: sh.hexdigest() for t, sh in hashers.items()}
+        for h in hashes:
+            if h.value and digests[h.type] != h.value:
+                raise RuntimeError(f'{name}: {h.type} checksum mismatch')
+
+        os.replace(tmp_path, filepath)
+        tmp_path = None
+        return digests
+    finally:
+        # Also on KeyboardInterrupt
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+#-------------------------------------------------------------------------------
+# save_response - save the body of a (streamed) requests response
+#-------------------------------------------------------------------------------
+
+def save_response(response, filepath, hashes=(), size=None):
+    """Save a response obtained with stream=True, see save_chunks()."""
+    response.raise_for_status()
+    return save_chunks(response.iter_content(chunk_size=chunk_size), filepath,
+                       hashes, size, name=response.url)
+
+#-------------------------------------------------------------------------------
+# download - get a file over http(s) or ftp
+#-------------------------------------------------------------------------------
+
+def download(url, filepath, hashes=(), size=None, session=None):
+    """Download url to filepath, verifying its size and checksums.
+
+    See save_chunks() for the return value and errors.
+    """
+    p = urlparse(url)
+    if p.scheme in ['http', 'https']:
+        http = session or requests
+        response = http.get(url, stream=True, timeout=timeout)
+        return save_response(response, filepath, hashes, size)
+    elif p.scheme == 'ftp':
+        with urlopen(url, timeout=timeout[1]) as f:
+            return save_chunks(iter(lambda: f.read(chunk_size), b''), filepath,
+                               hashes, size, name=url)
+    raise RuntimeError(f'Unsupported scheme "{p.scheme}"')
+
+#-------------------------------------------------------------------------------
+# download_segmented - parallel ranged download, from several mirrors
+#-------------------------------------------------------------------------------
+
+# Files are split into segments of this size, files smaller than the threshold
+# are not worth splitting.
+segment_size = 8*1024*1024
+segment_threshold = 32*1024*1024
+
+def part_paths(filepath):
+    """Return the paths of the partial file, and of its progress record."""
+    dirpath, filename = os.path.split(os.path.abspath(filepath))
+    part_path = os.path.join(dirpath, f'.tmp-{filename}.part')
+    return part_path, part_path + '.json'
+
+def remote_size(url, session=None):
+    """Return the size of url if the server accepts range requests, or None."""
+    http = session or requests
+    response = http.head(url, allow_redirects=True, timeout=timeout)
+    if not response.ok:
+        # Some servers don't answer HEAD requests, a plain GET may still work
+        return None
+    if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+    length = response.headers.get('Content-Length')
+    return int(length) if length else None
+
+class SegmentedDownload():
+    """Download one file as HTTP Range segments, from one or several mirrors.
+
+    The segments are fetched in parallel, each worker starting on a different
+    mirror and moving on to the next one if a request fails. The data goes
+    into a partial file, and the segments that are complete are recorded
+    next to it, with the mirror each one came from, so an interrupted download
+    resumes where it stopped, and only the segments that failed are fetched
+    again.
+    """
+    def __init__(self, urls, filepath, size, hashes=(), session=None):
+        self.urls = urls
+        self.filepath = filepath
+        self.size = size
+        self.hashes = hashes
+        self.session = session or requests
+        self.part_path, self.state_path = part_paths(filepath)
+        self.lock = threading.Lock()
+        # Segment index -> URL it was fetched from
+        self.done = {}
+
+    def segments(self):
+        return [(i, start, min(start + segment_size, self.size) - 1)
+                for i, start in enumerate(range(0, self.size, segment_size))]
+
+    def load_state(self):
+        """Resume a previous download of the same file, if there's one."""
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if (state['size'] == self.size
+                    and state['segment_size'] == segment_size
+                    and os.stat(self.part_path).st_size == self.size):
+                self.done = {int(i): url for i, url in state['done'].items()}
+                return
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        self.done = {}
+        with open(self.part_path, 'wb') as f:
+            f.truncate(self.size)
+        self.save_state()
+
+    def save_state(self):
+        state = dict(size=self.size, segment_size=segment_size,
+                     done=self.done)
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(state))
+        os.replace(tmp_path, self.state_path)
+
+    def fetch_segment(self, seg):
+        i, start, end = seg
+        errors = []
+        # Spread the segments over the mirrors
+        for k in range(len(self.urls)):
+            url = self.urls[(i + k) % len(self.urls)]
+            try:
+                response = self.session.get(url, stream=True, timeout=timeout,
+                                            headers={'Range': f'bytes={start}-{end}'})
+                response.raise_for_status()
+                if (response.status_code != 206 or not response.headers.get(
+                        'Content-Range', '').startswith(f'bytes {start}-{end}/')):
+                    raise RuntimeError(f'{url}: range requests not supported')
+                n = 0
+                with open(self.part_path, 'r+b') as f:
+                    f.seek(start)
+                    for data in response.iter_content(chunk_size=chunk_size):
+                        n += len(data)
+                        if n > end - start + 1:
+                            raise RuntimeError(f'{url}: segment too long')
+                        f.write(data)
+                if n != end - start + 1:
+                    raise RuntimeError(f'{url}: short segment')
+            except (requests.RequestException, RuntimeError) as e:
+                errors.append(e)
+                continue
+            with self.lock:
+                self.done[i] = url
+                self.save_state()
+            return None
+        return errors
+
+    def run(self, jobs=4):
+        """Download the file, return a dictionary of hex digests.
+
+        Raise a RuntimeError if some segments couldn't be retrieved (the
+        download may be resumed later), or if the file doesn't match the
+        expected checksums. The partial file is then discarded, and the error
+        tells which byte ranges came from which mirror.
+        """
+        self.load_state()
+        todo = [seg for seg in self.segments() if seg[0] not in self.done]
+        with ThreadPoolExecutor(max_workers=jobs) as ex:
+            errors = [e for e in ex.map(self.fetch_segment, todo) if e]
+        if errors:
+            raise RuntimeError(f'{self.filepath}: {len(errors)} segments failed,'
+                               + f' first error: {errors[0][-1]}')
+
+        # Verify the whole file in place before giving it its final name. The
+        # digests aren't looked up or stored in the verification cache, this
+        # is a temporary file.
+        digests = compute_hashes([h.type for h in self.hashes], self.part_path)
+        bad = [h.type for h in self.hashes
+               if h.value and digests[h.type] != h.value]
+        if bad:
+            sources = self.sources()
+            self.discard()
+            raise RuntimeError(f'{self.filepath}: {bad[0]} checksum mismatch,'
+                               + f' segments from {sources}')
+        os.replace(self.part_path, self.filepath)
+        self.discard()
+        return digests
+
+    def sources(self):
+        """Describe the byte ranges fetched from each mirror."""
+        ranges = {}
+        for i, start, end in self.segments():
+            ranges.setdefault(self.done.get(i), []).append(f'{start}-{end}')
+        return '; '.join(f'{url}: {",".join(r)}' for url, r in ranges.items())
+
+    def discard(self):
+        for path in [self.part_path, self.state_path]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def download_segmented(urls, filepath, hashes=(), size=None, jobs=4,
+                       session=None, approx_size=None):
+    """Download a file from a list of mirrors, in parallel segments.
+
+    The size is asked to the first mirror if it's not given. approx_size is a
+    size that isn't exact enough to be verified (e.g. rounded to kilobytes):
+    if it's below the threshold, the file is downloaded right away, without
+    asking. Small files, and servers that don't support range requests, get a
+    plain download() from the first mirror. Return a dictionary of hex
+    digests, see SegmentedDownload.run() for the errors.
+    """
+    if isinstance(urls, str):
+        urls = [urls]
+    http_urls = [u for u in urls if urlparse(u).scheme in ['http', 'https']]
+    if not http_urls:
+        return download(urls[0], filepath, hashes, size, session)
+    length = size
+    if size is None and approx_size is not None:
+        length = approx_size
+    if length is None or length >= segment_threshold:
+        length = remote_size(http_urls[0], session)
+        if size is not None and length != size:
+            # No range support, or not the file we expect
+            length = None
+    if length is None or length < segment_threshold:
+        return download(http_urls[0], filepath, hashes, size, session)
+    return SegmentedDownload(http_urls, filepath, length, hashes,
+                             session).run(jobs)
+
+if __name__ == '__main__':
+    print("""This module is not meant to run directly.""")
@@ -4,13 +4,15 @@ import os
 import re
 import sys
 import json
+import time
 import tarfile
 import requests
-from urllib.request import urlopen
-from urllib.parse import urlparse
 from subprocess import run, PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import common
+from checksum import Checksum
+from download import download_segmented
 
 #-------------------------------------------------------------------------------
 # Pkg - 
@@ -60,23 +62,22 @@ class Pkg():
         filepath = os.path.join(path, self.filename)
         if os.path.isfile(filepath):
             print(f'Already have: "{self.url}"')
-        else:
-            print(f'Retrieving: "{self.url}"')
-            p = urlparse(self.url)
-            if p.scheme in ['http', 'https']:
-                response = requests.get(self.url)
-                data = response.content
-            elif p.scheme == 'ftp':
-                with urlopen(self.url) as f:
-                    data = f.read()
-            else:
-                print(f'Unsupported scheme "{p.scheme}"')
-                return
-            with open(filepath, 'wb') as f:
-                f.write(data)
-
-        # Verify the checksum
-        print(f'Checksum: {"ok" if self.md5.check(filepath) else "NOK"}')
+            # Verify the checksum
+            print(f'Checksum: {"ok" if self.md5.check(filepath) else "NOK"}')
+            return
+
+        # The checksum is verified while downloading, the file only gets its
+        # name if it's correct. Large files are retrieved in parallel segments,
+        # and an interrupted download resumes. The book gives the size in
+        # kilobytes, enough to tell if it's worth splitting the file.
+        print(f'Retrieving: "{self.url}"')
+        try:
+            download_segmented(self.url, filepath, [self.md5],
+                               approx_size=self.size and self.size*1024)
+        except (requests.RequestException, OSError, RuntimeError) as e:
+            print(f'Checksum: NOK ({e})')
+            return
+        print(f'Checksum: ok')
 
 #-------------------------------------------------------------------------------
 # Global functions
@@ -159,21 +160,16 @@ def get_all(version, pkgs_path):
     # Ensure we have the list of md5 checksums and verify them
     get_lfs_file(version, 'md5sums')
     print('Verifying all checksums')
-    # md5sums is the reason why we need to be inside this dir
-    r = run(['md5sum', '-c', 'md5sums'], stdout=PIPE, stderr=STDOUT)
-    if r.returncode != 0:
-        print(f'md5sum returned: {r.returncode}')
-
-    # Checking results
-    cnt = 0
-    for line in r.stdout.decode().split('\n'):
-        line = line.strip()
-        if len(line) == 0:
-            continue
-        if not line.endswith(': OK'):
-            cnt += 1
-            print(f'error: line="{line}", len={len(line)}')
-    if cnt:
+    results = verify_all(pkgs_path)
+    failed = [x for x in results if x.status != 'ok']
+    if failed:
+        # Get the files that failed again, and only those
+        for x in failed:
+            print(f'error: {x}')
+        failed = refetch(pkgs_path, failed)
+    if failed:
+        for x in failed:
+            print(f'error: {x}')
         print('Checksum verification failed, exiting')
         exit()
 
@@ -182,6 +178,110 @@ def get_all(version, pkgs_path):
     # Move back to the original directory
     os.chdir(curr_dir)
 
+#-------------------------------------------------------------------------------
+# Verification of the package directory
+#-------------------------------------------------------------------------------
+
+class VerifyResult():
+    def __init__(self, filename, status, expected, size=0):
+        self.filename = filename
+        # 'ok', 'failed', 'missing' or 'error' (the file couldn't be read)
+        self.status = status
+        self.expected = expected
+        self.size = size
+
+    def __str__(self):
+        return f'{self.filename}: {self.status}'
+
+def read_md5sums(filepath):
+    """Return a list of (md5, filename) tuples from an md5sums file."""
+    l = []
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            md5, filename = line.split(maxsplit=1)
+            # md5sum's binary mode marker
+            l.append((md5, filename.lstrip('*')))
+    return l
+
+def read_wget_list(filepath):
+    """Return a dictionary mapping file names to urls from a wget-list file."""
+    d = {}
+    with open(filepath, 'r') as f:
+        for line in f:
+            url = line.strip()
+            if len(url) > 0:
+                d[url.rsplit('/', maxsplit=1)[1]] = url
+    return d
+
+def verify_one(pkgs_path, md5, filename):
+    filepath = os.path.join(pkgs_path, filename)
+    if not os.path.isfile(filepath):
+        return VerifyResult(filename, 'missing', md5)
+    try:
+        size = os.stat(filepath).st_size
+        ok = Checksum('md5', md5).check(filepath)
+    except OSError:
+        # Unreadable, or removed meanwhile: one file mustn't stop the others
+        return VerifyResult(filename, 'error', md5)
+    return VerifyResult(filename, 'ok' if ok else 'failed', md5, size)
+
+def verify_all(pkgs_path, entries=None, jobs=None):
+    """Verify the files listed in md5sums, return a list of VerifyResult.
+
+    The files are hashed in a thread pool (hashlib releases the GIL), and the
+    progress is shown as they complete. entries is a list of (md5, filename),
+    it defaults to the contents of the md5sums file.
+    """
+    if entries is None:
+        entries = read_md5sums(os.path.join(pkgs_path, 'md5sums'))
+    total = 0
+    for _, filename in entries:
+        filepath = os.path.join(pkgs_path, filename)
+        if os.path.isfile(filepath):
+            total += os.stat(filepath).st_size
+
+    results = []
+    done = 0
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as ex:
+        futures = [ex.submit(verify_one, pkgs_path, md5, filename)
+                   for md5, filename in entries]
+        for f in as_completed(futures):
+            x = f.result()
+            results.append(x)
+            done += x.size
+            elapsed = time.perf_counter() - t
+            eta = elapsed * (total - done) / done if done else 0
+            print(f'\r{len(results)}/{len(entries)} files,'
+                  + f' {100*done//max(total, 1)}% of {total//(1024*1024)} MB,'
+                  + f' ETA {eta:.0f}s   ', end='')
+    print()
+
+    results.sort(key=lambda x: x.filename)
+    return results
+
+def refetch(pkgs_path, failed):
+    """Download the failed files again, return those still failing."""
+    urls = read_wget_list(os.path.join(pkgs_path, 'wget-list'))
+    still_failed = []
+    for x in failed:
+        url = urls.get(x.filename)
+        if url is None:
+            print(f'{x.filename}: not found in wget-list')
+            still_failed.append(x)
+            continue
+        print(f'Retrieving: "{url}"')
+        try:
+            download_segmented(url, os.path.join(pkgs_path, x.filename),
+                               [Checksum('md5', x.expected)])
+        except (requests.RequestException, OSError, RuntimeError) as e:
+            print(f'{x.filename}: {e}')
+            still_failed.append(x)
+    return still_failed
+
 def wget_files(version, pkgs_path):
     """Ensure that we have all the correct packages for this version"""
 
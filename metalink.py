@@ -8,9 +8,19 @@ retrieve repomd.xml from it. There's a list of data types, retrieve primary.
 
 import os
 import re
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 from lfs.checksum import Checksum
 
+# Number of bytes requested from each mirror when probing
+probe_size = 64*1024
+
+# Transfer size used to turn a mirror's latency and throughput into a single
+# expected download time, when ranking the mirrors
+ref_size = 1024*1024
+
 #-------------------------------------------------------------------------------
 # Resource - 
 #-------------------------------------------------------------------------------
@@ -20,8 +30,60 @@ class Resource():
         self.protocol = protocol
         self.type = type
         self.location = location
-        self.preference = preference
+        # Mirrormanager's preference is a percentage, 100 being the best
+        self.preference = int(preference)
         self.url = url
+        # Measured by probe()
+        self.latency = None
+        self.throughput = None
+
+    def root_url(self):
+        """Return the repository's root URL on this mirror, or None."""
+        m = re.match(r'(.*)/repodata/repomd\.xml$', self.url)
+        return m.group(1) if m else None
+
+    def probe(self, timeout=5, session=None):
+        """Measure the mirror's latency and throughput with a ranged GET.
+
+        On failure, both stay None.
+        """
+        http = session or requests
+        self.latency = self.throughput = None
+        try:
+            t0 = time.perf_counter()
+            response = http.get(self.url, stream=True, timeout=timeout,
+                                headers={'Range': f'bytes=0-{probe_size - 1}'})
+            response.raise_for_status()
+            size = 0
+            t1 = None
+            for data in response.iter_content(chunk_size=16*1024):
+                if t1 is None:
+                    # Time to first byte
+                    t1 = time.perf_counter()
+                size += len(data)
+            t2 = time.perf_counter()
+        except requests.RequestException as e:
+            print(f'Probe failed: {self.url}: {e}')
+            return
+        if t1 is None:
+            t1 = t2
+        self.latency = t1 - t0
+        self.throughput = size / max(t2 - t1, 1e-3)
+
+    def score(self, location=None):
+        """Return the mirror's rank for probed mirrors, lower is better.
+
+        The expected time to download ref_size bytes is weighted by the
+        metalink's preference, and by the mirror being in the preferred
+        location, if any.
+        """
+        if self.latency is None:
+            return float('inf')
+        t = self.latency + ref_size / max(self.throughput, 1)
+        weight = max(self.preference, 1) / 100
+        if location and self.location and self.location.upper() == location.upper():
+            weight *= 1.5
+        return t / weight
 
     def to_csv(self):
         return (f'{self.protocol};{self.type};{self.location};{self.preference}'
@@ -117,11 +179,42 @@ class Metalink():
         root = etree.parse(filepath).getroot()
         return Metalink.parse_node(root)
 
+    def http_resources(self):
+        """Return the http(s) resources, by decreasing preference."""
+        return sorted([r for r in self.resources
+                       if r.protocol in ['http', 'https']],
+                      key=lambda x: -x.preference)
+
     def get_best_data_url(self):
-        r = sorted([r for r in self.resources
-                    if r.protocol in ['http', 'https']],
-                       key=lambda x: x.preference)[0]
-        return r.url
+        return self.http_resources()[0].url
+
+    def probe(self, n=5, timeout=5, session=None, location=None):
+        """Return the http(s) resources, the top n ranked by probing them.
+
+        The n most preferred mirrors are probed in parallel, and sorted by
+        their score (see Resource.score); mirrors failing the probe come last,
+        followed by the other, unprobed, resources. location is a country
+        code, it defaults to the PKG_LOCATION environment variable.
+        """
+        location = location or os.environ.get('PKG_LOCATION')
+        res = self.http_resources()
+        top, rest = res[:n], res[n:]
+        if top:
+            with ThreadPoolExecutor(max_workers=len(top)) as ex:
+                list(ex.map(lambda r: r.probe(timeout, session), top))
+        top.sort(key=lambda r: r.score(location))
+        return top + rest
+
+    def get_root_urls(self, probe=True, n=5, session=None, location=None):
+        """Return the repository root URLs, best mirror first."""
+        res = (self.probe(n, session=session, location=location) if probe
+               else self.http_resources())
+        urls = []
+        for r in res:
+            url = r.root_url()
+            if url and url not in urls:
+                urls.append(url)
+        return urls
 
 if __name__ == '__main__':
     print("""This module is not meant to run directly.""")
@@ -0,0 +1,328 @@
+#!/usr/bin/python
+# mirror.py - keep local mirrors of repositories up to date
+
+"""Each enabled repository of a directory of .repo files is mirrored into
+<mirror-dir>/<repo_id>, with its packages and its repodata.
+
+Only the difference with the previous run is transferred. A manifest in each
+mirror records the location, checksum and size of every package already
+there, so unchanged packages are recognized without reading them. A package
+that another mirrored repository already has (same checksum) is hard-linked
+instead of downloaded. The other packages are downloaded in parallel, and
+verified while they're being written (see lfs/download.py).
+
+The repodata files are installed once all the packages are there, with
+repomd.xml last, so the mirror is always consistent for its clients. A file
+whose content changes at the same location is written to a temporary name
+first, and only replaces the old one right before repomd.xml. Files that the
+new metadata doesn't reference anymore are only deleted after that.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from repo import Repo, parse_bool
+from repocache import RepoCache
+from lfs.download import download
+from runner import Unbuffered
+from sync import make_session
+
+manifest_name = '.mirror-manifest.json'
+
+#-------------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------------
+
+def local_path(dest, location):
+    """Return the path of location in dest, refusing to go outside of it."""
+    path = os.path.normpath(os.path.join(dest, location))
+    if os.path.isabs(location) or not path.startswith(os.path.join(dest, '')):
+        raise RuntimeError(f'Invalid location "{location}"')
+    return path
+
+def link_or_copy(src, dst, link=True):
+    """Hard-link src to dst, or copy it across file systems (or if link is
+    False), atomically."""
+    dirpath = os.path.dirname(dst)
+    os.makedirs(dirpath, exist_ok=True)
+    tmp_path = os.path.join(dirpath, f'.tmp-{os.path.basename(dst)}')
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+    linked = False
+    if link:
+        try:
+            os.link(src, tmp_path)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+def staging_path(path):
+    """Return the temporary name of a file replacing path."""
+    dirpath, filename = os.path.split(path)
+    return os.path.join(dirpath, f'.tmp-{filename}.new')
+
+def same_size(path, size):
+    try:
+        return os.stat(path).st_size == size
+    except FileNotFoundError:
+        return False
+
+#-------------------------------------------------------------------------------
+# Manifest - what a mirror holds, as of its last update
+#-------------------------------------------------------------------------------
+
+class Manifest():
+    def __init__(self, dest):
+        self.filepath = os.path.join(dest, manifest_name)
+        try:
+            with open(self.filepath, 'r') as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            d = {}
+        self.revision = d.get('revision')
+        # location -> [checksum type, checksum value, size]
+        self.packages = d.get('packages', {})
+        # Repodata file locations, repomd.xml excepted
+        self.repodata = d.get('repodata', [])
+
+    def save(self):
+        tmp_path = self.filepath + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'revision': self.revision,
+                                'packages': self.packages,
+                                'repodata': self.repodata}))
+        os.replace(tmp_path, self.filepath)
+
+#-------------------------------------------------------------------------------
+# MirrorResult - the outcome of mirroring one repository
+#-------------------------------------------------------------------------------
+
+class MirrorResult():
+    def __init__(self, repo):
+        self.repo = repo
+        self.unchanged = 0
+        self.linked = 0
+        self.downloaded = 0
+        self.bytes = 0
+        self.failed = []
+        self.deleted = 0
+        self.error = None
+        self.elapsed = 0
+
+    def __str__(self):
+        s = f'{self.repo.repo_id:<40} {self.elapsed:7.2f}s  '
+        if self.error:
+            skip = parse_bool(self.repo.skip_if_unavailable)
+            return s + f'{"skipped" if skip else "FAILED"}: {self.error}'
+        s += (f'{self.unchanged} unchanged, {self.linked} linked,'
+              + f' {self.downloaded} downloaded ({self.bytes} bytes),'
+              + f' {len(self.failed)} failed, {self.deleted} deleted')
+        return s
+
+#-------------------------------------------------------------------------------
+# Mirror -
+#-------------------------------------------------------------------------------
+
+class Mirror():
+    def __init__(self, dirpath, jobs=8, cache=None):
+        self.dirpath = dirpath
+        self.jobs = jobs
+        self.cache = cache or RepoCache()
+        self.session = make_session(jobs)
+        self.lock = threading.Lock()
+
+        # Checksum value -> path, for all the packages of all the mirrors,
+        # to hard-link packages shared between repositories.
+        self.by_checksum = {}
+        for d in os.listdir(dirpath) if os.path.isdir(dirpath) else []:
+            dest = os.path.join(dirpath, d)
+            for location, (_, value, _) in Manifest(dest).packages.items():
+                self.by_checksum[value] = os.path.join(dest, location)
+
+    def mirror_all(self, repos):
+        """Mirror all the enabled repositories, return a list of MirrorResult."""
+        results = []
+        for r in repos:
+            if parse_bool(r.enabled, default=True):
+                res = self.mirror_repo(r)
+                print(f'Done: {res}')
+                results.append(res)
+        return results
+
+    def mirror_repo(self, r):
+        """Update the mirror of one repository, never raise."""
+        t = time.perf_counter()
+        res = MirrorResult(r)
+        try:
+            self.update(r, res)
+        except (requests.RequestException, OSError, RuntimeError) as e:
+            res.error = e
+        res.elapsed = time.perf_counter() - t
+        return res
+
+    def update(self, r, res):
+        dest = os.path.abspath(os.path.join(self.dirpath, r.repo_id))
+        os.makedirs(dest, exist_ok=True)
+        manifest = Manifest(dest)
+
+        md = r.get_repomd(session=self.session)
+        if md is None:
+            raise RuntimeError('no metadata found')
+        if md.revision == manifest.revision and os.path.isfile(
+                os.path.join(dest, 'repodata', 'repomd.xml')):
+            print(f'{r.repo_id}: revision {md.revision} already mirrored')
+            res.unchanged = len(manifest.packages)
+            return
+        pl = md.get_pkg_lists(r.root_url, self.cache, self.session, r.mirrors)
+        if pl is None:
+            raise RuntimeError('no primary data set')
+
+        # Packages: compare with the manifest, then link or download. A
+        # package replacing another one at the same location is staged under
+        # a temporary name, see publish().
+        todo = []
+        packages = {}
+        # location -> (temporary path, path)
+        staged = {}
+        for p in pl.packages:
+            entry = [p.checksum.type, p.checksum.value, p.size.package]
+            packages[p.location] = entry
+            path = local_path(dest, p.location)
+            if (manifest.packages.get(p.location) == entry
+                    and same_size(path, p.size.package)):
+                res.unchanged += 1
+                continue
+            if os.path.exists(path):
+                staged[p.location] = (staging_path(path), path)
+            target = staged[p.location][0] if p.location in staged else path
+            src = self.by_checksum.get(p.checksum.value)
+            if src and src != path and same_size(src, p.size.package):
+                link_or_copy(src, target)
+                res.linked += 1
+                continue
+            todo.append((p, target))
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as ex:
+            futures = {ex.submit(self.get_pkg, r, target, p): p
+                       for p, target in todo}
+            for f in as_completed(futures):
+                p = futures[f]
+                try:
+                    f.result()
+                    res.downloaded += 1
+                    res.bytes += p.size.package
+                except (requests.RequestException, OSError, RuntimeError) as e:
+                    print(f'  {p.location}: {e}')
+                    res.failed.append(p)
+                    del packages[p.location]
+                    staged.pop(p.location, None)
+
+        # Record what we have, even if some packages failed: they'll be
+        # retried next time. The staged ones aren't in place yet.
+        old_packages = manifest.packages
+        manifest.packages = {**old_packages,
+                             **{l: e for l, e in packages.items()
+                                if l not in staged}}
+        manifest.save()
+        if res.failed:
+            raise RuntimeError(f'{len(res.failed)} packages failed, the'
+                               + ' metadata was not updated')
+
+        # Repodata, copied out of the cache: a link would share the file's
+        # times with the cache entry, which get() updates. Until repomd.xml is
+        # replaced, clients see the old metadata with the old packages, which
+        # are still there.
+        repodata = []
+        for ds in md.data_sets:
+            urls = [f'{u}/{ds.location}' for u in r.mirrors or [r.root_url]]
+            filepath = self.cache.fetch(ds, urls, self.session)
+            path = local_path(dest, ds.location)
+            if os.path.exists(path):
+                staged[ds.location] = (staging_path(path), path)
+                path = staged[ds.location][0]
+            link_or_copy(filepath, path, link=False)
+            repodata.append(ds.location)
+        self.publish(staged, packages)
+        link_or_copy(r.repomd_file(),
+                     os.path.join(dest, 'repodata', 'repomd.xml'), link=False)
+
+        # Now the stale files can go
+        stale = ([l for l in old_packages if l not in packages]
+                 + [l for l in manifest.repodata if l not in repodata])
+        for location in stale:
+            try:
+                os.remove(local_path(dest, location))
+                res.deleted += 1
+            except FileNotFoundError:
+                pass
+        manifest.packages = packages
+        manifest.repodata = repodata
+        manifest.revision = md.revision
+        manifest.save()
+
+    def publish(self, staged, packages):
+        """Move the staged files into place, right before repomd.xml.
+
+        The window during which the old repomd.xml refers to new files is
+        then only a few renames long.
+        """
+        for location, (tmp_path, path) in staged.items():
+            os.replace(tmp_path, path)
+            if location in packages:
+                with self.lock:
+                    self.by_checksum[packages[location][1]] = path
+
+    def get_pkg(self, r, path, p):
+        """Download one package to path, trying each mirror in turn."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        error = None
+        for root_url in r.mirrors or [r.root_url]:
+            try:
+                download(f'{root_url}/{p.location}', path, [p.checksum],
+                         p.size.package, self.session)
+                with self.lock:
+                    self.by_checksum[p.checksum.value] = path
+                return
+            except (requests.RequestException, RuntimeError) as e:
+                error = e
+        raise error
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    sys.stdout = Unbuffered(sys.stdout)
+
+    # Check cmd line args
+    if len(sys.argv) not in [3, 4]:
+        print(f'usage: {sys.argv[0]} <repos-dirpath> <mirror-dirpath> [<jobs>]')
+        exit(-1)
+    repos_path = sys.argv[1]
+    dirpath = sys.argv[2]
+    jobs = int(sys.argv[3]) if len(sys.argv) == 4 else 8
+
+    t = time.perf_counter()
+    os.makedirs(dirpath, exist_ok=True)
+    results = Mirror(dirpath, jobs).mirror_all(Repo.from_dir(repos_path))
+    print(f'\nMirrored {len(results)} repositories'
+          + f' in {time.perf_counter() - t:.2f}s:')
+    failed = 0
+    for res in sorted(results, key=lambda x: x.repo.repo_id):
+        print(res)
+        if res.error and not parse_bool(res.repo.skip_if_unavailable):
+            failed += 1
+    if failed:
+        exit(-1)
@@ -0,0 +1,188 @@
+# mirror_t.py
+
+import os
+import gzip
+import hashlib
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer
+from repo import Repo
+from repocache import RepoCache
+from mirror import Mirror, Manifest, local_path
+from repocache_t import QuietHandler
+
+def publish_repo(root, packages, revision):
+    """Write a repository with packages, a dictionary name -> contents."""
+    pkgs = []
+    for name, data in sorted(packages.items()):
+        location = f'Packages/{name[0]}/{name}-1.0-1.x86_64.rpm'
+        path = os.path.join(root, location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        pkgs.append(
+            f'<package type="rpm"><name>{name}</name><arch>x86_64</arch>'
+            + '<version epoch="0" ver="1.0" rel="1"/>'
+            + '<checksum type="sha256" pkgid="YES">'
+            + f'{hashlib.sha256(data).hexdigest()}</checksum>'
+            + '<summary/><description/><packager/><url/>'
+            + '<time file="1" build="1"/>'
+            + f'<size package="{len(data)}" installed="1" archive="1"/>'
+            + f'<location href="{location}"/></package>\n')
+    raw = ('<?xml version="1.0" encoding="UTF-8"?>\n<metadata'
+           + ' xmlns="http://linux.duke.edu/metadata/common"'
+           + f' packages="{len(pkgs)}">\n' + ''.join(pkgs)
+           + '</metadata>\n').encode()
+    data = gzip.compress(raw, mtime=0)
+    checksum = hashlib.sha256(data).hexdigest()
+    location = f'repodata/{checksum}-primary.xml.gz'
+    os.makedirs(os.path.join(root, 'repodata'), exist_ok=True)
+    with open(os.path.join(root, location), 'wb') as f:
+        f.write(data)
+    repomd_path = os.path.join(root, 'repodata', 'repomd.xml')
+    with open(repomd_path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<repomd'
+                + ' xmlns="http://linux.duke.edu/metadata/repo">'
+                + f'<revision>{revision}</revision><data type="primary">'
+                + f'<checksum type="sha256">{checksum}</checksum>'
+                + '<open-checksum type="sha256">'
+                + f'{hashlib.sha256(raw).hexdigest()}</open-checksum>'
+                + f'<location href="{location}"/><timestamp>1</timestamp>'
+                + f'<size>{len(data)}</size><open-size>{len(raw)}</open-size>'
+                + '</data></repomd>\n')
+    # Last-Modified has a one second resolution, make each revision newer
+    t = 1600000000 + revision
+    os.utime(repomd_path, (t, t))
+
+def contents(name, salt=''):
+    return f'{name}{salt}\n'.encode() * 1000
+
+# -----------------------------------------------------------------------------
+# MirrorTest
+# -----------------------------------------------------------------------------
+
+class MirrorTest(unittest.TestCase):
+    """Test mirroring from a local HTTP server."""
+
+    def setUp(self):
+        # Repo saves its state in the current directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs('www')
+        handler = partial(QuietHandler, directory=os.path.abspath('www'))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.cache = RepoCache(os.path.abspath('cache'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def repo(self, repo_id):
+        return Repo(repo_id, baseurl=f'{self.url}/{repo_id}',
+                    metadata_expire='0')
+
+    def mirror(self, *repo_ids):
+        results = Mirror('out', 2, self.cache).mirror_all(
+            [self.repo(r) for r in repo_ids])
+        for res in results:
+            self.assertIsNone(res.error)
+        return results
+
+    def check(self, repo_id, packages):
+        dest = os.path.join('out', repo_id)
+        for name, data in packages.items():
+            path = os.path.join(dest, 'Packages', name[0],
+                                f'{name}-1.0-1.x86_64.rpm')
+            with open(path, 'rb') as f:
+                self.assertEqual(data, f.read(), name)
+        with open(os.path.join('www', repo_id, 'repodata', 'repomd.xml')) as f:
+            src = f.read()
+        with open(os.path.join(dest, 'repodata', 'repomd.xml')) as f:
+            self.assertEqual(src, f.read())
+        names = [f for _, _, files in os.walk(dest) for f in files]
+        self.assertEqual([], [f for f in names if f.startswith('.tmp-')])
+        self.assertEqual(len(packages), len(Manifest(dest).packages))
+
+    def test_mirror(self):
+        """A first run downloads everything, a second one nothing"""
+        packages = {n: contents(n) for n in ['alpha', 'beta', 'gamma']}
+        publish_repo(os.path.join('www', 'r1'), packages, 1)
+        res, = self.mirror('r1')
+        self.assertEqual((0, 3), (res.unchanged, res.downloaded))
+        self.check('r1', packages)
+
+        res, = self.mirror('r1')
+        self.assertEqual((3, 0), (res.unchanged, res.downloaded))
+
+    def test_update(self):
+        """Changed, added and removed packages"""
+        packages = {n: contents(n) for n in ['alpha', 'beta', 'gamma']}
+        publish_repo(os.path.join('www', 'r1'), packages, 1)
+        self.mirror('r1')
+
+        packages['beta'] = contents('beta', 'v2')
+        del packages['gamma']
+        packages['delta'] = contents('delta')
+        os.remove(os.path.join('www', 'r1', 'Packages', 'g',
+                               'gamma-1.0-1.x86_64.rpm'))
+        publish_repo(os.path.join('www', 'r1'), packages, 2)
+        res, = self.mirror('r1')
+        self.assertEqual((1, 2), (res.unchanged, res.downloaded))
+        # gamma and the old primary data set
+        self.assertEqual(2, res.deleted)
+        self.check('r1', packages)
+        self.assertFalse(os.path.exists(os.path.join(
+            'out', 'r1', 'Packages', 'g', 'gamma-1.0-1.x86_64.rpm')))
+        self.assertEqual('2', Manifest(os.path.join('out', 'r1')).revision)
+
+    def test_link(self):
+        """Packages shared between repositories are hard-linked"""
+        packages = {n: contents(n) for n in ['alpha', 'beta']}
+        publish_repo(os.path.join('www', 'r1'), packages, 1)
+        publish_repo(os.path.join('www', 'r2'), {'alpha': packages['alpha']}, 1)
+        res1, res2 = self.mirror('r1', 'r2')
+        self.assertEqual((1, 0), (res2.linked, res2.downloaded))
+        self.check('r2', {'alpha': packages['alpha']})
+        path = os.path.join('out', 'r2', 'Packages', 'a',
+                            'alpha-1.0-1.x86_64.rpm')
+        self.assertEqual(2, os.stat(path).st_nlink)
+
+    def test_failure(self):
+        """A bad package leaves the previous metadata in place"""
+        packages = {n: contents(n) for n in ['alpha', 'beta']}
+        publish_repo(os.path.join('www', 'r1'), packages, 1)
+        self.mirror('r1')
+        with open(os.path.join('out', 'r1', 'repodata', 'repomd.xml')) as f:
+            old = f.read()
+
+        packages['beta'] = contents('beta', 'v2')
+        publish_repo(os.path.join('www', 'r1'), packages, 2)
+        with open(os.path.join('www', 'r1', 'Packages', 'b',
+                               'beta-1.0-1.x86_64.rpm'), 'wb') as f:
+            f.write(contents('beta', 'v3'))
+        res, = Mirror('out', 2, self.cache).mirror_all([self.repo('r1')])
+        self.assertIsNotNone(res.error)
+        self.assertEqual(1, len(res.failed))
+        with open(os.path.join('out', 'r1', 'repodata', 'repomd.xml')) as f:
+            self.assertEqual(old, f.read())
+        with open(os.path.join('out', 'r1', 'Packages', 'b',
+                               'beta-1.0-1.x86_64.rpm'), 'rb') as f:
+            self.assertEqual(contents('beta'), f.read())
+
+    def test_local_path(self):
+        """Locations can't escape the mirror"""
+        self.assertEqual(os.path.join('/m', 'Packages', 'a.rpm'),
+                         local_path('/m', 'Packages/a.rpm'))
+        for location in ['../a.rpm', '/etc/passwd', 'Packages/../../a.rpm']:
+            with self.assertRaises(RuntimeError):
+                local_path('/m', location)
+
+if __name__ == '__main__':
+    unittest.main()
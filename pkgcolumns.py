@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# pkgcolumns.py - column-oriented view of a PkgList, for repository reports
+
+"""Reports over a whole repository ("total installed size per packager", "the
+100 largest packages built after some date") are slow as python loops over
+PkgList.packages. PkgColumns holds the sizes and times as numpy arrays, and the
+low-cardinality strings as dictionary-encoded columns, so that filters,
+group-bys and top-k selections run vectorized.
+
+numpy is only needed by this module, the rest of the code works without it.
+
+"""
+
+import sys
+import operator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Integer columns, and how to get their value from a Pkg
+int_columns = {
+    'size_package': lambda p: p.size.package,
+    'size_archive': lambda p: p.size.archive,
+    'size_installed': lambda p: p.size.installed,
+    'time_file': lambda p: p.pkg_time.file,
+    'time_build': lambda p: p.pkg_time.build,
+}
+
+# Dictionary-encoded string columns
+str_columns = ('name', 'arch', 'type', 'packager')
+
+# Comparison operators for filters on integer columns
+ops = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+#-------------------------------------------------------------------------------
+# StrColumn - a dictionary-encoded string column
+#-------------------------------------------------------------------------------
+
+class StrColumn():
+    def __init__(self, values):
+        # Each distinct string gets an integer code, the column itself is an
+        # array of codes.
+        self.values = []
+        self.index = {}
+        codes = []
+        for v in values:
+            c = self.index.get(v)
+            if c is None:
+                c = len(self.values)
+                self.index[v] = c
+                self.values.append(v)
+            codes.append(c)
+        self.codes = np.array(codes, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def mask(self, value):
+        """Return a boolean array, true where the column holds value.
+
+        value may also be a list, tuple or set of strings.
+        """
+        if isinstance(value, (list, tuple, set)):
+            wanted = [self.index[v] for v in value if v in self.index]
+            return np.isin(self.codes, wanted)
+        c = self.index.get(value)
+        if c is None:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == c
+
+#-------------------------------------------------------------------------------
+# PkgColumns -
+#-------------------------------------------------------------------------------
+
+class PkgColumns():
+    def __init__(self, packages):
+        if np is None:
+            raise RuntimeError('PkgColumns requires numpy, which is not installed')
+        # Keep the packages, to return them from the queries
+        self.packages = packages
+
+        self.columns = {}
+        for name, get in int_columns.items():
+            self.columns[name] = np.fromiter((get(p) for p in packages),
+                                             dtype=np.int64, count=len(packages))
+        for name in str_columns:
+            self.columns[name] = StrColumn(getattr(p, name) for p in packages)
+
+    def __len__(self):
+        return len(self.packages)
+
+    def column(self, name):
+        """Return the array (or StrColumn) for a column name."""
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError(f'Unknown column "{name}", expected one of'
+                           + f' {", ".join(self.columns)}')
+
+    #---------------------------------------------------------------------------
+    # Queries
+    #---------------------------------------------------------------------------
+
+    def where(self, **conds):
+        """Return a boolean mask selecting the packages matching all conds.
+
+        String columns are compared for equality with a string, or for
+        membership in a list of strings. Integer columns are compared with an
+        (operator, value) tuple, e.g. time_build=('>=', 1570000000).
+        """
+        m = np.ones(len(self.packages), dtype=bool)
+        for name, cond in conds.items():
+            col = self.column(name)
+            if isinstance(col, StrColumn):
+                m &= col.mask(cond)
+            else:
+                op, value = cond
+                m &= ops[op](col, value)
+        return m
+
+    def group_sum(self, value, by, mask=None):
+        """Return [(key, total)] of column value summed per key of column by.
+
+        The list is sorted by decreasing total, and only holds the keys that
+        were matched by mask (if given).
+        """
+        keys = self.column(by)
+        vals = self.column(value)
+        codes = keys.codes if mask is None else keys.codes[mask]
+        vals = vals if mask is None else vals[mask]
+        present = np.bincount(codes, minlength=len(keys.values)) > 0
+        totals = np.bincount(codes, weights=vals, minlength=len(keys.values))
+        order = np.argsort(-totals, kind='stable')
+        return [(keys.values[c], int(totals[c])) for c in order if present[c]]
+
+    def group_count(self, by, mask=None):
+        """Return [(key, count)] for column by, sorted by decreasing count."""
+        keys = self.column(by)
+        codes = keys.codes if mask is None else keys.codes[mask]
+        counts = np.bincount(codes, minlength=len(keys.values))
+        order = np.argsort(-counts, kind='stable')
+        return [(keys.values[c], int(counts[c])) for c in order if counts[c]]
+
+    def top_k(self, value, k, mask=None, largest=True):
+        """Return the k packages with the largest (or smallest) value."""
+        vals = self.column(value)
+        idx = np.arange(len(vals)) if mask is None else np.flatnonzero(mask)
+        v = -vals[idx] if largest else vals[idx]
+        if k < len(idx):
+            part = np.argpartition(v, k)[:k]
+            idx, v = idx[part], v[part]
+        idx = idx[np.argsort(v, kind='stable')]
+        return [self.packages[i] for i in idx]
+
+    def total(self, value, mask=None):
+        """Return the sum of column value, over the packages in mask."""
+        vals = self.column(value)
+        return int(vals.sum() if mask is None else vals[mask].sum())
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    from pkglist import PkgList
+
+    if len(sys.argv) != 2:
+        print(f'Usage: {sys.argv[0]} <filepath>')
+        exit(-1)
+    filepath = sys.argv[1]
+
+    cols = PkgList.from_file(filepath).to_columns()
+    print(f'{len(cols)} packages, installed size:'
+          + f' {cols.total("size_installed")} bytes')
+
+    print('Installed size per packager:')
+    for packager, total in cols.group_sum('size_installed', 'packager')[:10]:
+        print(f'    {total:>14}  {packager}')
+
+    print('Largest packages:')
+    for p in cols.top_k('size_package', 10):
+        print(f'    {p.size.package:>14}  {p.name}.{p.arch}')
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# pkgdb.py - query a repository's primary_db SQLite data set
+
+"""Besides primary.xml, repomd.xml usually lists primary_db: the same data as
+an SQLite database (*-primary.sqlite.xz), with indexes on package names and
+capabilities. It's decompressed once into the cache, then every query is an
+indexed SQL lookup, and Pkg instances are only created for the packages that
+are returned: there's no need to parse the whole repository to look up a few
+packages.
+
+PkgDb answers the same lookups as PkgList (find, find_many, find_pkgid,
+latest...), plus what_provides(). A database with a schema version we don't
+know is rejected, the caller then falls back to the XML data set.
+
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+
+from version import Version
+from datastream import open_data
+from pkglist import Pkg, PkgTime, Size
+from lfs.checksum import Checksum
+
+# Schema version of the databases we know how to read
+database_version = 10
+
+#-------------------------------------------------------------------------------
+# PkgDb -
+#-------------------------------------------------------------------------------
+
+class PkgDb():
+    columns = ('pkgKey, pkgId, name, arch, epoch, version, release, summary,'
+               + ' description, rpm_packager, url, time_file, time_build,'
+               + ' size_package, size_archive, size_installed, location_href,'
+               + ' checksum_type')
+
+    def __init__(self, filepath):
+        """Open a decompressed primary.sqlite file, read-only.
+
+        Raise a RuntimeError if the database schema version isn't supported.
+        """
+        self.filepath = filepath
+        self.db = sqlite3.connect(f'file:{filepath}?mode=ro', uri=True,
+                                  check_same_thread=False)
+        try:
+            version = self.db.execute('SELECT dbversion FROM db_info').fetchone()
+        except sqlite3.DatabaseError as e:
+            self.db.close()
+            raise RuntimeError(f'{filepath}: not a primary database ({e})')
+        if version is None or version[0] != database_version:
+            self.db.close()
+            raise RuntimeError(f'{filepath}: unsupported database version'
+                               + f' {version and version[0]}')
+
+    def __str__(self):
+        return f'primary db: {self.filepath}, {len(self)} packages\n'
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM packages').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #---------------------------------------------------------------------------
+    # Pkg instances, only for the rows a query returns
+    #---------------------------------------------------------------------------
+
+    def make_pkg(row):
+        (key, pkgid, name, arch, epoch, ver, rel, summary, description,
+         packager, url, time_file, time_build, size_package, size_archive,
+         size_installed, location, checksum_type) = row
+        return Pkg('rpm', name, arch, Version(epoch, ver, rel),
+                   Checksum(checksum_type, pkgid, pkgid='YES'), summary,
+                   description, packager, url, PkgTime(time_file, time_build),
+                   Size(size_package, size_archive, size_installed), location,
+                   None)
+
+    def query(self, where, params=()):
+        sql = f'SELECT {PkgDb.columns} FROM packages WHERE {where}'
+        return [PkgDb.make_pkg(row) for row in self.db.execute(sql, params)]
+
+    #---------------------------------------------------------------------------
+    # Lookups, as in PkgList
+    #---------------------------------------------------------------------------
+
+    def find(self, name, arch=None):
+        """Return the list of packages with this name (and arch)."""
+        if arch is None:
+            return self.query('name = ?', (name,))
+        return self.query('name = ? AND arch = ?', (name, arch))
+
+    def find_many(self, names, arch=None):
+        """Return a dictionary with the list of packages for each name."""
+        return {n: self.find(n, arch) for n in names}
+
+    def find_pkgid(self, pkgid):
+        """Return the package with this checksum value, or None."""
+        l = self.query('pkgId = ?', (pkgid,))
+        return l[0] if l else None
+
+    def names_with_prefix(self, prefix):
+        """Return the sorted package names starting with prefix."""
+        if prefix == '':
+            sql, params = 'SELECT DISTINCT name FROM packages', ()
+        else:
+            # A range on the index, rather than LIKE which doesn't use it
+            hi = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            sql = 'SELECT DISTINCT name FROM packages WHERE name >= ? AND name < ?'
+            params = (prefix, hi)
+        return sorted(row[0] for row in self.db.execute(sql, params))
+
+    def latest(self, name, arch=None):
+        """Return the package with the highest epoch:version-release, or None."""
+        l = self.find(name, arch)
+        if not l:
+            return None
+        return max(l, key=lambda p: p.version.key)
+
+    def what_provides(self, capability):
+        """Return the list of packages providing a capability (or a file)."""
+        where = 'pkgKey IN (SELECT pkgKey FROM provides WHERE name = ?)'
+        params = (capability,)
+        if capability.startswith('/'):
+            where += ' OR pkgKey IN (SELECT pkgKey FROM files WHERE name = ?)'
+            params += (capability,)
+        return self.query(where, params)
+
+    #---------------------------------------------------------------------------
+    # Retrieval
+    #---------------------------------------------------------------------------
+
+    @classmethod
+    def from_data_set(cls, cache, ds, urls, session=None):
+        """Return a PkgDb for a primary_db DataSet, retrieving it if needed.
+
+        The compressed file is fetched through the RepoCache, and decompressed
+        next to it (its open-checksum is verified on the way); only the
+        decompressed database is kept. Raise a RuntimeError if the database
+        can't be retrieved or isn't supported.
+        """
+        if getattr(ds, 'database_version', None) not in [None, str(database_version)]:
+            raise RuntimeError(f'{ds.location}: unsupported database version'
+                               + f' {ds.database_version}')
+        dbpath = PkgDb.db_path(cache, ds)
+        try:
+            # The modification time records the last use, for LRU eviction
+            os.utime(dbpath)
+            print(f'  In cache: "{dbpath}"')
+        except FileNotFoundError:
+            filepath = cache.fetch(ds, urls, session)
+            PkgDb.decompress(filepath, dbpath, ds)
+            os.remove(filepath)
+        return cls(dbpath)
+
+    def db_path(cache, ds):
+        filepath = cache.path_for(ds)
+        base, ext = os.path.splitext(filepath)
+        return base if ext in ['.xz', '.bz2', '.gz'] else filepath + '.sqlite'
+
+    def decompress(filepath, dbpath, ds):
+        """Decompress filepath into dbpath, verifying the open-checksum."""
+        dirpath = os.path.dirname(dbpath)
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f, open_data(filepath, ds) as src:
+                shutil.copyfileobj(src, f)
+            os.replace(tmp_path, dbpath)
+            tmp_path = None
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'Usage: {sys.argv[0]} <primary.sqlite> <name>|<capability>...')
+        exit(-1)
+
+    with PkgDb(sys.argv[1]) as db:
+        for name in sys.argv[2:]:
+            l = db.find(name) or db.what_provides(name)
+            if not l:
+                print(f'{name}: not found')
+            for p in l:
+                print(f'{name}: {p.name}-{p.version.evr()}.{p.arch}'
+                      + f'  {p.location}')
@@ -0,0 +1,191 @@
+# pkgdb_t.py
+
+import os
+import lzma
+import sqlite3
+import hashlib
+import tempfile
+import unittest
+from lfs.checksum import Checksum
+from repomd import DataSet
+from repocache import RepoCache
+from pkgdb import PkgDb
+
+# (name, arch, epoch, version, release, provides, files)
+rows = [
+    ('bash', 'x86_64', '0', '5.1', '2.fc34', ['/bin/sh'], ['/usr/bin/bash']),
+    ('bash', 'x86_64', '0', '5.1', '10.fc34', ['/bin/sh'], ['/usr/bin/bash']),
+    ('bash', 'i686', '0', '5.2', '1.fc34', [], []),
+    ('bash-doc', 'noarch', '0', '5.1', '2.fc34', [], []),
+    ('zsh', 'x86_64', '1', '5.8', '1.fc34', ['/bin/zsh'], ['/etc/zshrc']),
+]
+
+def make_db(path, version=10):
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE db_info (dbversion INTEGER, checksum TEXT);
+        CREATE TABLE packages (pkgKey INTEGER PRIMARY KEY, pkgId TEXT,
+            name TEXT, arch TEXT, version TEXT, epoch TEXT, release TEXT,
+            summary TEXT, description TEXT, url TEXT, time_file INTEGER,
+            time_build INTEGER, rpm_license TEXT, rpm_vendor TEXT,
+            rpm_group TEXT, rpm_buildhost TEXT, rpm_sourcerpm TEXT,
+            rpm_header_start INTEGER, rpm_header_end INTEGER,
+            rpm_packager TEXT, size_package INTEGER, size_installed INTEGER,
+            size_archive INTEGER, location_href TEXT, location_base TEXT,
+            checksum_type TEXT);
+        CREATE TABLE provides (name TEXT, flags TEXT, epoch TEXT,
+            version TEXT, release TEXT, pkgKey INTEGER);
+        CREATE TABLE files (name TEXT, type TEXT, pkgKey INTEGER);
+        CREATE INDEX packagename ON packages (name);
+        """)
+    db.execute('INSERT INTO db_info VALUES (?, ?)', (version, 'x'))
+    for key, (name, arch, e, v, r, provides, files) in enumerate(rows, 1):
+        pkgid = hashlib.sha256(f'{key}'.encode()).hexdigest()
+        db.execute('INSERT INTO packages (pkgKey, pkgId, name, arch, epoch,'
+                   + ' version, release, summary, description, url,'
+                   + ' time_file, time_build, rpm_packager, size_package,'
+                   + ' size_installed, size_archive, location_href,'
+                   + ' checksum_type) VALUES'
+                   + ' (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                   (key, pkgid, name, arch, e, v, r, f'{name} summary', '',
+                    '', 1, 2, '', 100 * key, 300, 200,
+                    f'Packages/{name}-{v}-{r}.{arch}.rpm', 'sha256'))
+        for cap in [name] + provides:
+            db.execute('INSERT INTO provides (name, pkgKey) VALUES (?, ?)',
+                       (cap, key))
+        for f in files:
+            db.execute('INSERT INTO files VALUES (?, ?, ?)', (f, 'file', key))
+    db.commit()
+    db.close()
+
+# -----------------------------------------------------------------------------
+# PkgDbTest
+# -----------------------------------------------------------------------------
+
+class PkgDbTest(unittest.TestCase):
+    """Test the lookups."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'primary.sqlite')
+        make_db(self.path)
+        self.db = PkgDb(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_find(self):
+        """By name, name and arch, checksum"""
+        self.assertEqual(5, len(self.db))
+        self.assertEqual(3, len(self.db.find('bash')))
+        self.assertEqual(['i686'], [p.arch for p in self.db.find('bash', 'i686')])
+        self.assertEqual([], self.db.find('fish'))
+        d = self.db.find_many(['bash', 'zsh'], 'x86_64')
+        self.assertEqual([2, 1], [len(d['bash']), len(d['zsh'])])
+
+        p = self.db.find('zsh')[0]
+        self.assertEqual('1', p.version.epoch)
+        self.assertEqual(500, p.size.package)
+        self.assertEqual('Packages/zsh-5.8-1.fc34.x86_64.rpm', p.location)
+        self.assertEqual('zsh', self.db.find_pkgid(p.checksum.value).name)
+        self.assertIsNone(self.db.find_pkgid('0' * 64))
+
+    def test_names_with_prefix(self):
+        """Distinct sorted names"""
+        self.assertEqual(['bash', 'bash-doc'], self.db.names_with_prefix('ba'))
+        self.assertEqual(['bash', 'bash-doc', 'zsh'],
+                         self.db.names_with_prefix(''))
+        self.assertEqual([], self.db.names_with_prefix('c'))
+
+    def test_latest(self):
+        """rpm version ordering, not string ordering"""
+        p = self.db.latest('bash', 'x86_64')
+        self.assertEqual('10.fc34', p.version.rel)
+        self.assertEqual('5.2', self.db.latest('bash').version.ver)
+        self.assertIsNone(self.db.latest('fish'))
+
+    def test_what_provides(self):
+        """Capabilities, and files for paths"""
+        self.assertEqual(2, len(self.db.what_provides('/bin/sh')))
+        self.assertEqual(['zsh'],
+                         [p.name for p in self.db.what_provides('/etc/zshrc')])
+        self.assertEqual(['bash-doc'],
+                         [p.name for p in self.db.what_provides('bash-doc')])
+        self.assertEqual([], self.db.what_provides('/nowhere'))
+
+    def test_version(self):
+        """Unknown schema versions, and files that aren't databases"""
+        path = os.path.join(self.tmp.name, 'v9.sqlite')
+        make_db(path, 9)
+        with self.assertRaises(RuntimeError):
+            PkgDb(path)
+        path = os.path.join(self.tmp.name, 'text.sqlite')
+        with open(path, 'w') as f:
+            f.write('not a database' * 100)
+        with self.assertRaises(RuntimeError):
+            PkgDb(path)
+
+# -----------------------------------------------------------------------------
+# DataSetTest
+# -----------------------------------------------------------------------------
+
+class DataSetTest(unittest.TestCase):
+    """Test decompression of a primary_db data set from the cache."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RepoCache(os.path.join(self.tmp.name, 'cache'))
+        path = os.path.join(self.tmp.name, 'primary.sqlite')
+        make_db(path)
+        with open(path, 'rb') as f:
+            self.raw = f.read()
+        self.data = lzma.compress(self.raw)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def data_set(self, open_value):
+        v = hashlib.sha256(self.data).hexdigest()
+        return DataSet('primary_db', Checksum('sha256', v),
+                       f'repodata/{v}-primary.sqlite.xz', 0, len(self.data),
+                       open_checksum=Checksum('sha256', open_value),
+                       open_size=len(self.raw), database_version='10')
+
+    def add(self, ds):
+        filepath = self.cache.path_for(ds)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(self.data)
+        return filepath
+
+    def test_from_data_set(self):
+        """Only the decompressed database is kept"""
+        ds = self.data_set(hashlib.sha256(self.raw).hexdigest())
+        filepath = self.add(ds)
+        with PkgDb.from_data_set(self.cache, ds, []) as db:
+            self.assertEqual(5, len(db))
+        self.assertFalse(os.path.exists(filepath))
+        self.assertEqual(filepath[:-3], PkgDb.db_path(self.cache, ds))
+        # Second time, straight from the decompressed file
+        with PkgDb.from_data_set(self.cache, ds, []) as db:
+            self.assertEqual(5, len(db))
+
+    def test_open_checksum(self):
+        """A bad open-checksum leaves nothing behind"""
+        ds = self.data_set('0' * 64)
+        filepath = self.add(ds)
+        with self.assertRaises(RuntimeError):
+            PkgDb.from_data_set(self.cache, ds, [])
+        self.assertEqual([os.path.basename(filepath)],
+                         os.listdir(os.path.dirname(filepath)))
+
+    def test_database_version(self):
+        """A database version we don't know isn't retrieved"""
+        ds = self.data_set('0' * 64)
+        ds.database_version = '11'
+        with self.assertRaises(RuntimeError):
+            PkgDb.from_data_set(self.cache, ds, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,65 +1,252 @@
 #!/usr/bin/python
-# pkgformat.py - 
+# pkgformat.py - the <format> part of a package: rpm headers and dependencies
+
+"""The dependencies of all the packages of a repository are kept in a single
+DepGraph: capability names, and epoch:version-release values, are interned
+into integer ids, and each kind of dependency (requires, provides...) is
+stored in compressed sparse row form: for package i, its entries are at
+offsets[i]:offsets[i + 1] of parallel arrays of capability ids, flags and
+version ids. A full repository then holds a few compact arrays instead of
+millions of small objects, and traversing the graph is integer lookups.
+
+PkgFormat keeps the scalar values (license, vendor...), and its dependency
+properties create DepsEntry instances from the graph when they're asked for.
+
+"""
 
 import os
 import re
+import sys
+import array
 from lxml import etree
 
 from version import Version
 
+# Dependency kinds, as the local names of the <rpm:...> elements
+dep_kinds = ['provides', 'requires', 'conflicts', 'obsoletes', 'recommends',
+             'suggests', 'supplements', 'enhances']
+
+# Comparison flags, as codes in the graph arrays. 0 means no version.
+flag_names = [None, 'EQ', 'LT', 'LE', 'GT', 'GE']
+flag_codes = {name: code for code, name in enumerate(flag_names)}
+
+# Position of the provide in the reverse index, for the files
+file_entry = 0xffffffff
+
 #-------------------------------------------------------------------------------
-# HeaderRange - 
+# HeaderRange -
 #-------------------------------------------------------------------------------
 
 class HeaderRange():
+    __slots__ = ('start', 'end')
+
     def __init__(self, start, end):
-        self.start = start
-        self.end = end
+        self.start = int(start)
+        self.end = int(end)
 
     def __str__(self):
         return f'header-range: start={self.start}, end={self.end}\n'
 
     def to_csv(self):
-        return f'\\t{self.start}\t{self.end}'
+        return f'{self.start}\t{self.end}'
 
     @classmethod
     def csv_header(cls):
-        return f'\tstart\tend'
+        return f'start\tend'
 
 #-------------------------------------------------------------------------------
-# DepsEntry - 
+# DepsEntry -
 #-------------------------------------------------------------------------------
 
 class DepsEntry():
-    def __init__(self, name, flags):
+    __slots__ = ('name', 'flags', 'version', 'pre')
+
+    def __init__(self, name, flags=None, version=None, pre=False):
         self.name = name
         self.flags = flags
         self.version = version
+        self.pre = pre
 
     def __str__(self):
-        return f'entry: name={self.name}, flags={self.flags}\n'
+        s = f'entry: name={self.name}, flags={self.flags}'
+        if self.version:
+            s += f', evr={self.version.evr()}'
+        if self.pre:
+            s += ', pre'
+        return s + '\n'
 
     def to_csv(self):
-        return f'{self.name}\t{self.flags}'
+        evr = self.version.evr() if self.version else ''
+        return f'{self.name}\t{self.flags or ""}\t{evr}'
 
     @classmethod
     def csv_header(cls):
-        return f'\tname\tflags'
+        return f'name\tflags\tevr'
 
 #-------------------------------------------------------------------------------
-# PkgFormat - 
+# DepGraph - the dependencies of all the packages, in compact arrays
+#-------------------------------------------------------------------------------
+
+class DepArrays():
+    """One kind of dependency for all the packages, in CSR form."""
+    __slots__ = ('offsets', 'caps', 'flags', 'evrs', 'pre')
+
+    def __init__(self):
+        self.offsets = array.array('I', [0])
+        self.caps = array.array('I')
+        self.flags = array.array('B')
+        self.evrs = array.array('I')
+        # Only meaningful for requires
+        self.pre = array.array('B')
+
+    def range(self, i):
+        return self.offsets[i], self.offsets[i + 1]
+
+class DepGraph():
+    def __init__(self):
+        # Capability names, by id
+        self.cap_ids = {}
+        self.cap_names = []
+
+        # Versions, by id; id 0 is no version
+        self.evr_ids = {None: 0}
+        self.evrs = [None]
+
+        self.deps = {kind: DepArrays() for kind in dep_kinds}
+        # Files listed in primary.xml, with the same layout
+        self.files = DepArrays()
+
+        # The Pkg for each index, set by PkgList.handle_pkg()
+        self.packages = []
+
+        # Reverse index, capability id -> providing packages, and the position
+        # of each one's provide entry (file_entry for a file), built on demand
+        self.provider_offsets = None
+        self.provider_pkgs = None
+        self.provider_entries = None
+
+    def __str__(self):
+        s = (f'dependency graph: {len(self.packages)} packages,'
+             + f' {len(self.cap_names)} capabilities, {len(self.evrs)} versions\n')
+        for kind, d in self.deps.items():
+            s += f'    {kind}: {len(d.caps)}\n'
+        s += f'    files: {len(self.files.caps)}\n'
+        return s
+
+    #---------------------------------------------------------------------------
+    # Building
+    #---------------------------------------------------------------------------
+
+    def cap_id(self, name):
+        i = self.cap_ids.get(name)
+        if i is None:
+            i = self.cap_ids[name] = len(self.cap_names)
+            self.cap_names.append(name)
+        return i
+
+    def evr_id(self, epoch, ver, rel):
+        if ver is None:
+            return 0
+        k = (epoch, ver, rel)
+        i = self.evr_ids.get(k)
+        if i is None:
+            i = self.evr_ids[k] = len(self.evrs)
+            self.evrs.append(Version(epoch, ver, rel))
+        return i
+
+    def add_package(self, deps, files):
+        """Add the dependencies of a package, return the package index.
+
+        deps is a dictionary with a list of (name, flags, epoch, ver, rel, pre)
+        tuples for each kind, files a list of paths.
+        """
+        index = len(self.packages)
+        self.packages.append(None)
+        for kind, d in self.deps.items():
+            for name, flags, epoch, ver, rel, pre in deps.get(kind, ()):
+                d.caps.append(self.cap_id(name))
+                d.flags.append(flag_codes.get(flags, 0))
+                d.evrs.append(self.evr_id(epoch, ver, rel))
+                d.pre.append(pre)
+            d.offsets.append(len(d.caps))
+        for path in files:
+            self.files.caps.append(self.cap_id(path))
+        self.files.offsets.append(len(self.files.caps))
+        self.provider_offsets = None
+        return index
+
+    #---------------------------------------------------------------------------
+    # Traversal
+    #---------------------------------------------------------------------------
+
+    def cap_ids_of(self, kind, i):
+        """Return the capability ids of one kind of dependency of package i."""
+        d = self.files if kind == 'files' else self.deps[kind]
+        start, end = d.range(i)
+        return d.caps[start:end]
+
+    def entries(self, kind, i):
+        """Return the DepsEntry list of one kind of dependency of package i."""
+        d = self.deps[kind]
+        start, end = d.range(i)
+        return [DepsEntry(self.cap_names[d.caps[j]], flag_names[d.flags[j]],
+                          self.evrs[d.evrs[j]], bool(d.pre[j]))
+                for j in range(start, end)]
+
+    def build_providers(self):
+        """Build the reverse index of provides and files."""
+        counts = array.array('I', bytes(4 * (len(self.cap_names) + 1)))
+        for d in [self.deps['provides'], self.files]:
+            for c in d.caps:
+                counts[c + 1] += 1
+        for c in range(len(self.cap_names)):
+            counts[c + 1] += counts[c]
+        pkgs = array.array('I', bytes(4 * counts[-1]))
+        entries = array.array('I', bytes(4 * counts[-1]))
+        pos = array.array('I', counts[:-1])
+        provides = self.deps['provides']
+        for d in [provides, self.files]:
+            for i in range(len(d.offsets) - 1):
+                start, end = d.range(i)
+                for j in range(start, end):
+                    c = d.caps[j]
+                    pkgs[pos[c]] = i
+                    entries[pos[c]] = j if d is provides else file_entry
+                    pos[c] += 1
+        self.provider_offsets = counts
+        self.provider_pkgs = pkgs
+        self.provider_entries = entries
+
+    def providers(self, cap):
+        """Return the indexes of the packages providing a capability (name or
+        id), duplicates removed."""
+        if isinstance(cap, str):
+            cap = self.cap_ids.get(cap)
+            if cap is None:
+                return []
+        if self.provider_offsets is None:
+            self.build_providers()
+        start, end = self.provider_offsets[cap], self.provider_offsets[cap + 1]
+        return list(dict.fromkeys(self.provider_pkgs[start:end]))
+
+#-------------------------------------------------------------------------------
+# PkgFormat -
 #-------------------------------------------------------------------------------
 
 class PkgFormat():
+    __slots__ = ('licence', 'vendor', 'group', 'buildhost', 'sourcerpm',
+                 'header_range', 'graph', 'index')
+
     def __init__(self, licence, vendor, group, buildhost, sourcerpm,
-                 header_range
-                 ):
+                 header_range, graph=None, index=None):
         self.licence = licence
-        self.vendor = vendor
-        self.group = group
+        self.vendor = sys.intern(vendor) if vendor else vendor
+        self.group = sys.intern(group) if group else group
         self.buildhost = buildhost
         self.sourcerpm = sourcerpm
         self.header_range = header_range
+        self.graph = graph
+        self.index = index
 
     def __str__(self):
         s = ''
@@ -79,8 +266,82 @@ class PkgFormat():
     @classmethod
     def csv_header(cls):
         s = f'licence\tvendor\tgroup\tbuildhost\tsourcerpm'
-        s += + f'\t{HeaderRange.csv_header()}'
+        s += f'\t{HeaderRange.csv_header()}'
         return s
 
+    #---------------------------------------------------------------------------
+    # Dependencies, from the graph
+    #---------------------------------------------------------------------------
+
+    def deps(self, kind):
+        if self.graph is None:
+            return []
+        return self.graph.entries(kind, self.index)
+
+    @property
+    def provides(self):
+        return self.deps('provides')
+
+    @property
+    def requires(self):
+        return self.deps('requires')
+
+    @property
+    def conflicts(self):
+        return self.deps('conflicts')
+
+    @property
+    def obsoletes(self):
+        return self.deps('obsoletes')
+
+    @property
+    def recommends(self):
+        return self.deps('recommends')
+
+    @property
+    def files(self):
+        if self.graph is None:
+            return []
+        return [self.graph.cap_names[c]
+                for c in self.graph.cap_ids_of('files', self.index)]
+
+    #---------------------------------------------------------------------------
+    # Parse <format>
+    #---------------------------------------------------------------------------
+
+    def handle_format(nd, graph):
+        """Return a PkgFormat from a <format> element, adding its
+        dependencies to graph."""
+        licence = vendor = group = buildhost = sourcerpm = None
+        header_range = None
+        deps = {}
+        files = []
+
+        for k in nd:
+            tag = etree.QName(k.tag).localname
+            if tag == 'license':
+                licence = k.text
+            elif tag == 'vendor':
+                vendor = k.text
+            elif tag == 'group':
+                group = k.text
+            elif tag == 'buildhost':
+                buildhost = k.text
+            elif tag == 'sourcerpm':
+                sourcerpm = k.text
+            elif tag == 'header-range':
+                header_range = HeaderRange(k.attrib['start'], k.attrib['end'])
+            elif tag in dep_kinds:
+                a = [e.attrib for e in k]
+                deps[tag] = [(x['name'], x.get('flags'), x.get('epoch'),
+                              x.get('ver'), x.get('rel'), x.get('pre') == '1')
+                             for x in a]
+            elif tag == 'file':
+                files.append(k.text)
+
+        index = graph.add_package(deps, files)
+        return PkgFormat(licence, vendor, group, buildhost, sourcerpm,
+                         header_range, graph, index)
+
 if __name__ == '__main__':
     print("""This module is not meant to run directly.""")
@@ -0,0 +1,185 @@
+# pkgformat_t.py
+
+import os
+import hashlib
+import tempfile
+import unittest
+from lxml import etree
+from pkgformat import DepGraph, PkgFormat, file_entry, flag_codes
+from pkglist import PkgList
+
+ns = 'xmlns="http://linux.duke.edu/metadata/common"' \
+     + ' xmlns:rpm="http://linux.duke.edu/metadata/rpm"'
+
+def dep_xml(kind, deps):
+    """deps is a list of names, or (name, flags, 'epoch:ver-rel') tuples."""
+    if not deps:
+        return ''
+    s = f'<rpm:{kind}>'
+    for d in deps:
+        if isinstance(d, str):
+            s += f'<rpm:entry name="{d}"/>'
+            continue
+        name, flags, evr = d
+        epoch, _, vr = evr.rpartition(':')
+        ver, _, rel = vr.partition('-')
+        s += (f'<rpm:entry name="{name}" flags="{flags}"'
+              + f' epoch="{epoch or 0}" ver="{ver}"'
+              + (f' rel="{rel}"' if rel else '') + '/>')
+    return s + f'</rpm:{kind}>'
+
+def package_xml(name, evr='1.0-1', arch='x86_64', files=(), **deps):
+    """Return a <package> element of primary.xml, deps by kind."""
+    epoch, _, vr = evr.rpartition(':')
+    ver, _, rel = vr.partition('-')
+    checksum = hashlib.sha256(f'{name}-{evr}.{arch}'.encode()).hexdigest()
+    return (f'<package type="rpm"><name>{name}</name><arch>{arch}</arch>'
+            + f'<version epoch="{epoch or 0}" ver="{ver}" rel="{rel}"/>'
+            + f'<checksum type="sha256" pkgid="YES">{checksum}</checksum>'
+            + f'<summary>{name}</summary><description/><packager/><url/>'
+            + '<time file="1" build="2"/>'
+            + '<size package="1000" installed="3000" archive="2000"/>'
+            + f'<location href="Packages/{name}-{ver}-{rel}.{arch}.rpm"/>'
+            + '<format><rpm:license>MIT</rpm:license>'
+            + '<rpm:header-range start="4504" end="9000"/>'
+            + ''.join(dep_xml(k, v) for k, v in deps.items())
+            + ''.join(f'<file>{f}</file>' for f in files)
+            + '</format></package>\n')
+
+def write_primary(filepath, packages):
+    """Write a primary.xml file with the <package> elements given."""
+    with open(filepath, 'w') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<metadata {ns}'
+                + f' packages="{len(packages)}">\n')
+        f.writelines(packages)
+        f.write('</metadata>\n')
+
+# -----------------------------------------------------------------------------
+# DepGraphTest
+# -----------------------------------------------------------------------------
+
+class DepGraphTest(unittest.TestCase):
+    """Test the interned arrays and the reverse provides index."""
+
+    def setUp(self):
+        g = self.g = DepGraph()
+        g.add_package({'provides': [('a', 'EQ', '0', '1.0', '1', False),
+                                    ('libx.so', None, None, None, None, False)],
+                       'requires': [('b', 'GE', '0', '2.0', None, True),
+                                    ('/bin/sh', None, None, None, None, False)]},
+                      ['/usr/bin/a'])
+        g.add_package({'provides': [('b', 'EQ', '0', '2.0', '1', False),
+                                    ('libx.so', None, None, None, None, False)]},
+                      ['/bin/sh', '/usr/bin/a'])
+        g.add_package({}, [])
+
+    def test_interning(self):
+        """Each name and version is stored once"""
+        g = self.g
+        self.assertEqual(['a', 'libx.so', 'b', '/bin/sh', '/usr/bin/a'],
+                         g.cap_names)
+        self.assertEqual(g.cap_ids['b'], g.deps['requires'].caps[0])
+        # No version, then 0:1.0-1, 0:2.0, 0:2.0-1
+        self.assertEqual(4, len(g.evrs))
+        self.assertEqual([0, 2, 4, 4], list(g.deps['provides'].offsets))
+        self.assertEqual((4, 4), g.deps['provides'].range(2))
+        self.assertEqual([], list(g.cap_ids_of('requires', 1)))
+        self.assertEqual(['/bin/sh', '/usr/bin/a'],
+                         [g.cap_names[c] for c in g.cap_ids_of('files', 1)])
+
+    def test_entries(self):
+        """DepsEntry instances, made from the arrays"""
+        l = self.g.entries('requires', 0)
+        self.assertEqual(['b', '/bin/sh'], [e.name for e in l])
+        self.assertEqual(['GE', None], [e.flags for e in l])
+        self.assertEqual([True, False], [e.pre for e in l])
+        self.assertEqual('2.0', l[0].version.ver)
+        self.assertIsNone(l[1].version)
+        self.assertEqual([], self.g.entries('obsoletes', 2))
+
+    def test_providers(self):
+        """Provides and files, by name or id, without duplicates"""
+        g = self.g
+        self.assertEqual([0, 1], g.providers('libx.so'))
+        self.assertEqual([1], g.providers('/bin/sh'))
+        self.assertEqual([0, 1], g.providers('/usr/bin/a'))
+        self.assertEqual([1], g.providers(g.cap_ids['b']))
+        self.assertEqual([], g.providers('c'))
+
+        # Entry positions, file_entry for the files
+        c = g.cap_ids['/usr/bin/a']
+        start, end = g.provider_offsets[c], g.provider_offsets[c + 1]
+        self.assertEqual([file_entry] * 2, list(g.provider_entries[start:end]))
+        c = g.cap_ids['b']
+        j = g.provider_entries[g.provider_offsets[c]]
+        self.assertEqual(c, g.deps['provides'].caps[j])
+
+    def test_add_invalidates(self):
+        """Adding a package drops the reverse index"""
+        self.assertEqual([1], self.g.providers('b'))
+        self.g.add_package({'provides': [('b', None, None, None, None,
+                                          False)]}, [])
+        self.assertIsNone(self.g.provider_offsets)
+        self.assertEqual([1, 3], self.g.providers('b'))
+
+# -----------------------------------------------------------------------------
+# PkgFormatTest
+# -----------------------------------------------------------------------------
+
+class PkgFormatTest(unittest.TestCase):
+    """Test parsing of <format>, through PkgList."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(self.filepath, [
+            package_xml('a', '1:2.0-3', files=['/usr/bin/a'],
+                        provides=[('a', 'EQ', '1:2.0-3'), 'liba.so'],
+                        requires=[('b', 'GE', '1.5'), 'rpmlib(X)'],
+                        recommends=['c']),
+            package_xml('b', '1.5-1', arch='noarch')])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_format(self):
+        """Scalar values, and dependencies from the graph"""
+        pl = PkgList.from_file(self.filepath, deps=True)
+        a, b = pl.packages
+        self.assertIs(pl.deps, a.format.graph)
+        self.assertEqual([a, b], pl.deps.packages)
+        self.assertEqual('MIT', a.format.licence)
+        self.assertEqual(4504, a.format.header_range.start)
+        self.assertEqual(['a', 'liba.so'], [e.name for e in a.format.provides])
+        self.assertEqual('1', a.format.provides[0].version.epoch)
+        self.assertEqual(['GE', None], [e.flags for e in a.format.requires])
+        self.assertEqual('1.5', a.format.requires[0].version.ver)
+        self.assertEqual(['c'], [e.name for e in a.format.recommends])
+        self.assertEqual(['/usr/bin/a'], a.format.files)
+        self.assertEqual([], b.format.requires)
+        self.assertEqual(flag_codes['GE'], pl.deps.deps['requires'].flags[0])
+
+    def test_no_deps(self):
+        """Without deps, <format> isn't parsed"""
+        pl = PkgList.from_file(self.filepath)
+        self.assertIsNone(pl.deps)
+        self.assertIsNone(pl.packages[0].format)
+
+    def test_handle_format(self):
+        """A <format> element on its own"""
+        nd = etree.fromstring(
+            '<format xmlns:rpm="http://linux.duke.edu/metadata/rpm">'
+            + '<rpm:vendor>V</rpm:vendor><rpm:obsoletes>'
+            + '<rpm:entry name="old" flags="LT" epoch="0" ver="2"/>'
+            + '</rpm:obsoletes></format>')
+        g = DepGraph()
+        f = PkgFormat.handle_format(nd, g)
+        self.assertEqual('V', f.vendor)
+        self.assertEqual(0, f.index)
+        self.assertEqual(['LT'], [e.flags for e in f.obsoletes])
+        self.assertEqual([], f.provides)
+        self.assertEqual([], PkgFormat(None, None, None, None, None,
+                                       None).requires)
+
+if __name__ == '__main__':
+    unittest.main()
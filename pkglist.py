@@ -4,9 +4,18 @@
 import os
 import re
 import sys
+import mmap
+import time
+import array
+import bisect
+import struct
+from collections.abc import Sequence
 from lxml import etree
 
 from version import Version
+from datastream import iter_elements
+from pkgcolumns import PkgColumns
+from pkgformat import PkgFormat, HeaderRange, DepGraph, DepArrays
 from lfs.checksum import Checksum
 
 #-------------------------------------------------------------------------------
@@ -14,9 +23,11 @@ from lfs.checksum import Checksum
 #-------------------------------------------------------------------------------
 
 class PkgTime():
+    __slots__ = ('file', 'build')
+
     def __init__(self, file, build):
-        self.file = file
-        self.build = build
+        self.file = int(file)
+        self.build = int(build)
 
     def __str__(self):
         return f'time: file={self.file}, build={self.build}\n'
@@ -33,10 +44,12 @@ class PkgTime():
 #-------------------------------------------------------------------------------
 
 class Size():
+    __slots__ = ('package', 'archive', 'installed')
+
     def __init__(self, package, archive, installed):
-        self.package = package
-        self.archive = archive
-        self.installed = installed
+        self.package = int(package)
+        self.archive = int(archive)
+        self.installed = int(installed)
 
     def __str__(self):
         return (f'size: package={self.package}, archive={self.archive}'
@@ -54,16 +67,26 @@ class Size():
 #-------------------------------------------------------------------------------
 
 class Pkg():
+    # A full repository holds tens of thousands of these: no per-instance
+    # __dict__, and the low-cardinality strings are shared between instances.
+    # The per-package text (summary, description, url, location, checksum)
+    # is still one str each, about 40% of a parsed list's heap. When only
+    # some of the packages are used, a list loaded from a snapshot (see
+    # LazyPkgs) only creates those.
+    __slots__ = ('type', 'name', 'arch', 'version', 'checksum', 'summary',
+                 'description', 'packager', 'url', 'pkg_time', 'size',
+                 'location', 'format')
+
     def __init__(self, type, name, arch, version, checksum, summary, description,
                  packager, url, pkg_time, size, location, format):
-        self.type = type
+        self.type = sys.intern(type)
         self.name = name
-        self.arch = arch
+        self.arch = sys.intern(arch)
         self.version = version
         self.checksum = checksum
         self.summary = summary
         self.description = description
-        self.packager = packager
+        self.packager = sys.intern(packager) if packager else packager
         self.url = url
         self.pkg_time = pkg_time
         self.size = size
@@ -108,6 +131,214 @@ class Pkg():
         s += f'\tlocation'
         return s
 
+#-------------------------------------------------------------------------------
+# Snapshot - a PkgList saved as fixed-width records, read through mmap
+#-------------------------------------------------------------------------------
+
+# A snapshot file is a header (magic, format version, key, counts), then
+# 8-byte aligned sections:
+#
+# - the string table: the offsets of the strings ('Q' array, one more than
+#   the number of strings), then the strings, UTF-8 encoded. Every distinct
+#   string is stored once, and referred to by its position.
+# - the package records, fixed-width, in record_format: string ids for the
+#   text fields, then the integers.
+# - if the PkgList has a DepGraph for all its packages: the capability names,
+#   the versions (3 string ids each), the arrays of each DepArrays, then the
+#   graph's reverse provides index, so that it's only built once.
+#
+# The key is the checksum of the primary data set the list was parsed from,
+# so a snapshot of older metadata is detected. Loading a snapshot only reads
+# the header: the Pkg instances are created from their record the first time
+# they're accessed, see LazyPkgs. The DepGraph arrays aren't read either, they
+# are memoryviews of the mapped file: read-only, and only valid until the
+# snapshot is closed.
+
+snapshot_magic = b'PKGSNAP\0'
+snapshot_version = 2
+
+# String id meaning None
+NONE = 0xffffffff
+
+# type, name, arch, epoch, ver, rel, checksum type, value and pkgid, summary,
+# description, packager, url, location, licence, vendor, group, buildhost,
+# sourcerpm, format index (NONE: no format); time file and build, size
+# package, archive and installed, header range start and end (-1: none).
+record_format = struct.Struct('<20I7q')
+
+snapshot_header = struct.Struct('<8sIIQQ')
+
+def write_section(f, data):
+    """Write a length-prefixed section, padded to 8 bytes."""
+    f.write(struct.pack('<Q', len(data)))
+    f.write(data)
+    f.write(bytes(-len(data) % 8))
+
+def write_array_section(f, a):
+    # a is an array, or a memoryview from a snapshot
+    typecode = a.format if isinstance(a, memoryview) else a.typecode
+    f.write(struct.pack('<cxxxxxxx', typecode.encode()))
+    write_section(f, a.tobytes())
+
+class Snapshot():
+    def __init__(self, filepath, key=None):
+        """Map a snapshot file, check its version and key (if given).
+
+        Raise a RuntimeError if the file isn't a snapshot we can use.
+        """
+        with open(filepath, 'rb') as f:
+            try:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise RuntimeError(f'{filepath}: empty file')
+        self.buf = memoryview(self.mm)
+        # Views of the file handed out, released by close()
+        self.views = [self.buf]
+        try:
+            self.check(filepath, key)
+        except RuntimeError:
+            self.close()
+            raise
+
+    def check(self, filepath, key):
+        if len(self.mm) < snapshot_header.size:
+            raise RuntimeError(f'{filepath}: not a package list snapshot')
+        magic, version, has_graph, self.count, key_size = (
+            snapshot_header.unpack_from(self.mm))
+        if magic != snapshot_magic:
+            raise RuntimeError(f'{filepath}: not a package list snapshot')
+        if version != snapshot_version:
+            raise RuntimeError(f'{filepath}: snapshot version {version},'
+                               + f' expected {snapshot_version}')
+        self.has_graph = bool(has_graph)
+        self.pos = snapshot_header.size
+        try:
+            self.key = bytes(self.section(key_size)).decode()
+            self.offsets = self.view(self.section().cast('Q'))
+            self.strings = self.pos + 8
+            self.section()
+            self.records = self.pos + 8
+            size = len(self.section())
+        except (struct.error, TypeError, ValueError):
+            raise RuntimeError(f'{filepath}: truncated snapshot')
+        if key is not None and key != self.key:
+            raise RuntimeError(f'{filepath}: stale snapshot, for {self.key}')
+        if size != self.count * record_format.size:
+            raise RuntimeError(f'{filepath}: truncated snapshot')
+
+        # Decoded strings, by id: each one is decoded once, and shared by all
+        # the packages using it.
+        self.cache = [None] * (len(self.offsets) - 1)
+
+    def close(self):
+        """Unmap the file. The packages that weren't created yet, and the
+        DepGraph, can't be used any more."""
+        for v in self.views:
+            v.release()
+        self.views = []
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def view(self, v):
+        self.views.append(v)
+        return v
+
+    def section(self, size=None):
+        """Return the next section as a memoryview, move past it."""
+        if size is None:
+            size, = struct.unpack_from('<Q', self.mm, self.pos)
+            self.pos += 8
+        if self.pos + size > len(self.mm):
+            raise ValueError('truncated section')
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += size + -size % 8
+        return data
+
+    def array_section(self):
+        """Return the next array section, as a memoryview of the file."""
+        typecode = bytes(self.section(8)[:1]).decode()
+        return self.view(self.section().cast(typecode))
+
+    def string(self, i):
+        if i == NONE:
+            return None
+        s = self.cache[i]
+        if s is None:
+            start = self.strings + self.offsets[i]
+            end = self.strings + self.offsets[i + 1]
+            s = self.cache[i] = self.mm[start:end].decode('utf-8')
+        return s
+
+    def pkg(self, i, graph=None):
+        """Return a Pkg from record i."""
+        r = record_format.unpack_from(self.mm, self.records
+                                      + i * record_format.size)
+        s = [self.string(x) for x in r[:19]]
+        format = None
+        if r[19] != NONE:
+            header_range = HeaderRange(r[25], r[26]) if r[25] >= 0 else None
+            format = PkgFormat(*s[14:19], header_range,
+                               graph if self.has_graph else None,
+                               r[19] if self.has_graph else None)
+        return Pkg(s[0], s[1], s[2], Version(s[3], s[4], s[5]),
+                   Checksum(s[6], s[7], pkgid=s[8]), s[9], s[10], s[11],
+                   s[12], PkgTime(r[20], r[21]), Size(r[22], r[23], r[24]),
+                   s[13], format)
+
+    def graph(self):
+        """Return the DepGraph stored after the records."""
+        g = DepGraph()
+        self.pos = self.records + self.count * record_format.size
+        self.pos += -self.pos % 8
+        names = bytes(self.section()).decode('utf-8')
+        g.cap_names = names.split('\0') if names else []
+        g.cap_ids = {name: i for i, name in enumerate(g.cap_names)}
+        evrs = self.array_section()
+        for i in range(3, len(evrs), 3):
+            epoch, ver, rel = [self.string(x) for x in evrs[i:i + 3]]
+            g.evr_ids[(epoch, ver, rel)] = len(g.evrs)
+            g.evrs.append(Version(epoch, ver, rel))
+        for d in list(g.deps.values()) + [g.files]:
+            for name in DepArrays.__slots__:
+                setattr(d, name, self.array_section())
+        g.provider_offsets = self.array_section()
+        g.provider_pkgs = self.array_section()
+        g.provider_entries = self.array_section()
+        return g
+
+class LazyPkgs(Sequence):
+    """The packages of a snapshot, each Pkg created on first access.
+
+    It's a read-only sequence: PkgList replaces it with a list of all the
+    packages before modifying its packages (see PkgList.own_packages()).
+    """
+    def __init__(self, snapshot, graph=None):
+        self.snapshot = snapshot
+        self.graph = graph
+        self.items = [None] * snapshot.count
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.items)))]
+        p = self.items[i]
+        if p is None:
+            if i < 0:
+                i += len(self.items)
+            p = self.items[i] = self.snapshot.pkg(i, self.graph)
+        return p
+
+    def __iter__(self):
+        for i in range(len(self.items)):
+            yield self[i]
+
 #-------------------------------------------------------------------------------
 # PkgList - metalinks for repository metadata access
 #-------------------------------------------------------------------------------
@@ -116,20 +347,293 @@ class PkgList():
     def __init__(self):
         self.packages = []
 
+        # Lookup indexes, built on first use by build_indexes(), then kept up
+        # to date by add().
+        self.name_index = None
+        self.name_arch_index = None
+        self.pkgid_index = None
+        self.sorted_names = None
+        self.index_time = None
+
+        # Dependencies of the packages, a DepGraph if they were parsed (see
+        # from_file())
+        self.deps = None
+
+        # The Snapshot the packages are read from (see load_snapshot())
+        self.snapshot = None
+
     def __str__(self):
         s = ''
         for p in self.packages:
             s += f'{p}'
         return s
 
+    def close(self):
+        """Release the snapshot the list was loaded from, if any. Only the
+        packages already accessed remain usable, without their DepGraph."""
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def to_csv(self, filepath):
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(f'{Pkg.csv_header()}\n')
             for p in self.packages:
                 f.write(f'{p.to_csv()}\n')
 
-    def handle_pkg(nd):
+    def to_columns(self):
+        """Return a PkgColumns instance, for vectorized queries (needs numpy)."""
+        return PkgColumns(self.packages)
+
+    #---------------------------------------------------------------------------
+    # Lookup indexes
+    #---------------------------------------------------------------------------
+
+    def own_packages(self):
+        """Make self.packages a list, before modifying it.
+
+        The packages of a snapshot are a read-only LazyPkgs.
+        """
+        if not isinstance(self.packages, list):
+            self.packages = list(self.packages)
+
+    def add(self, p):
+        """Append a package to the list, keeping the indexes up to date."""
+        self.own_packages()
+        self.packages.append(p)
+        if self.name_index is not None:
+            self.index_pkg(p)
+
+    def index_pkg(self, p):
+        l = self.name_index.get(p.name)
+        if l is None:
+            self.name_index[p.name] = l = []
+            if self.sorted_names is not None:
+                bisect.insort(self.sorted_names, p.name)
+        l.append(p)
+        self.name_arch_index.setdefault((p.name, p.arch), []).append(p)
+        self.pkgid_index[p.checksum.value] = p
+
+    def build_indexes(self):
+        """Build the lookup indexes, return the time it took in seconds.
+
+        The indexes are built automatically by the first lookup, this is only
+        needed to rebuild them after self.packages was modified directly.
+        """
+        t = time.perf_counter()
+        self.name_index = {}
+        self.name_arch_index = {}
+        self.pkgid_index = {}
+        self.sorted_names = None
+        for p in self.packages:
+            self.index_pkg(p)
+        self.sorted_names = sorted(self.name_index)
+        self.index_time = time.perf_counter() - t
+        return self.index_time
+
+    def invalidate_indexes(self):
+        self.name_index = None
+        self.name_arch_index = None
+        self.pkgid_index = None
+        self.sorted_names = None
+
+    def ensure_indexes(self):
+        if self.name_index is None:
+            self.build_indexes()
+
+    def find(self, name, arch=None):
+        """Return the list of packages with this name (and arch)."""
+        self.ensure_indexes()
+        if arch is None:
+            return self.name_index.get(name, [])
+        return self.name_arch_index.get((name, arch), [])
+
+    def find_many(self, names, arch=None):
+        """Return a dictionary with the list of packages for each name."""
+        self.ensure_indexes()
+        if arch is None:
+            get = self.name_index.get
+            return {n: get(n, []) for n in names}
+        get = self.name_arch_index.get
+        return {n: get((n, arch), []) for n in names}
+
+    def find_pkgid(self, pkgid):
+        """Return the package with this checksum value, or None."""
+        self.ensure_indexes()
+        return self.pkgid_index.get(pkgid)
+
+    def names_between(self, lo, hi=None):
+        """Return the sorted package names n such that lo <= n < hi."""
+        self.ensure_indexes()
+        i = bisect.bisect_left(self.sorted_names, lo)
+        j = (len(self.sorted_names) if hi is None
+             else bisect.bisect_left(self.sorted_names, hi))
+        return self.sorted_names[i:j]
+
+    def names_with_prefix(self, prefix):
+        """Return the sorted package names starting with prefix."""
+        if prefix == '':
+            return self.names_between('')
+        # The smallest string greater than all those starting with prefix
+        hi = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self.names_between(prefix, hi)
+
+    #---------------------------------------------------------------------------
+    # Versions
+    #---------------------------------------------------------------------------
+
+    def latest(self, name, arch=None):
+        """Return the package with the highest epoch:version-release, or None."""
+        l = self.find(name, arch)
+        if not l:
+            return None
+        return max(l, key=lambda p: p.version.key)
+
+    def newest(self):
+        """Return a PkgList with only the newest package of each name/arch.
+
+        It shares this list's DepGraph, if there's one.
+        """
+        best = {}
+        for p in self.packages:
+            k = (p.name, p.arch)
+            q = best.get(k)
+            if q is None or p.version.key > q.version.key:
+                best[k] = p
+        pl = PkgList()
+        pl.packages = list(best.values())
+        pl.deps = self.deps
+        return pl
+
+    def sort(self):
+        """Sort the packages by name, arch and epoch:version-release."""
+        self.own_packages()
+        self.packages.sort(key=lambda p: (p.name, p.arch, p.version.key))
+        self.invalidate_indexes()
+
+    def index_report(self):
+        """Return a string comparing index build cost and linear scans."""
+        self.ensure_indexes()
+        name = self.packages[-1].name if self.packages else ''
+        t = time.perf_counter()
+        x = [p for p in self.packages if p.name == name]
+        scan = time.perf_counter() - t
+        t = time.perf_counter()
+        x = self.find(name)
+        lookup = time.perf_counter() - t
+        return (f'{len(self.packages)} packages, {len(self.sorted_names)} names:'
+                + f' indexes built in {self.index_time:.6f}s,'
+                + f' one linear scan takes {scan:.6f}s,'
+                + f' one indexed lookup takes {lookup:.6f}s')
+
+    #---------------------------------------------------------------------------
+    # Binary snapshot
+    #---------------------------------------------------------------------------
+
+    def save_snapshot(self, filepath, key=''):
+        """Write the list to a snapshot file, atomically (see Snapshot).
+
+        key identifies the metadata the list was parsed from, normally the
+        checksum of the primary data set.
+        """
+        strings = {}
+        def sid(s):
+            if s is None:
+                return NONE
+            i = strings.get(s)
+            if i is None:
+                i = strings[s] = len(strings)
+            return i
+
+        # The graph is saved if it's the one of all the packages, in order
+        g = self.deps
+        has_graph = (g is not None and len(g.packages) == len(self.packages)
+                     and all(p.format and p.format.graph is g
+                             and p.format.index == i
+                             for i, p in enumerate(self.packages)))
+
+        records = bytearray()
+        for i, p in enumerate(self.packages):
+            f = p.format
+            v = p.version
+            c = p.checksum
+            hr = f.header_range if f else None
+            records += record_format.pack(
+                sid(p.type), sid(p.name), sid(p.arch), sid(v.epoch),
+                sid(v.ver), sid(v.rel), sid(c.type), sid(c.value),
+                sid(c.pkgid), sid(p.summary), sid(p.description),
+                sid(p.packager), sid(p.url), sid(p.location),
+                *[sid(getattr(f, a)) if f else NONE for a in
+                  ['licence', 'vendor', 'group', 'buildhost', 'sourcerpm']],
+                (i if has_graph else 0) if f else NONE,
+                p.pkg_time.file, p.pkg_time.build, p.size.package,
+                p.size.archive, p.size.installed,
+                hr.start if hr else -1, hr.end if hr else -1)
+        if has_graph:
+            if g.provider_offsets is None:
+                g.build_providers()
+            evrs = array.array('I', [NONE] * 3)
+            for v in g.evrs[1:]:
+                evrs.extend([sid(v.epoch), sid(v.ver), sid(v.rel)])
+
+        data = [s.encode('utf-8') for s in strings]
+        offsets = array.array('Q', [0])
+        for b in data:
+            offsets.append(offsets[-1] + len(b))
+
+        dirpath, filename = os.path.split(os.path.abspath(filepath))
+        tmp_path = os.path.join(dirpath, f'.tmp-{filename}.{os.getpid()}')
+        key = key.encode()
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot_header.pack(snapshot_magic, snapshot_version,
+                                         has_graph, len(self.packages),
+                                         len(key)))
+            f.write(key + bytes(-len(key) % 8))
+            write_section(f, offsets.tobytes())
+            write_section(f, b''.join(data))
+            write_section(f, records)
+            if has_graph:
+                write_section(f, '\0'.join(g.cap_names).encode('utf-8'))
+                write_array_section(f, evrs)
+                for d in list(g.deps.values()) + [g.files]:
+                    for name in DepArrays.__slots__:
+                        write_array_section(f, getattr(d, name))
+                for a in [g.provider_offsets, g.provider_pkgs,
+                          g.provider_entries]:
+                    write_array_section(f, a)
+        os.replace(tmp_path, filepath)
+
+    @classmethod
+    def load_snapshot(cls, filepath, key=None):
+        """Return a PkgList from a snapshot file written by save_snapshot().
+
+        If key is given, it must be the one the snapshot was saved with. A
+        RuntimeError is raised if the snapshot can't be used. The file stays
+        mapped until close() is called, or the list is garbage collected.
+        """
+        snapshot = Snapshot(filepath, key)
+        pl = PkgList()
+        pl.snapshot = snapshot
+        if snapshot.has_graph:
+            pl.deps = snapshot.graph()
+        pl.packages = LazyPkgs(snapshot, pl.deps)
+        if snapshot.has_graph:
+            pl.deps.packages = pl.packages
+        return pl
+
+    #---------------------------------------------------------------------------
+    # Parse primary.xml
+    #---------------------------------------------------------------------------
+
+    def handle_pkg(nd, graph=None):
         type = nd.attrib['type']
+        format = None
         
         for k in nd:
             tag = etree.QName(k.tag).localname
@@ -158,9 +662,13 @@ class PkgList():
                             k.attrib['installed'])
             elif tag == 'location':
                 location = k.attrib['href']
+            elif tag == 'format' and graph is not None:
+                format = PkgFormat.handle_format(k, graph)
 
         p = Pkg(type, name, arch, version, checksum, summary, description,
-                           packager, url, pkg_time, size, location, None)
+                           packager, url, pkg_time, size, location, format)
+        if format:
+            graph.packages[format.index] = p
         return p
 
 
@@ -174,10 +682,46 @@ class PkgList():
         return pl
 
     @classmethod
-    def from_file(cls, filepath):
-        """Return a PkgList instance from a primary.xml file."""
-        root = etree.parse(filepath).getroot()
-        return PkgList.parse_root(root)
+    def iter_packages(cls, filepath, ds=None, graph=None):
+        """Yield one Pkg instance per <package> element of a primary.xml file.
+
+        The file is parsed incrementally, and each <package> element is
+        discarded once it has been handled, so memory use doesn't grow with
+        the number of packages in the file. Compressed files (.gz, .xz, .bz2)
+        are decompressed on the fly; if the repomd DataSet is given, its
+        checksums and sizes are verified on the same pass. If a DepGraph is
+        given, the <format> elements are parsed, and the dependencies added
+        to it.
+        """
+        for nd in iter_elements(filepath, 'package', ds):
+            yield PkgList.handle_pkg(nd, graph)
+
+    @classmethod
+    def from_file(cls, filepath, ds=None, deps=False):
+        """Return a PkgList instance from a primary.xml file.
+
+        The <format> elements (dependencies, files, header range) are only
+        parsed if deps is True, into the list's DepGraph.
+        """
+        pl = PkgList()
+        if deps:
+            pl.deps = DepGraph()
+        pl.packages.extend(PkgList.iter_packages(filepath, ds, pl.deps))
+        return pl
+
+    @classmethod
+    def csv_from_file(cls, filepath, csvpath):
+        """Create a .csv file from a primary.xml file, without a PkgList.
+
+        Return the number of packages written out.
+        """
+        cnt = 0
+        with open(csvpath, 'w', encoding='utf-8') as f:
+            f.write(f'{Pkg.csv_header()}\n')
+            for p in PkgList.iter_packages(filepath):
+                f.write(f'{p.to_csv()}\n')
+                cnt += 1
+        return cnt
 
 #===============================================================================
 # main
@@ -191,8 +735,6 @@ if __name__ == '__main__':
     filepath = sys.argv[1]
 
     print(f'Parsing file "{filepath}"')
-    pl = PkgList.from_file(filepath)
-    print(f'Parsing done, found {len(pl.packages)} packages.')
 
     # # Print out a text output
     # print(f'String to be printed is {len(str(pl))} bytes long.')
@@ -201,6 +743,7 @@ if __name__ == '__main__':
     # with open(filename, 'w', encoding='utf-8') as f:
     #     f.write(str(pl))
 
-    # Create a .csv file
+    # Create a .csv file, streaming the packages straight out of the file
     print(f'Creating file toto.txt')
-    pl.to_csv('toto.txt')
+    cnt = PkgList.csv_from_file(filepath, 'toto.txt')
+    print(f'Parsing done, found {cnt} packages.')
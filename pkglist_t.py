@@ -0,0 +1,138 @@
+# pkglist_t.py
+
+import os
+import tempfile
+import unittest
+from pkglist import PkgList, LazyPkgs, snapshot_header, snapshot_magic
+from pkgformat import DepArrays
+from resolve import Resolver
+from pkgformat_t import package_xml, write_primary
+
+key = 'sha256:0123'
+
+def fields(p):
+    """The values of a Pkg and its format, as a comparable tuple."""
+    f = p.format
+    return (p.to_csv(), p.description,
+            f and (f.licence, f.vendor, f.group, f.buildhost, f.sourcerpm,
+                   f.header_range and (f.header_range.start,
+                                       f.header_range.end),
+                   [str(e) for e in f.provides], [str(e) for e in f.requires],
+                   f.files))
+
+# -----------------------------------------------------------------------------
+# SnapshotTest
+# -----------------------------------------------------------------------------
+
+class SnapshotTest(unittest.TestCase):
+    """Test saving package lists as snapshots and loading them back."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(self.filepath, [
+            package_xml('app', '2:1.0-1.fc34', files=['/usr/bin/app'],
+                        provides=['app'],
+                        requires=[('libfoo', 'GE', '2.0'), '/bin/sh']),
+            package_xml('libfoo', '1.5-1', provides=[('libfoo', 'EQ', '1.5-1')]),
+            package_xml('libfoo', '2.1-1', provides=[('libfoo', 'EQ', '2.1-1')]),
+            package_xml('bash', files=['/bin/sh', '/etc/bashrc'],
+                        provides=['bash', 'sh']),
+            package_xml('docs', arch='noarch'),
+        ])
+        self.snap = os.path.join(self.tmp.name, 'primary.snap')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        """Without dependencies"""
+        pl = PkgList.from_file(self.filepath)
+        pl.save_snapshot(self.snap, key)
+        self.assertEqual(['primary.snap', 'primary.xml'],
+                         sorted(os.listdir(self.tmp.name)))
+        with PkgList.load_snapshot(self.snap, key) as loaded:
+            self.assertIsInstance(loaded.packages, LazyPkgs)
+            self.assertIsNone(loaded.deps)
+            self.assertEqual([fields(p) for p in pl.packages],
+                             [fields(p) for p in loaded.packages])
+            self.assertEqual(2, len(loaded.find('libfoo')))
+            self.assertEqual('2.1', loaded.latest('libfoo').version.ver)
+            self.assertEqual('docs', loaded.packages[-1].name)
+            self.assertEqual(['libfoo', 'libfoo'],
+                             [p.name for p in loaded.packages[1:3]])
+
+    def test_graph(self):
+        """The DepGraph arrays, and resolving from a loaded list"""
+        pl = PkgList.from_file(self.filepath, deps=True)
+        expected = Resolver(pl).resolve(['app'])
+        pl.save_snapshot(self.snap, key)
+        with PkgList.load_snapshot(self.snap, key) as loaded:
+            g, h = pl.deps, loaded.deps
+            self.assertIs(loaded.packages, h.packages)
+            self.assertEqual(g.cap_names, h.cap_names)
+            self.assertEqual([v and v.evr() for v in g.evrs],
+                             [v and v.evr() for v in h.evrs])
+            for kind in g.deps:
+                for name in DepArrays.__slots__:
+                    self.assertEqual(list(getattr(g.deps[kind], name)),
+                                     list(getattr(h.deps[kind], name)))
+            for name in ['provider_offsets', 'provider_pkgs',
+                         'provider_entries']:
+                self.assertEqual(list(getattr(g, name)),
+                                 list(getattr(h, name)))
+            self.assertEqual([fields(p) for p in pl.packages],
+                             [fields(p) for p in loaded.packages])
+
+            res = Resolver(loaded).resolve(['app'])
+            self.assertEqual(sorted(p.location for p in expected.packages),
+                             sorted(p.location for p in res.packages))
+
+            # Saved again from the mapped arrays
+            other = os.path.join(self.tmp.name, 'other.snap')
+            loaded.save_snapshot(other, key)
+            with open(self.snap, 'rb') as a, open(other, 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_subset(self):
+        """A list with some of its graph's packages is saved without it"""
+        pl = PkgList.from_file(self.filepath, deps=True).newest()
+        pl.save_snapshot(self.snap, key)
+        with PkgList.load_snapshot(self.snap) as loaded:
+            self.assertIsNone(loaded.deps)
+            self.assertEqual(4, len(loaded.packages))
+            p = loaded.find('app')[0]
+            self.assertEqual('MIT', p.format.licence)
+            self.assertEqual([], p.format.requires)
+
+    def test_modify(self):
+        """Sorting or adding replaces the lazy sequence with a list"""
+        PkgList.from_file(self.filepath).save_snapshot(self.snap, key)
+        with PkgList.load_snapshot(self.snap) as loaded:
+            loaded.sort()
+            self.assertIsInstance(loaded.packages, list)
+            self.assertEqual(['app', 'bash', 'docs', 'libfoo', 'libfoo'],
+                             [p.name for p in loaded.packages])
+            loaded.add(loaded.packages[0])
+            self.assertEqual(6, len(loaded.packages))
+            self.assertEqual(2, len(loaded.find('app')))
+
+    def test_errors(self):
+        """Stale, truncated, or not a snapshot"""
+        PkgList.from_file(self.filepath).save_snapshot(self.snap, key)
+        with self.assertRaises(RuntimeError):
+            PkgList.load_snapshot(self.snap, 'sha256:other')
+        with open(self.snap, 'rb') as f:
+            data = f.read()
+
+        bad = os.path.join(self.tmp.name, 'bad.snap')
+        version = snapshot_header.pack(snapshot_magic, 1, 0, 0, 0)
+        for contents in [b'', b'x' * 100, data[:len(data) // 2],
+                         version + data[snapshot_header.size:]]:
+            with open(bad, 'wb') as f:
+                f.write(contents)
+            with self.assertRaises(RuntimeError):
+                PkgList.load_snapshot(bad)
+
+if __name__ == '__main__':
+    unittest.main()
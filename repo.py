@@ -8,10 +8,76 @@ https://dnf.readthedocs.io/en/latest/conf_ref.html."""
 
 import os
 import re
+import json
+import time
 import requests
-import checksum
 from metalink import Metalink
 from repomd import Repomd
+from lfs.download import save_response, timeout
+from lfs.checksum import check_many
+
+# dnf's default for metadata_expire: 48 hours
+default_expire = 48*3600
+
+#-------------------------------------------------------------------------------
+# parse_expire - convert a metadata_expire value to seconds
+#-------------------------------------------------------------------------------
+
+def parse_expire(value):
+    """Return the metadata_expire value in seconds, or None for 'never'.
+
+    The value is a number of seconds, optionally followed by one of the 's',
+    'm', 'h' or 'd' units. 'never' and -1 mean that the metadata never expires.
+    """
+    if value is None or value == '':
+        return default_expire
+    value = value.strip().lower()
+    if value in ['never', '-1']:
+        return None
+    m = re.match(r'([0-9]+)([smhd]?)$', value)
+    if not m:
+        print(f'Invalid metadata_expire value "{value}", using the default')
+        return default_expire
+    mult = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[m.group(2)]
+    return int(m.group(1)) * mult
+
+#-------------------------------------------------------------------------------
+# parse_bool - convert a boolean option value
+#-------------------------------------------------------------------------------
+
+def parse_bool(value, default=False):
+    """Return the boolean value of a .repo file option (1/0, yes/no...)."""
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ['1', 'yes', 'true', 'on']
+
+#-------------------------------------------------------------------------------
+# conditional_get - HTTP GET with ETag / If-Modified-Since validators
+#-------------------------------------------------------------------------------
+
+def conditional_get(url, validators, session=None):
+    """GET url unless it's unchanged since the validators were recorded.
+
+    validators is a dictionary holding the 'etag' and 'last_modified' values
+    from a previous response, it is updated from this response. Return the
+    response, or None if the server says the resource has not been modified.
+    The response is streamed, its body hasn't been read yet.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    http = session or requests
+    response = http.get(url, headers=headers, timeout=timeout, stream=True)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+
+    validators['etag'] = response.headers.get('ETag')
+    validators['last_modified'] = response.headers.get('Last-Modified')
+    return response
 
 #-------------------------------------------------------------------------------
 # Repo: 
@@ -43,7 +109,12 @@ class Repo():
         self.skip_if_unavailable = skip_if_unavailable
         self.failovermethod = failovermethod
         self.root_url = None
+        # Root URLs on all the known mirrors, best first
+        self.mirrors = []
         self.repo_md = None
+        # Set by get_repomd(): False when the metadata is the same as in the
+        # previous run.
+        self.changed = None
 
     def __str__(self):
         s = f'repo_id: {self.repo_id}\n'
@@ -144,38 +215,98 @@ class Repo():
                 repos.extend(Repo.from_file(os.path.join(dirpath, f)))
         return repos
 
+    #---------------------------------------------------------------------------
+    # Persistent state between runs, used for conditional requests
+    #---------------------------------------------------------------------------
+
+    def state_file(self):
+        return f'{self.repo_id}_state.json'
+
+    def repomd_file(self):
+        """Return the path of the repomd.xml saved by get_repomd()."""
+        return f'{self.repo_id}_repomd.xml'
+
+    def load_state(self):
+        try:
+            with open(self.state_file(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        filename = self.state_file()
+        with open(filename + '.tmp', 'w') as f:
+            f.write(json.dumps(state, indent=4))
+        os.replace(filename + '.tmp', filename)
+
+    def is_fresh(self, state):
+        """True if the cached metadata is still within metadata_expire."""
+        if not (state.get('checked') and state.get('root_url')
+                and os.path.isfile(self.repomd_file())):
+            return False
+        expire = parse_expire(self.metadata_expire)
+        return expire is None or time.time() - state['checked'] < expire
+
     #---------------------------------------------------------------------------
     # Get the repomd.xml file for this repository
     #---------------------------------------------------------------------------
 
-    def get_repomd(self):
+    def get_repomd(self, force=False, session=None):
+        """Return a Repomd instance, refreshing the metadata if needed.
+
+        No request is made at all while the cached metadata is within
+        metadata_expire (unless force is True). Otherwise the metalink and
+        repomd.xml files are requested conditionally, and repomd.xml isn't
+        downloaded again if the metalink shows that it hasn't changed. On
+        return, self.changed tells whether the revision or any data set has
+        changed since the previous run.
+        """
+        state = self.load_state()
+        md_file = self.repomd_file()
+        old_md = Repomd.from_file(md_file) if os.path.isfile(md_file) else None
+
+        if not force and self.is_fresh(state):
+            print(f'Metadata for {self.repo_id} has not expired yet')
+            self.root_url = state['root_url']
+            self.mirrors = state.get('mirrors', [self.root_url])
+            self.changed = False
+            return old_md
+
         # The URL for the repomd.xml file
         url = None
+        ml = None
         
         if self.metalink:
             # Using the mirrors is the preferred approach
             url = self.metalink.replace('$releasever', '31')
             url = url.replace('$basearch', 'x86_64')
             print(f'Retrieving metalink: "{url}"')
-            response = requests.get(url)
-
-            # Write out the XML file
             filename = f'{self.repo_id}_metalink.xml'
-            with open(filename, 'w') as f:
-                f.write(response.text)
+            validators = state.setdefault('metalink', {})
+            response = conditional_get(url, validators, session)
+
+            if response is None and os.path.isfile(filename):
+                print('Metalink not modified')
+            else:
+                if response is None:
+                    # We lost the file, get it unconditionally
+                    validators.clear()
+                    response = conditional_get(url, validators, session)
+                # Write out the XML file
+                save_response(response, filename)
  
-            # Get the location of the repo's data set information
+            # Get the location of the repo's data set information. The
+            # mirrors are only probed if repomd.xml has to be downloaded.
             ml = Metalink.from_file(filename)
-            url = ml.get_best_data_url()
-            m = re.match('(.*)/repodata/repomd\.xml', url)
-            if not m:
-                print(f'Incorrect url: {url}')
+            mirrors = ml.get_root_urls(probe=False)
+            if not mirrors:
+                print(f'No usable mirror in {filename}')
                 return
-            url = m.group(1)
         elif self.baseurl:
             # Docker CE, Google Chrome... use this mchanisms, with no mirrors.
             url = f'{self.baseurl}'.replace('$releasever', '31')
             url = url.replace('$basearch', 'x86_64')
+            mirrors = [url]
         else:
             print(f'Neither metalink nor baseurl found in {self.repo_id}')
             return
@@ -189,34 +320,95 @@ class Repo():
         #     {self.root_url}/repodata/repomd.xml
         #     {self.root_url}/repodata/87aea7f[...]f7-primary.xml.gz
         #     {self.root_url}/Packages/0/...
-        self.root_url = url
+        self.root_url = mirrors[0]
+        self.mirrors = mirrors
 
-        # Get the actual file
-        url = f'{self.root_url}/repodata/repomd.xml'
-        print(f'Retrieving repomd: "{url}"')
-        response = requests.get(url)
-        filename = f'{self.repo_id}_repomd.xml'
+        if ml and old_md and self.matches_metalink(md_file, ml):
+            # The metalink describes the repomd.xml file we already have.
+            # Keep the mirror ranking of the previous run.
+            print('Repomd not modified')
+            known = [u for u in state.get('mirrors', []) if u in mirrors]
+            self.mirrors = known + [u for u in mirrors if u not in known]
+            self.root_url = self.mirrors[0]
+        else:
+            if ml:
+                # Rank the mirrors by probing the ones that respond best
+                mirrors = ml.get_root_urls(session=session) or mirrors
+            validators = state.setdefault('repomd', {})
+            if not old_md:
+                validators.clear()
+            # Fail over to the next mirror if one doesn't respond, or serves
+            # a stale repomd.xml file.
+            for root_url in mirrors:
+                if self.get_repomd_from(root_url, md_file, validators, ml,
+                                        session):
+                    self.root_url = root_url
+                    # Keep the mirror that worked first in line
+                    self.mirrors = [root_url] + [u for u in mirrors
+                                                 if u != root_url]
+                    break
+            else:
+                raise RuntimeError(f'{self.repo_id}: no mirror could provide'
+                                   + ' repomd.xml')
 
-        # On Windows, the line endings get changed whitout the 'newline' arg
-        with open(filename, 'w', newline='\n') as f:
-            f.write(response.text)
+        state['root_url'] = self.root_url
+        state['mirrors'] = self.mirrors
+        state['checked'] = time.time()
+        self.save_state(state)
 
-        # Check the file size and checksum, if we know what to expect
-        if self.metalink:
-            # Check the size of the actual fle on disk, not response.text
-            l = os.stat(filename).st_size
-            # print(f'File size: expected={ml.size}, actual={l}')
-            print(f'File size: {"ok" if ml.size == l else "NOK"}')
+        # Create the object from the file
+        md = Repomd.from_file(md_file)
+        self.changed = not (old_md and md.same_as(old_md))
+        if not self.changed:
+            print(f'Revision {md.revision} unchanged')
+        return md
 
-            # Check all the secure hashes defined in the metalink
+    def get_repomd_from(self, root_url, md_file, validators, ml, session):
+        """Get repomd.xml from one mirror, return True if it worked."""
+        url = f'{root_url}/repodata/repomd.xml'
+        print(f'Retrieving repomd: "{url}"')
+        # The validators only describe the file we got from one mirror. With
+        # a metalink, we already know that file is stale: a 304 would only
+        # mean that the mirror is stale too.
+        sent = {}
+        if not ml and validators.get('root_url') == root_url:
+            sent = {k: validators.get(k) for k in ['etag', 'last_modified']}
+        try:
+            response = conditional_get(url, sent, session)
+        except requests.RequestException as e:
+            print(f'Mirror failed: {e}')
+            return False
+
+        if response is None:
+            print('Repomd not modified')
+            return True
+
+        # Check the file size and checksums while writing it out, if we know
+        # what to expect. The file is saved as is, in binary mode, so its
+        # line endings don't get changed on Windows.
+        hashes = ml.hashes if ml else []
+        size = ml.size if ml else None
+        try:
+            save_response(response, md_file, hashes, size)
+        except (requests.RequestException, RuntimeError) as e:
+            # Probably a mirror that's not up to date
+            print(f'Mirror failed: {e}')
+            return False
+        validators.clear()
+        validators.update(sent)
+        validators['root_url'] = root_url
+        if ml:
+            print(f'File size: ok')
             for h in ml.hashes:
-                if h.check(filename):
-                    print(f'Checksum {h.type}: ok')
-                else:
-                    print(f'Checksum {h.type}: NOK')
+                print(f'Checksum {h.type}: ok')
+        return True
 
-        # Create the object from the file
-        return Repomd.from_file(filename)
+    def matches_metalink(self, filepath, ml):
+        """True if filepath is the repomd.xml file described by ml."""
+        if ml.size is None or os.stat(filepath).st_size != ml.size:
+            return False
+        # All the hashes are computed on a single read of the file
+        return len(ml.hashes) > 0 and all(check_many(ml.hashes, filepath).values())
 
 if __name__ == '__main__':
     print("""This module is not meant to run directly.""")
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# repocache.py - content-addressed cache for repository data sets
+
+"""Data set files (primary, filelists...) are identified by the checksum that
+repomd.xml gives for them, so they are stored in the cache under that checksum:
+a file that has already been retrieved, for any repository and in any run, is
+never downloaded again.
+
+The cache has a size budget; when it's exceeded, the least recently used files
+are removed. Files are written to a temporary name and renamed into place once
+their checksum has been verified (see lfs/download.py), and evictions are
+serialized with a lock file, so several processes can share the same cache
+directory.
+
+"""
+
+import os
+import time
+import requests
+from lfs.download import download, download_segmented, segment_threshold
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: evictions won't be serialized between
+    # processes, everything else still works.
+    fcntl = None
+
+# Default location and size budget, unless specified otherwise
+default_dir = os.path.join(os.path.expanduser('~'), '.cache', 'pkg', 'repodata')
+default_max_bytes = 4*1024**3
+
+#-------------------------------------------------------------------------------
+# CacheLock - exclusive lock on the cache directory
+#-------------------------------------------------------------------------------
+
+class CacheLock():
+    def __init__(self, dirpath):
+        self.filepath = os.path.join(dirpath, '.lock')
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.filepath, 'a')
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+#-------------------------------------------------------------------------------
+# RepoCache -
+#-------------------------------------------------------------------------------
+
+class RepoCache():
+    def __init__(self, dirpath=None, max_bytes=None):
+        self.dirpath = dirpath or os.environ.get('PKG_CACHE_DIR', default_dir)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('PKG_CACHE_MAX_BYTES',
+                                           default_max_bytes))
+        self.max_bytes = max_bytes
+        os.makedirs(self.dirpath, exist_ok=True)
+
+    def __str__(self):
+        return f'cache: {self.dirpath}, max_bytes={self.max_bytes}\n'
+
+    #---------------------------------------------------------------------------
+    # Cache entries
+    #---------------------------------------------------------------------------
+
+    def path_for(self, ds):
+        """Return the path of the cache entry for a repomd DataSet."""
+        v = ds.checksum.value
+        basename = ds.location.rsplit('/', maxsplit=1)[-1]
+        # Fedora's file names already start with the checksum
+        filename = basename if basename.startswith(v) else f'{v}-{basename}'
+        return os.path.join(self.dirpath, v[:2], filename)
+
+    def get(self, ds):
+        """Return the path of the cached file for ds, or None.
+
+        The file is marked as used under the cache lock: an eviction running
+        in another process either removed it already (None is returned), or
+        will see it as the most recently used entry.
+        """
+        filepath = self.path_for(ds)
+        with CacheLock(self.dirpath):
+            try:
+                # The modification time records the last use, for LRU eviction
+                os.utime(filepath)
+            except FileNotFoundError:
+                return None
+        return filepath
+
+    #---------------------------------------------------------------------------
+    # Retrieval
+    #---------------------------------------------------------------------------
+
+    def fetch(self, ds, urls, session=None):
+        """Return the path of the cached file for ds, downloading it if needed.
+
+        urls is the URL of the file, or a list of URLs on different mirrors,
+        tried in turn until one of them works. The file's size and checksum
+        are verified before it enters the cache, a RuntimeError is raised if
+        no mirror could provide the expected file.
+        """
+        filepath = self.get(ds)
+        if filepath:
+            print(f'  In cache: "{filepath}"')
+            return filepath
+
+        if isinstance(urls, str):
+            urls = [urls]
+        if ds.size and ds.size >= segment_threshold:
+            # Large file: fetch segments from all the mirrors at once. If that
+            # fails, the segments already retrieved are kept for next time.
+            try:
+                return self.download_segmented(ds, urls, session)
+            except (requests.RequestException, RuntimeError) as e:
+                print(f'  Segmented download failed: {e}')
+        for url in urls:
+            try:
+                return self.download(ds, url, session)
+            except (requests.RequestException, RuntimeError) as e:
+                print(f'  Download failed: {e}')
+        raise RuntimeError(f'Could not retrieve {ds.location}')
+
+    def download(self, ds, url, session=None):
+        print(f'  Retrieving: "{url}"')
+        filepath = self.path_for(ds)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        # The file only appears under its final name once it's verified
+        download(url, filepath, [ds.checksum], ds.size, session)
+        self.evict(keep=filepath)
+        return filepath
+
+    def download_segmented(self, ds, urls, session=None):
+        print(f'  Retrieving from {len(urls)} mirrors: "{ds.location}"')
+        filepath = self.path_for(ds)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        download_segmented(urls, filepath, [ds.checksum], ds.size,
+                           session=session)
+        self.evict(keep=filepath)
+        return filepath
+
+    #---------------------------------------------------------------------------
+    # LRU eviction
+    #---------------------------------------------------------------------------
+
+    def entries(self):
+        """Return a list of (mtime, size, path) for all the cache entries."""
+        l = []
+        for dirpath, dirnames, filenames in os.walk(self.dirpath):
+            for f in filenames:
+                if f.startswith('.'):
+                    # Lock file, or download in progress
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                l.append((st.st_mtime, st.st_size, path))
+        return l
+
+    def size(self):
+        return sum(sz for _, sz, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until we're within budget."""
+        with CacheLock(self.dirpath):
+            self.clean_temp_files()
+            entries = self.entries()
+            total = sum(sz for _, sz, _ in entries)
+            for _, sz, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Someone else got there first
+                    pass
+                total -= sz
+
+    def clean_temp_files(self, age=24*3600):
+        """Remove temporary files left behind by interrupted downloads."""
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.dirpath):
+            for f in filenames:
+                if not f.startswith('.tmp-'):
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    if now - os.stat(path).st_mtime > age:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+if __name__ == '__main__':
+    print("""This module is not meant to run directly.""")
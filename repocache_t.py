@@ -0,0 +1,141 @@
+# repocache_t.py
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from lfs.checksum import Checksum
+from repomd import DataSet
+from repocache import RepoCache
+
+def data_set(data, name='primary.xml.gz'):
+    v = hashlib.sha256(data).hexdigest()
+    return DataSet('primary', Checksum('sha256', v), f'repodata/{v}-{name}',
+                   0, len(data))
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+# -----------------------------------------------------------------------------
+# RepoCacheTest
+# -----------------------------------------------------------------------------
+
+class RepoCacheTest(unittest.TestCase):
+    """Test the cache entries and their eviction."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RepoCache(os.path.join(self.tmp.name, 'cache'), 1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, ds, data, mtime):
+        filepath = self.cache.path_for(ds)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        os.utime(filepath, (mtime, mtime))
+        return filepath
+
+    def test_path_for(self):
+        """Entries are named after their checksum"""
+        ds = data_set(b'abc')
+        v = ds.checksum.value
+        self.assertEqual(os.path.join(self.cache.dirpath, v[:2],
+                                      f'{v}-primary.xml.gz'),
+                         self.cache.path_for(ds))
+        ds.location = 'repodata/primary.xml.gz'
+        self.assertEqual(os.path.join(self.cache.dirpath, v[:2],
+                                      f'{v}-primary.xml.gz'),
+                         self.cache.path_for(ds))
+
+    def test_get(self):
+        """get() finds an entry and marks it as used"""
+        ds = data_set(b'abc')
+        self.assertIsNone(self.cache.get(ds))
+        filepath = self.add(ds, b'abc', 1000)
+        self.assertEqual(filepath, self.cache.get(ds))
+        self.assertGreater(os.stat(filepath).st_mtime, time.time() - 60)
+
+    def test_evict(self):
+        """The least recently used entries go first, keep is kept"""
+        now = time.time()
+        paths = [self.add(data_set(bytes([i]) * 400), bytes([i]) * 400,
+                          now - 100 + i)
+                 for i in range(4)]
+        self.cache.evict(keep=paths[0])
+        self.assertEqual([True, False, False, True],
+                         [os.path.exists(p) for p in paths])
+        self.assertLessEqual(self.cache.size(), 1000)
+
+    def test_temp_files(self):
+        """Only old temporary files are removed, and never counted"""
+        dirpath = os.path.join(self.cache.dirpath, 'ab')
+        os.makedirs(dirpath)
+        old, new = [os.path.join(dirpath, f'.tmp-{n}') for n in 'ab']
+        for path in [old, new]:
+            with open(path, 'wb') as f:
+                f.write(b'x' * 2000)
+        os.utime(old, (0, 0))
+        self.assertEqual(0, self.cache.size())
+        self.cache.evict()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+# -----------------------------------------------------------------------------
+# FetchTest
+# -----------------------------------------------------------------------------
+
+class FetchTest(unittest.TestCase):
+    """Test retrieval from a local HTTP server."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = RepoCache(os.path.join(self.tmp.name, 'cache'))
+        self.root = os.path.join(self.tmp.name, 'www')
+        handler = partial(QuietHandler, directory=self.root)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def publish(self, data):
+        ds = data_set(data)
+        path = os.path.join(self.root, ds.location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return ds
+
+    def test_fetch(self):
+        """A missing mirror is skipped, the second call hits the cache"""
+        data = os.urandom(5000)
+        ds = self.publish(data)
+        urls = [f'{self.url}/missing/{ds.location}', f'{self.url}/{ds.location}']
+        filepath = self.cache.fetch(ds, urls)
+        with open(filepath, 'rb') as f:
+            self.assertEqual(data, f.read())
+
+        os.remove(os.path.join(self.root, ds.location))
+        self.assertEqual(filepath, self.cache.fetch(ds, urls))
+
+    def test_fetch_mismatch(self):
+        """A file that doesn't match its checksum never enters the cache"""
+        ds = self.publish(b'abc')
+        ds.checksum = Checksum('sha256', '0' * 64)
+        with self.assertRaises(RuntimeError):
+            self.cache.fetch(ds, f'{self.url}/{ds.location}')
+        self.assertEqual([], self.cache.entries())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,15 @@ import re
 import requests
 from lxml import etree
 from lfs.checksum import Checksum
+import zchunk
+from pkglist import PkgList
+from pkgdb import PkgDb
+from filelists import FileIndex
+from repocache import RepoCache
+
+def root_urls(root_url, mirrors):
+    """Return root_url followed by the other mirrors, to try in that order."""
+    return [root_url] + [u for u in mirrors or [] if u != root_url]
 
 #-------------------------------------------------------------------------------
 # DataSet - 
@@ -169,19 +178,135 @@ class Repomd():
         root = etree.parse(filepath).getroot()
         return Repomd.parse_root(root)
 
-    def get_pkg_lists(self, root_url):
+    def same_as(self, other):
+        """True if other has the same revision and data sets as self."""
+        if self.revision != other.revision:
+            return False
+        mine = {(ds.type, ds.timestamp, ds.checksum.value)
+                for ds in self.data_sets}
+        theirs = {(ds.type, ds.timestamp, ds.checksum.value)
+                  for ds in other.data_sets}
+        return mine == theirs
+
+    def get_data_set(self, type):
+        """Return the data set of the given type, or None."""
         for ds in self.data_sets:
-            url = f'{root_url}/{ds.location}'
-            print(f'type={ds.type}, sz={ds.size}, url={url}')
-            if ds.type == 'primary':
-                print(f'  Retrieving primary: "{url}"')
-                response = requests.get(url)
+            if ds.type == type:
+                return ds
+
+    def get_pkg_lists(self, root_url, cache=None, session=None, mirrors=None,
+                      deps=False):
+        """Retrieve the primary data set and return it as a PkgList.
+
+        The file is kept in a RepoCache (the default one if cache is None),
+        and only downloaded if it's not already there. mirrors is a list of
+        other root URLs, tried in turn if root_url fails. If deps is True, the
+        dependencies are parsed too (see PkgList.from_file()).
+
+        The zchunk variant of the data set is preferred when zstandard is
+        available: a previous version in the cache then saves downloading
+        the chunks that didn't change.
+
+        The parsed list is saved as a snapshot next to the cached primary
+        data set, keyed by its checksum: as long as the metadata doesn't
+        change, the next calls load the snapshot instead of parsing again. A
+        snapshot saved without the dependencies is parsed again if they're
+        needed.
+        """
+        if cache is None:
+            cache = RepoCache()
+        roots = root_urls(root_url, mirrors)
+        primary = self.get_data_set('primary')
+        if primary:
+            snapshot_path = cache.path_for(primary) + '.snap'
+            key = f'{primary.checksum.type}:{primary.checksum.value}'
+            try:
+                pl = PkgList.load_snapshot(snapshot_path, key)
+                if pl.deps is not None or not deps:
+                    os.utime(snapshot_path)
+                    print(f'  Snapshot: "{snapshot_path}",'
+                          + f' {len(pl.packages)} packages')
+                    return pl
+                pl.close()
+            except (OSError, RuntimeError):
+                pass
+
+        pl = None
+        ds = self.get_data_set('primary_zck')
+        if ds and zchunk.zstandard:
+            urls = [f'{u}/{ds.location}' for u in roots]
+            try:
+                filepath = zchunk.fetch(cache, ds, urls, session)
+                pl = PkgList.from_file(filepath, ds, deps)
+            except (requests.RequestException, RuntimeError) as e:
+                print(f'  zchunk failed: {e}')
+
+        if pl is None:
+            if primary is None:
+                return None
+            urls = [f'{u}/{primary.location}' for u in roots]
+            filepath = cache.fetch(primary, urls, session)
+
+            # Checksums and sizes get verified while parsing the file
+            pl = PkgList.from_file(filepath, primary, deps)
+        print(f'  Checksum: ok, {len(pl.packages)} packages')
+
+        if primary:
+            try:
+                os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+                pl.save_snapshot(snapshot_path, key)
+            except OSError as e:
+                print(f'  Snapshot not saved: {e}')
+        return pl
+
+    def get_pkg_db(self, root_url, cache=None, session=None, mirrors=None):
+        """Return a PkgDb for the primary_db data set, for quick lookups.
+
+        If the repository has no primary_db data set, or one we can't use,
+        fall back to get_pkg_lists() and return a PkgList, which supports
+        the same lookups (except what_provides()).
+        """
+        if cache is None:
+            cache = RepoCache()
+        roots = root_urls(root_url, mirrors)
+        ds = self.get_data_set('primary_db')
+        if ds:
+            urls = [f'{u}/{ds.location}' for u in roots]
+            try:
+                db = PkgDb.from_data_set(cache, ds, urls, session)
+                print(f'  Database: ok, {len(db)} packages')
+                return db
+            except (requests.RequestException, RuntimeError) as e:
+                print(f'  primary_db not usable: {e}')
+        return self.get_pkg_lists(root_url, cache, session, mirrors)
+
+    def get_file_index(self, root_url, cache=None, session=None, mirrors=None):
+        """Return a FileIndex for the filelists data set, or None.
 
-                filename = url.rsplit('/', maxsplit=1)[1]
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
+        The index is saved next to the cached data set, so it's only built
+        the first time.
+        """
+        if cache is None:
+            cache = RepoCache()
+        ds = self.get_data_set('filelists')
+        if ds is None:
+            return None
+        index_path = cache.path_for(ds) + '.idx'
+        try:
+            fi = FileIndex.load(index_path)
+            os.utime(index_path)
+            print(f'  In cache: "{index_path}"')
+            return fi
+        except (OSError, RuntimeError):
+            pass
 
-                print(f'  Checksum: {"ok" if ds.checksum.check(filename) else "NOK"}')
+        roots = root_urls(root_url, mirrors)
+        urls = [f'{u}/{ds.location}' for u in roots]
+        filepath = cache.fetch(ds, urls, session)
+        fi = FileIndex.from_file(filepath, ds)
+        fi.save(index_path)
+        print(f'  Checksum: ok, {fi}', end='')
+        return fi
 
 if __name__ == '__main__':
     print("""This module is not meant to run directly.""")
@@ -0,0 +1,255 @@
+#!/usr/bin/python
+# resolve.py - the set of packages needed to install some packages
+
+"""Given a few package names, compute their dependency closure in a PkgList:
+every package that has to be downloaded to install them, e.g. to pre-stage
+package sets for hosts without network access.
+
+The work is done on the PkgList's DepGraph (see pkgformat.py), with integer
+ids only: requirements are looked up in the reverse provides index, and the
+set of selected packages is a bytearray indexed by package. For each distinct
+requirement (capability, flags, version), the matching providers and the
+best one are computed once, and reused by every package with the same
+requirement.
+
+The best provider is the one whose name is the capability, then the one with
+the preferred architecture, then the highest epoch:version-release. A
+requirement is satisfied without adding anything if one of the packages
+already selected provides it. Requirements that nothing provides are
+reported, and rpmlib() ones are skipped, they're provided by rpm itself.
+
+"""
+
+import sys
+import time
+
+from pkglist import PkgList
+from pkgformat import file_entry
+
+# Architectures, by order of preference, for each machine architecture
+arch_preferences = {
+    'x86_64': ['x86_64', 'noarch', 'i686', 'i586', 'i486', 'i386'],
+    'aarch64': ['aarch64', 'noarch'],
+    'ppc64le': ['ppc64le', 'noarch'],
+    's390x': ['s390x', 'noarch'],
+    'i686': ['i686', 'noarch', 'i586', 'i486', 'i386'],
+}
+
+# Flag codes (see pkgformat.flag_codes) as sets of EQ, LT, GT bits
+EQ, LT, GT = 1, 2, 4
+flag_bits = [0, EQ, LT, LT | EQ, GT, GT | EQ]
+
+#-------------------------------------------------------------------------------
+# satisfies - does a versioned provide match a versioned requirement
+#-------------------------------------------------------------------------------
+
+def satisfies(p_flags, p_evr, r_flags, r_evr):
+    """True if the range of versions of a provide overlaps the requirement's.
+
+    Flags are codes from pkgformat.flag_codes, versions are Version instances
+    or None. As in rpm, a requirement or a provide without a version matches
+    anything, and the release is only compared if both sides have one.
+    """
+    if not r_flags or not p_flags or r_evr is None or p_evr is None:
+        return True
+    pk, rk = p_evr.key, r_evr.key
+    if not (r_evr.rel and p_evr.rel):
+        pk, rk = pk[:2], rk[:2]
+    p, r = flag_bits[p_flags], flag_bits[r_flags]
+    if pk < rk:
+        return bool(p & GT or r & LT)
+    if pk > rk:
+        return bool(p & LT or r & GT)
+    return bool(p & r & EQ or p & r & LT or p & r & GT)
+
+#-------------------------------------------------------------------------------
+# Resolution - the outcome of a resolution
+#-------------------------------------------------------------------------------
+
+class Resolution():
+    def __init__(self, packages, unresolved, missing, elapsed):
+        # The Pkg instances to download
+        self.packages = packages
+        # (Pkg, requirement string) for requirements nothing provides
+        self.unresolved = unresolved
+        # Requested names that no package has or provides
+        self.missing = missing
+        self.elapsed = elapsed
+
+    def __str__(self):
+        s = (f'{len(self.packages)} packages, {len(self.unresolved)}'
+             + f' unresolved requirements, {len(self.missing)} missing'
+             + f' names, in {self.elapsed:.3f}s\n')
+        for name in self.missing:
+            s += f'    missing: {name}\n'
+        for p, req in self.unresolved:
+            s += f'    unresolved: {p.name} requires {req}\n'
+        return s
+
+    def size(self):
+        """Return the total download size in bytes."""
+        return sum(p.size.package for p in self.packages)
+
+#-------------------------------------------------------------------------------
+# Resolver -
+#-------------------------------------------------------------------------------
+
+class Resolver():
+    def __init__(self, pl, arch='x86_64', weak=False):
+        """Resolve against a PkgList parsed with its dependencies.
+
+        arch is the architecture of the target hosts. If weak is True, the
+        recommends are followed too. pl may have only some of the packages
+        of its DepGraph (see PkgList.newest()), the others are never selected.
+        """
+        self.pl = pl
+        self.graph = pl.deps
+        if self.graph is None or not self.graph.packages:
+            raise RuntimeError('The PkgList has no dependency data')
+        self.kinds = ['requires', 'recommends'] if weak else ['requires']
+
+        # Architecture preference of each package, lower is better
+        prefs = arch_preferences.get(arch, [arch, 'noarch'])
+        arch_rank = {a: i for i, a in enumerate(prefs)}
+        packages = self.graph.packages
+        self.arch_rank = [arch_rank.get(p.arch, len(prefs)) for p in packages]
+        self.compatible = bytearray(p.arch in arch_rank for p in packages)
+        if pl.packages is not packages:
+            member = bytearray(len(packages))
+            for p in pl.packages:
+                if p.format and p.format.graph is self.graph:
+                    member[p.format.index] = 1
+            self.compatible = bytearray(a & b for a, b in
+                                        zip(self.compatible, member))
+
+        # Requirement (cap id, flags, evr id) -> (providers, best)
+        self.cache = {}
+        self.skipped = set(i for name, i in self.graph.cap_ids.items()
+                           if name.startswith('rpmlib('))
+
+        # Build the indexes now rather than during the first resolution
+        pl.ensure_indexes()
+        if self.graph.provider_offsets is None:
+            self.graph.build_providers()
+
+    def best(self, candidates, name):
+        """Return the preferred package index among candidates, or -1."""
+        if len(candidates) < 2:
+            return candidates[0] if candidates else -1
+        packages = self.graph.packages
+        def pref(i):
+            return (packages[i].name != name, self.arch_rank[i])
+        top = min(pref(i) for i in candidates)
+        return max((i for i in candidates if pref(i) == top),
+                   key=lambda i: packages[i].version.key)
+
+    def providers(self, cap, flags, evr):
+        """Return (matching providers, best provider or -1), cached."""
+        k = (cap, flags, evr)
+        v = self.cache.get(k)
+        if v is not None:
+            return v
+        g = self.graph
+        r_evr = g.evrs[evr]
+        provides = g.deps['provides']
+        pkgs, entries = g.provider_pkgs, g.provider_entries
+        # Ordered set of the matching packages
+        matches = {}
+        for n in range(g.provider_offsets[cap], g.provider_offsets[cap + 1]):
+            i = pkgs[n]
+            if not self.compatible[i] or i in matches:
+                continue
+            # A file provide has no version, otherwise the provide has to
+            # match the range.
+            j = entries[n]
+            if (not flags or j == file_entry
+                    or satisfies(provides.flags[j], g.evrs[provides.evrs[j]],
+                                 flags, r_evr)):
+                matches[i] = None
+        matches = list(matches)
+        best = self.best(matches, g.cap_names[cap])
+        v = self.cache[k] = (matches, best)
+        return v
+
+    def best_of_name(self, name):
+        """Return the index of the best package named name, or -1."""
+        candidates = [p.format.index for p in self.pl.find(name)
+                      if p.format and self.compatible[p.format.index]]
+        return self.best(candidates, name)
+
+    def resolve(self, names):
+        """Return a Resolution for a list of package names (or capabilities)."""
+        t = time.perf_counter()
+        g = self.graph
+        selected = bytearray(len(g.packages))
+        todo = []
+        missing = []
+        unresolved = []
+
+        def select(i):
+            if not selected[i]:
+                selected[i] = 1
+                todo.append(i)
+
+        for name in names:
+            i = self.best_of_name(name)
+            if i < 0:
+                cap = g.cap_ids.get(name)
+                if cap is not None:
+                    i = self.providers(cap, 0, 0)[1]
+            if i < 0:
+                missing.append(name)
+            else:
+                select(i)
+
+        while todo:
+            i = todo.pop()
+            for kind in self.kinds:
+                d = g.deps[kind]
+                start, end = d.range(i)
+                for j in range(start, end):
+                    cap = d.caps[j]
+                    if cap in self.skipped:
+                        continue
+                    matches, best = self.providers(cap, d.flags[j], d.evrs[j])
+                    if best < 0:
+                        if kind == 'requires':
+                            unresolved.append((g.packages[i],
+                                               self.requirement(d, j)))
+                        continue
+                    if any(selected[m] for m in matches):
+                        continue
+                    select(best)
+
+        packages = [g.packages[i] for i in range(len(selected)) if selected[i]]
+        return Resolution(packages, unresolved, missing,
+                          time.perf_counter() - t)
+
+    def requirement(self, d, j):
+        g = self.graph
+        s = g.cap_names[d.caps[j]]
+        evr = g.evrs[d.evrs[j]]
+        if d.flags[j] and evr:
+            op = ['', '=', '<', '<=', '>', '>='][d.flags[j]]
+            s += f' {op} {evr.evr()}'
+        return s
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(f'Usage: {sys.argv[0]} <primary.xml> <arch> <name>...')
+        exit(-1)
+    filepath = sys.argv[1]
+    arch = sys.argv[2]
+
+    t = time.perf_counter()
+    pl = PkgList.from_file(filepath, deps=True)
+    print(f'Parsed {len(pl.packages)} packages in {time.perf_counter() - t:.2f}s')
+    res = Resolver(pl, arch).resolve(sys.argv[3:])
+    print(res, end='')
+    print(f'Download size: {res.size()} bytes')
+    for p in sorted(res.packages, key=lambda p: p.location):
+        print(p.location)
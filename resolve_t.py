@@ -0,0 +1,171 @@
+# resolve_t.py
+
+import os
+import tempfile
+import unittest
+from version import Version
+from pkgformat import flag_codes
+from pkglist import PkgList
+from resolve import satisfies, Resolver
+from pkgformat_t import package_xml, write_primary
+
+def v(evr):
+    epoch, _, vr = evr.rpartition(':')
+    ver, _, rel = vr.partition('-')
+    return Version(epoch or '0', ver, rel or None)
+
+# -----------------------------------------------------------------------------
+# SatisfiesTest
+# -----------------------------------------------------------------------------
+
+class SatisfiesTest(unittest.TestCase):
+    """Test the matching of versioned provides and requirements."""
+
+    def check(self, provide, require, expected):
+        p_flags, p_evr = provide.split()
+        r_flags, r_evr = require.split()
+        self.assertEqual(expected,
+                         satisfies(flag_codes[p_flags], v(p_evr),
+                                   flag_codes[r_flags], v(r_evr)),
+                         f'{provide} / {require}')
+
+    def test_equal(self):
+        """A provide of one version"""
+        self.check('EQ 1.0-1', 'EQ 1.0-1', True)
+        self.check('EQ 1.0-1', 'EQ 1.0-2', False)
+        self.check('EQ 1.0-1', 'GE 1.0', True)
+        self.check('EQ 1.0-1', 'GT 1.0', False)
+        self.check('EQ 1.0-1', 'LT 1.1', True)
+        self.check('EQ 1.0-1', 'LE 0.9', False)
+        self.check('EQ 2.0-1', 'GT 1.0-5', True)
+        self.check('EQ 1:1.0-1', 'GE 2.0', True)
+
+    def test_release(self):
+        """The release only counts if both sides have one"""
+        self.check('EQ 1.0', 'EQ 1.0-7', True)
+        self.check('EQ 1.0-7', 'EQ 1.0', True)
+        self.check('EQ 1.0-7', 'LT 1.0-7', False)
+        self.check('EQ 1.0-7', 'LE 1.0-7', True)
+
+    def test_ranges(self):
+        """Both sides are ranges"""
+        self.check('GE 2.0', 'LT 3.0', True)
+        self.check('GE 2.0', 'LT 2.0', False)
+        self.check('GE 2.0', 'LE 2.0', True)
+        self.check('LT 2.0', 'GT 1.0', True)
+        self.check('LT 2.0', 'GE 2.0', False)
+        self.check('GT 2.0', 'GT 1.0', True)
+        self.check('LE 1.0', 'LT 0.5', True)
+
+    def test_unversioned(self):
+        """No version on either side matches anything"""
+        self.assertTrue(satisfies(0, None, flag_codes['EQ'], v('1.0')))
+        self.assertTrue(satisfies(flag_codes['EQ'], v('1.0'), 0, None))
+
+# -----------------------------------------------------------------------------
+# ResolverTest
+# -----------------------------------------------------------------------------
+
+class ResolverTest(unittest.TestCase):
+    """Test dependency closures."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(self.filepath, [
+            package_xml('app', requires=[('libfoo', 'GE', '2.0'), '/bin/sh',
+                                         'rpmlib(PayloadIsZstd)', 'config'],
+                        recommends=['docs']),
+            package_xml('libfoo', '1.5-1', provides=[('libfoo', 'EQ', '1.5-1')]),
+            package_xml('libfoo', '2.1-1', provides=[('libfoo', 'EQ', '2.1-1')]),
+            package_xml('libfoo', '2.2-1', arch='i686',
+                        provides=[('libfoo', 'EQ', '2.2-1')]),
+            package_xml('libfoo', '2.3-1', arch='aarch64',
+                        provides=[('libfoo', 'EQ', '2.3-1')]),
+            package_xml('bash', files=['/bin/sh'], requires=['libfoo']),
+            package_xml('dash', files=['/bin/sh']),
+            package_xml('config-a', provides=['config']),
+            package_xml('config-b', '2.0-1', provides=['config']),
+            package_xml('docs', arch='noarch', provides=['docs']),
+            package_xml('broken', requires=['nothing']),
+        ])
+        self.pl = PkgList.from_file(self.filepath, deps=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def names(self, res):
+        return sorted(f'{p.name}-{p.version.ver}.{p.arch}'
+                      for p in res.packages)
+
+    def test_closure(self):
+        """Versioned requirements, files, preferred architecture"""
+        res = Resolver(self.pl, 'x86_64').resolve(['app'])
+        self.assertEqual(['app-1.0.x86_64', 'bash-1.0.x86_64',
+                          'config-b-2.0.x86_64', 'libfoo-2.1.x86_64'],
+                         self.names(res))
+        self.assertEqual([], res.unresolved)
+        self.assertEqual([], res.missing)
+        self.assertEqual(4000, res.size())
+
+    def test_selected_provider(self):
+        """A requirement already satisfied adds nothing"""
+        res = Resolver(self.pl).resolve(['dash', 'app'])
+        self.assertIn('dash-1.0.x86_64', self.names(res))
+        self.assertNotIn('bash-1.0.x86_64', self.names(res))
+
+    def test_weak(self):
+        """Recommends are followed on request"""
+        res = Resolver(self.pl, weak=True).resolve(['app'])
+        self.assertIn('docs-1.0.noarch', self.names(res))
+
+    def test_arch(self):
+        """Other architectures are never selected"""
+        res = Resolver(self.pl, 'aarch64').resolve(['libfoo'])
+        self.assertEqual(['libfoo-2.3.aarch64'], self.names(res))
+        res = Resolver(self.pl, 'aarch64').resolve(['app'])
+        self.assertEqual(['app'], res.missing)
+
+    def test_missing_unresolved(self):
+        """Unknown names, and requirements nothing provides"""
+        res = Resolver(self.pl).resolve(['broken', 'nope', 'config'])
+        self.assertEqual(['nope'], res.missing)
+        self.assertEqual([('broken', 'nothing')],
+                         [(p.name, r) for p, r in res.unresolved])
+        self.assertEqual(['broken-1.0.x86_64', 'config-b-2.0.x86_64'],
+                         self.names(res))
+        self.assertIn('unresolved: broken requires nothing', str(res))
+
+    def test_subset(self):
+        """Only the packages of the list, e.g. the newest ones"""
+        pl = self.pl.newest()
+        res = Resolver(pl).resolve(['libfoo'])
+        self.assertEqual(['libfoo-2.1.x86_64'], self.names(res))
+
+        pl.packages = [p for p in pl.packages if p.name != 'config-b']
+        res = Resolver(pl).resolve(['app'])
+        self.assertIn('config-a-1.0.x86_64', self.names(res))
+
+    def test_cache(self):
+        """Providers are cached per requirement"""
+        r = Resolver(self.pl)
+        r.resolve(['app'])
+        g = self.pl.deps
+        d = g.deps['requires']
+        i = self.pl.find('app')[0].format.index
+        start, end = d.range(i)
+        keys = [(d.caps[j], d.flags[j], d.evrs[j]) for j in range(start, end)
+                if d.caps[j] not in r.skipped]
+        self.assertEqual(3, len(keys))
+        for k in keys:
+            self.assertIn(k, r.cache)
+            self.assertIs(r.cache[k], r.providers(*k))
+        self.assertTrue(all(isinstance(k, tuple) for k in r.cache))
+
+    def test_no_deps(self):
+        """A list parsed without dependencies can't be resolved"""
+        with self.assertRaises(RuntimeError):
+            Resolver(PkgList.from_file(self.filepath))
+
+if __name__ == '__main__':
+    unittest.main()
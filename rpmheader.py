@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# rpmheader.py - read rpm package headers, fetching only their bytes
+
+"""The metadata of an rpm package (name, version, dependencies, files,
+changelog...) is in its header, a few KB at the start of a file which may be
+many MB long. primary.xml gives the header's byte range in the file, as
+<rpm:header-range start end> (end is exclusive), so a header can be fetched
+with an HTTP range request, without downloading the package.
+
+A header is a magic number, an index of (tag, type, offset, count) entries,
+and a data store holding the values. RpmHeader decodes the values of the
+tags it's asked for, only when they're asked for.
+
+"""
+
+import sys
+import time
+import struct
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from version import Version
+from pkglist import PkgList
+from pkgformat import DepsEntry
+from lfs.download import timeout
+
+#-------------------------------------------------------------------------------
+# Header format
+#-------------------------------------------------------------------------------
+
+header_magic = b'\x8e\xad\xe8\x01'
+
+# An .rpm file is a lead, a signature header, then the header and payload
+lead_magic = b'\xed\xab\xee\xdb'
+lead_size = 96
+
+# Data types
+NULL, CHAR, INT8, INT16, INT32, INT64, STRING, BIN, STRING_ARRAY, I18NSTRING = range(10)
+
+# Item format and size for the numeric types
+int_formats = {CHAR: ('B', 1), INT8: ('B', 1), INT16: ('H', 2), INT32: ('I', 4),
+               INT64: ('Q', 8)}
+
+# The tags we know about
+tags = {
+    'name': 1000, 'version': 1001, 'release': 1002, 'epoch': 1003,
+    'summary': 1004, 'description': 1005, 'buildtime': 1006,
+    'buildhost': 1007, 'size': 1009, 'vendor': 1011, 'license': 1014,
+    'packager': 1015, 'group': 1016, 'url': 1020, 'os': 1021, 'arch': 1022,
+    'oldfilenames': 1027, 'filesizes': 1028, 'filemodes': 1030,
+    'filedigests': 1035, 'filelinktos': 1036, 'fileflags': 1037,
+    'fileusername': 1039, 'filegroupname': 1040, 'sourcerpm': 1044,
+    'archivesize': 1046, 'providename': 1047, 'requireflags': 1048,
+    'requirename': 1049, 'requireversion': 1050, 'conflictflags': 1053,
+    'conflictname': 1054, 'conflictversion': 1055, 'changelogtime': 1080,
+    'changelogname': 1081, 'changelogtext': 1082, 'obsoletename': 1090,
+    'provideflags': 1112, 'provideversion': 1113, 'obsoleteflags': 1114,
+    'obsoleteversion': 1115,
+    'dirindexes': 1116, 'basenames': 1117, 'dirnames': 1118,
+    'payloadformat': 1124, 'payloadcompressor': 1125,
+    'recommendname': 5046, 'recommendversion': 5047, 'recommendflags': 5048,
+    'suggestname': 5049, 'suggestversion': 5050, 'suggestflags': 5051,
+    'supplementname': 5052, 'supplementversion': 5053,
+    'supplementflags': 5054, 'enhancename': 5055, 'enhanceversion': 5056,
+    'enhanceflags': 5057,
+}
+
+# Dependency sense flags
+RPMSENSE_LESS = 0x02
+RPMSENSE_GREATER = 0x04
+RPMSENSE_EQUAL = 0x08
+RPMSENSE_PREREQ = 0x40
+RPMSENSE_SCRIPT_PRE = 0x200
+RPMSENSE_SCRIPT_POST = 0x400
+
+sense_names = {
+    RPMSENSE_EQUAL: 'EQ',
+    RPMSENSE_LESS: 'LT',
+    RPMSENSE_LESS | RPMSENSE_EQUAL: 'LE',
+    RPMSENSE_GREATER: 'GT',
+    RPMSENSE_GREATER | RPMSENSE_EQUAL: 'GE',
+}
+
+def header_size(buf, offset=0):
+    """Return the size of the header at offset in buf, from its preamble."""
+    if bytes(buf[offset:offset + 4]) != header_magic:
+        raise RuntimeError('Not an rpm header')
+    nindex, hsize = struct.unpack_from('>II', buf, offset + 8)
+    return 16 + 16 * nindex + hsize
+
+def package_headers(buf):
+    """Return (signature, header, start) for an .rpm file in buf (bytes or
+    mmap), start being the offset of the header in the file."""
+    if bytes(buf[:4]) != lead_magic:
+        raise RuntimeError('Not an rpm package')
+    sig = RpmHeader(buf, lead_size)
+    # The header is aligned on 8 bytes after the signature
+    start = lead_size + (sig.size + 7) // 8 * 8
+    return sig, RpmHeader(buf, start), start
+
+def parse_evr(s):
+    """Return a Version from an [epoch:]version[-release] string, or None."""
+    if not s:
+        return None
+    epoch, _, vr = s.rpartition(':')
+    ver, _, rel = vr.partition('-')
+    return Version(epoch or None, ver, rel or None)
+
+#-------------------------------------------------------------------------------
+# RpmHeader -
+#-------------------------------------------------------------------------------
+
+class RpmHeader():
+    def __init__(self, buf, offset=0):
+        """Parse the index of the header at offset in buf (bytes or mmap)."""
+        size = header_size(buf, offset)
+        if len(buf) < offset + size:
+            raise RuntimeError(f'Truncated rpm header: {len(buf) - offset}'
+                               + f' bytes, expected {size}')
+        nindex, hsize = struct.unpack_from('>II', buf, offset + 8)
+        self.size = size
+        store = offset + 16 + 16 * nindex
+        self.data = bytes(buf[store:store + hsize])
+        # tag -> (type, offset in data, count)
+        self.index = {}
+        for tag, type, off, count in struct.iter_unpack(
+                '>iiii', buf[offset + 16:store]):
+            self.index[tag] = (type, off, count)
+
+    def __str__(self):
+        s = f'{self.get("name")}-{self.evr().evr()}.{self.get("arch")}\n'
+        s += f'    summary: {self.get("summary")}\n'
+        s += f'    license: {self.get("license")}\n'
+        s += f'    sourcerpm: {self.get("sourcerpm")}\n'
+        s += f'    buildtime: {self.get("buildtime")}\n'
+        for kind in ['provides', 'requires']:
+            s += f'    {kind}: {len(self.deps(kind))}\n'
+        s += f'    files: {len(self.files())}\n'
+        log = self.changelog()
+        if log:
+            s += f'    changelog: {log[0][1]}\n'
+        return s
+
+    def __contains__(self, tag):
+        return tags.get(tag, tag) in self.index
+
+    def get(self, tag, default=None):
+        """Return the value of a tag (name or number), or default.
+
+        Strings are returned as str, arrays as lists, scalars as themselves.
+        """
+        e = self.index.get(tags.get(tag, tag))
+        if e is None:
+            return default
+        type, off, count = e
+        if type in int_formats:
+            fmt, size = int_formats[type]
+            values = struct.unpack_from(f'>{count}{fmt}', self.data, off)
+            return values[0] if count == 1 and type != CHAR else list(values)
+        if type == BIN:
+            return self.data[off:off + count]
+        if type == STRING:
+            end = self.data.index(b'\0', off)
+            return self.data[off:end].decode('utf-8', 'replace')
+        if type in [STRING_ARRAY, I18NSTRING]:
+            l = []
+            for i in range(count):
+                end = self.data.index(b'\0', off)
+                l.append(self.data[off:end].decode('utf-8', 'replace'))
+                off = end + 1
+            # Only the first translation of an i18n string
+            return l[0] if type == I18NSTRING else l
+        return default
+
+    def as_list(self, tag):
+        v = self.get(tag, [])
+        return v if isinstance(v, list) else [v]
+
+    #---------------------------------------------------------------------------
+    # Derived values
+    #---------------------------------------------------------------------------
+
+    def evr(self):
+        epoch = self.get('epoch')
+        return Version(None if epoch is None else str(epoch),
+                       self.get('version'), self.get('release'))
+
+    def deps(self, kind):
+        """Return the DepsEntry list for a kind of dependency (provides,
+        requires, conflicts, obsoletes, recommends, suggests, supplements,
+        enhances)."""
+        base = kind[:-1] if kind.endswith('s') else kind
+        names = self.as_list(f'{base}name')
+        flags = self.as_list(f'{base}flags')
+        versions = self.as_list(f'{base}version')
+        l = []
+        for i, name in enumerate(names):
+            f = flags[i] if i < len(flags) else 0
+            v = versions[i] if i < len(versions) else ''
+            pre = bool(f & (RPMSENSE_PREREQ | RPMSENSE_SCRIPT_PRE
+                            | RPMSENSE_SCRIPT_POST))
+            sense = f & (RPMSENSE_LESS | RPMSENSE_GREATER | RPMSENSE_EQUAL)
+            l.append(DepsEntry(name, sense_names.get(sense), parse_evr(v), pre))
+        return l
+
+    def files(self):
+        """Return the list of file paths."""
+        basenames = self.as_list('basenames')
+        if not basenames:
+            return self.as_list('oldfilenames')
+        dirnames = self.as_list('dirnames')
+        dirindexes = self.as_list('dirindexes')
+        return [dirnames[i] + b for i, b in zip(dirindexes, basenames)]
+
+    def changelog(self):
+        """Return the list of (time, name, text) changelog entries."""
+        return list(zip(self.as_list('changelogtime'),
+                        self.as_list('changelogname'),
+                        self.as_list('changelogtext')))
+
+#-------------------------------------------------------------------------------
+# fetch_headers - get the headers of many packages from a mirror
+#-------------------------------------------------------------------------------
+
+def fetch_header(url, header_range, session=None):
+    """Return the RpmHeader of the package at url, fetching only its bytes."""
+    http = session or requests
+    start, end = header_range.start, header_range.end
+    response = http.get(url, timeout=timeout,
+                        headers={'Range': f'bytes={start}-{end - 1}'})
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise RuntimeError(f'{url}: range requests not supported')
+    return RpmHeader(response.content)
+
+def fetch_headers(pkgs, root_url, session=None, jobs=8, batch_size=256):
+    """Yield (Pkg, RpmHeader or exception) for each package, in order.
+
+    The packages must have been parsed with their <format> (see
+    PkgList.from_file(), with deps=True). The requests are made jobs at a
+    time, over pooled connections, one batch of packages after the other so
+    that memory use doesn't depend on the number of packages.
+    """
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=jobs)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def fetch(p):
+        hr = p.format.header_range if p.format else None
+        if hr is None:
+            return RuntimeError(f'{p.name}: no header range')
+        try:
+            return fetch_header(f'{root_url}/{p.location}', hr, session)
+        except (requests.RequestException, RuntimeError) as e:
+            return e
+
+    pkgs = list(pkgs)
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        for i in range(0, len(pkgs), batch_size):
+            batch = pkgs[i:i + batch_size]
+            yield from zip(batch, ex.map(fetch, batch))
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print(f'Usage: {sys.argv[0]} <primary.xml> <root_url> [<name>...]')
+        exit(-1)
+    filepath = sys.argv[1]
+    root_url = sys.argv[2]
+
+    pl = PkgList.from_file(filepath, deps=True)
+    pkgs = pl.packages
+    if len(sys.argv) > 3:
+        pkgs = [p for n in sys.argv[3:] for p in pl.find(n)]
+
+    t = time.perf_counter()
+    cnt = size = failed = 0
+    for p, h in fetch_headers(pkgs, root_url):
+        if isinstance(h, Exception):
+            print(f'{p.name}: {h}')
+            failed += 1
+            continue
+        print(h, end='')
+        cnt += 1
+        size += h.size
+    print(f'{cnt} headers ({size} bytes), {failed} failed,'
+          + f' in {time.perf_counter() - t:.2f}s')
@@ -0,0 +1,250 @@
+# rpmheader_t.py
+
+import os
+import re
+import struct
+import tempfile
+import threading
+import unittest
+from functools import partial
+from http.server import ThreadingHTTPServer
+from rpmheader import (RpmHeader, package_headers, header_size, fetch_headers,
+                       tags, lead_magic, lead_size, header_magic, INT16,
+                       INT32, STRING, BIN, STRING_ARRAY, I18NSTRING,
+                       RPMSENSE_EQUAL, RPMSENSE_GREATER, RPMSENSE_LESS,
+                       RPMSENSE_SCRIPT_PRE)
+from pkgformat_t import package_xml, write_primary
+from pkglist import PkgList
+from repocache_t import QuietHandler
+
+def make_header(entries):
+    """Return a header from a list of (tag name or number, type, value)."""
+    index = b''
+    store = bytearray()
+    entries = sorted((tags.get(t, t), type, v) for t, type, v in entries)
+    for tag, type, value in entries:
+        align = {INT16: 2, INT32: 4}.get(type, 1)
+        store += bytes(-len(store) % align)
+        off = len(store)
+        if type == STRING:
+            store += value.encode() + b'\0'
+            count = 1
+        elif type in [STRING_ARRAY, I18NSTRING]:
+            for s in value:
+                store += s.encode() + b'\0'
+            count = len(value)
+        elif type == BIN:
+            store += value
+            count = len(value)
+        else:
+            fmt = 'H' if type == INT16 else 'I'
+            values = value if isinstance(value, list) else [value]
+            store += struct.pack(f'>{len(values)}{fmt}', *values)
+            count = len(values)
+        index += struct.pack('>iiii', tag, type, off, count)
+    return (header_magic + bytes(4) + struct.pack('>II', len(entries),
+                                                  len(store))
+            + index + bytes(store))
+
+def package_header(name, ver='1.0', rel='1', arch='x86_64', epoch=None,
+                   files=(), requires=(), provides=(), changelog=()):
+    """Return the main header of a package.
+
+    Dependencies are (name, flags, version) tuples, the changelog is a list
+    of (time, name, text).
+    """
+    e = [('name', STRING, name), ('version', STRING, ver),
+         ('release', STRING, rel), ('arch', STRING, arch),
+         ('summary', I18NSTRING, [f'Summary of {name}']),
+         ('description', I18NSTRING, [f'Description of {name}']),
+         ('buildtime', INT32, 1600000000),
+         ('buildhost', STRING, 'build.example.org'),
+         ('license', STRING, 'MIT'), ('size', INT32, 12345),
+         ('sourcerpm', STRING, f'{name}-{ver}-{rel}.src.rpm'),
+         ('group', I18NSTRING, ['Unspecified']),
+         ('url', STRING, f'http://example.org/{name}'),
+         ('packager', STRING, 'Packager'), ('vendor', STRING, 'Vendor')]
+    if epoch is not None:
+        e.append(('epoch', INT32, epoch))
+    if files:
+        dirs = sorted({os.path.dirname(f) + '/' for f in files})
+        e += [('basenames', STRING_ARRAY, [os.path.basename(f) for f in files]),
+              ('dirnames', STRING_ARRAY, dirs),
+              ('dirindexes', INT32,
+               [dirs.index(os.path.dirname(f) + '/') for f in files]),
+              ('filemodes', INT16, [0o100755] * len(files)),
+              ('filesizes', INT32, [100] * len(files))]
+    for kind, deps in [('require', requires), ('provide', provides)]:
+        if deps:
+            e += [(f'{kind}name', STRING_ARRAY, [d[0] for d in deps]),
+                  (f'{kind}flags', INT32, [d[1] for d in deps]),
+                  (f'{kind}version', STRING_ARRAY, [d[2] for d in deps])]
+    if changelog:
+        e += [('changelogtime', INT32, [c[0] for c in changelog]),
+              ('changelogname', STRING_ARRAY, [c[1] for c in changelog]),
+              ('changelogtext', STRING_ARRAY, [c[2] for c in changelog])]
+    return make_header(e)
+
+def make_rpm(header, payload=b''):
+    """Return (.rpm file contents, header start, header end)."""
+    lead = lead_magic + bytes([3, 0, 0, 0]) + bytes(lead_size - 8)
+    sig = make_header([(1000, INT32, len(header) + len(payload)),
+                       (1004, BIN, b'\x01' * 16)])
+    sig += bytes(-len(sig) % 8)
+    start = len(lead) + len(sig)
+    return lead + sig + header + payload, start, start + len(header)
+
+class RangeHandler(QuietHandler):
+    """A file server answering single range requests with 206."""
+    def send_head(self):
+        m = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not m or not os.path.isfile(path):
+            return super().send_head()
+        with open(path, 'rb') as f:
+            data = f.read()
+        start, end = int(m.group(1)), int(m.group(2)) + 1
+        self.send_response(206)
+        self.send_header('Content-Range',
+                         f'bytes {start}-{end - 1}/{len(data)}')
+        self.send_header('Content-Length', str(len(data[start:end])))
+        self.end_headers()
+        self.wfile.write(data[start:end])
+        return None
+
+# -----------------------------------------------------------------------------
+# RpmHeaderTest
+# -----------------------------------------------------------------------------
+
+class RpmHeaderTest(unittest.TestCase):
+    """Test header decoding."""
+
+    def setUp(self):
+        self.h = RpmHeader(package_header(
+            'bash', '5.1', '2.fc34', epoch=1,
+            files=['/usr/bin/bash', '/usr/bin/sh', '/etc/skel/.bashrc'],
+            requires=[('libc.so.6', 0, ''),
+                      ('glibc', RPMSENSE_GREATER | RPMSENSE_EQUAL, '2.33'),
+                      ('/bin/sh', RPMSENSE_SCRIPT_PRE, '')],
+            provides=[('bash', RPMSENSE_EQUAL, '1:5.1-2.fc34'),
+                      ('sh', RPMSENSE_LESS, '6')],
+            changelog=[(1600000000, 'Someone <a@b> - 5.1-2', '- Rebuilt'),
+                       (1500000000, 'Someone <a@b> - 5.1-1', '- New')]))
+
+    def test_values(self):
+        """Each type of value"""
+        h = self.h
+        self.assertEqual('bash', h.get('name'))
+        self.assertEqual(1600000000, h.get('buildtime'))
+        self.assertEqual('Summary of bash', h.get('summary'))
+        self.assertEqual([0o100755] * 3, h.get('filemodes'))
+        self.assertEqual([100] * 3, h.get(1028))
+        self.assertIn('license', h)
+        self.assertNotIn('enhancename', h)
+        self.assertIsNone(h.get('vendorx'))
+        self.assertEqual('none', h.get('enhancename', 'none'))
+        self.assertEqual(('1', '5.1', '2.fc34'),
+                         (h.evr().epoch, h.evr().ver, h.evr().rel))
+
+    def test_deps(self):
+        """Flags, versions, pre-requirements"""
+        l = self.h.deps('requires')
+        self.assertEqual(['libc.so.6', 'glibc', '/bin/sh'],
+                         [e.name for e in l])
+        self.assertEqual([None, 'GE', None], [e.flags for e in l])
+        self.assertEqual([False, False, True], [e.pre for e in l])
+        self.assertIsNone(l[0].version)
+        self.assertEqual('2.33', l[1].version.ver)
+        l = self.h.deps('provides')
+        self.assertEqual(['EQ', 'LT'], [e.flags for e in l])
+        self.assertEqual(('1', '5.1', '2.fc34'),
+                         (l[0].version.epoch, l[0].version.ver,
+                          l[0].version.rel))
+        self.assertEqual([], self.h.deps('obsoletes'))
+
+    def test_files_changelog(self):
+        """Paths from directories and base names, changelog entries"""
+        self.assertEqual(['/usr/bin/bash', '/usr/bin/sh', '/etc/skel/.bashrc'],
+                         self.h.files())
+        log = self.h.changelog()
+        self.assertEqual(2, len(log))
+        self.assertEqual((1600000000, 'Someone <a@b> - 5.1-2', '- Rebuilt'),
+                         log[0])
+
+    def test_package(self):
+        """Signature and main header of an .rpm file"""
+        header = package_header('zsh')
+        data, start, end = make_rpm(header, b'payload')
+        sig, h, offset = package_headers(data)
+        self.assertEqual(start, offset)
+        self.assertEqual(end - start, h.size)
+        self.assertEqual(len(header) + 7, sig.get(1000))
+        self.assertEqual('zsh', h.get('name'))
+        self.assertIsNone(h.get('epoch'))
+        self.assertEqual([], h.files())
+
+    def test_errors(self):
+        """Bad magic numbers, truncated headers"""
+        header = package_header('zsh')
+        self.assertEqual(len(header), header_size(header))
+        with self.assertRaises(RuntimeError):
+            RpmHeader(b'\0' * 16)
+        with self.assertRaises(RuntimeError):
+            RpmHeader(header[:-1])
+        with self.assertRaises(RuntimeError):
+            package_headers(header)
+
+# -----------------------------------------------------------------------------
+# FetchHeadersTest
+# -----------------------------------------------------------------------------
+
+class FetchHeadersTest(unittest.TestCase):
+    """Test range requests to a local HTTP server."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        self.pkgs = []
+        for name in ['alpha', 'beta', 'gamma']:
+            data, start, end = make_rpm(package_header(name), os.urandom(5000))
+            location = f'Packages/{name}-1.0-1.x86_64.rpm'
+            os.makedirs(os.path.join(root, 'Packages'), exist_ok=True)
+            with open(os.path.join(root, location), 'wb') as f:
+                f.write(data)
+            self.pkgs.append(package_xml(name).replace(
+                'start="4504" end="9000"', f'start="{start}" end="{end}"'))
+        handler = partial(RangeHandler, directory=root)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_fetch(self):
+        """Headers come back in order, failures as exceptions"""
+        # gamma's header range is wrong
+        self.pkgs[2] = self.pkgs[2].replace('start="', 'start="1')
+        filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(filepath, self.pkgs)
+        pl = PkgList.from_file(filepath, deps=True)
+        results = list(fetch_headers(pl.packages, self.url, jobs=2,
+                                     batch_size=2))
+        self.assertEqual(['alpha', 'beta', 'gamma'],
+                         [p.name for p, h in results])
+        self.assertEqual(['alpha', 'beta'],
+                         [h.get('name') for p, h in results[:2]])
+        self.assertIsInstance(results[2][1], Exception)
+
+    def test_no_range(self):
+        """Packages parsed without <format> have no header range"""
+        filepath = os.path.join(self.tmp.name, 'primary.xml')
+        write_primary(filepath, self.pkgs)
+        pl = PkgList.from_file(filepath)
+        for p, h in fetch_headers(pl.packages, self.url):
+            self.assertIsInstance(h, RuntimeError)
+
+if __name__ == '__main__':
+    unittest.main()
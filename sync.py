@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# sync.py - retrieve the metadata of all the enabled repositories at once
+
+"""All the enabled repositories found in a directory of .repo files are
+synchronized concurrently: metalink, repomd.xml and the primary data set. The
+HTTP connections are pooled (and kept alive) in a single requests.Session
+shared by the workers, and a failure in one repository doesn't affect the
+others. A repository that fails makes the whole sync fail, unless it has
+skip_if_unavailable set.
+
+Optionally, the packages of all the repositories are recorded in a Catalog
+(see catalog.py), updated with the difference since the previous sync. The
+repositories that aren't enabled any more are removed from it.
+
+"""
+
+import sys
+import time
+import sqlite3
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from repo import Repo, parse_bool
+from repocache import RepoCache
+from catalog import Catalog
+from runner import Unbuffered
+
+#-------------------------------------------------------------------------------
+# make_session - a requests.Session suited to many concurrent workers
+#-------------------------------------------------------------------------------
+
+def make_session(jobs):
+    """Return a session keeping up to jobs connections alive per host."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=64,
+                                            pool_maxsize=jobs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+#-------------------------------------------------------------------------------
+# SyncResult - the outcome of synchronizing one repository
+#-------------------------------------------------------------------------------
+
+class SyncResult():
+    def __init__(self, repo, md=None, pl=None, error=None, elapsed=None):
+        self.repo = repo
+        self.md = md
+        self.pl = pl
+        self.error = error
+        self.elapsed = elapsed
+
+    def __str__(self):
+        s = f'{self.repo.repo_id:<40} {self.elapsed:7.2f}s  '
+        if self.error:
+            skip = parse_bool(self.repo.skip_if_unavailable)
+            s += f'{"skipped" if skip else "FAILED"}: {self.error}'
+        elif self.repo.changed is False:
+            s += f'unchanged, {len(self.pl.packages)} packages'
+        else:
+            s += f'revision {self.md.revision}, {len(self.pl.packages)} packages'
+        return s
+
+#-------------------------------------------------------------------------------
+# sync_repo - synchronize one repository, never raise
+#-------------------------------------------------------------------------------
+
+def sync_repo(r, cache, session, deps=False):
+    t = time.perf_counter()
+    try:
+        md = r.get_repomd(session=session)
+        if md is None:
+            raise RuntimeError('no metadata found')
+        pl = md.get_pkg_lists(r.root_url, cache, session, r.mirrors, deps)
+        if pl is None:
+            raise RuntimeError('no primary data set')
+        return SyncResult(r, md, pl, elapsed=time.perf_counter() - t)
+    except Exception as e:
+        return SyncResult(r, error=e, elapsed=time.perf_counter() - t)
+
+#-------------------------------------------------------------------------------
+# sync_all - synchronize all the enabled repositories
+#-------------------------------------------------------------------------------
+
+def sync_all(repos, jobs=8, cache=None, catalog=None):
+    """Return a list of SyncResult, one per enabled repository.
+
+    If a Catalog is given, each repository's packages are recorded in it as
+    soon as it's synchronized (by this thread, the only writer), and the
+    repositories that aren't enabled are removed from it.
+    """
+    repos = [r for r in repos if parse_bool(r.enabled, default=True)]
+    cache = cache or RepoCache()
+    session = make_session(jobs)
+
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        # The catalog records what each package provides
+        futures = [ex.submit(sync_repo, r, cache, session, catalog is not None)
+                   for r in repos]
+        for f in as_completed(futures):
+            res = f.result()
+            print(f'Done: {res}')
+            if catalog is not None and not res.error:
+                update_catalog(catalog, res)
+            results.append(res)
+    if catalog is not None:
+        prune_catalog(catalog, repos)
+    return results
+
+def update_catalog(catalog, res):
+    ds = res.md.get_data_set('primary')
+    key = f'{ds.checksum.type}:{ds.checksum.value}' if ds else None
+    try:
+        inserted, deleted = catalog.update(res.repo.repo_id, res.pl,
+                                           res.md.revision, key)
+        print(f'Catalog: {res.repo.repo_id}: {inserted} inserted,'
+              + f' {deleted} deleted')
+    except sqlite3.Error as e:
+        print(f'Catalog: {res.repo.repo_id}: {e}')
+
+def prune_catalog(catalog, repos):
+    """Remove the repositories that aren't in repos from the catalog."""
+    repo_ids = set(r.repo_id for r in repos)
+    for repo_id in catalog.repo_ids():
+        if repo_id in repo_ids:
+            continue
+        try:
+            catalog.remove_repo(repo_id)
+            print(f'Catalog: {repo_id}: removed')
+        except sqlite3.Error as e:
+            print(f'Catalog: {repo_id}: {e}')
+
+#===============================================================================
+# main
+#===============================================================================
+
+if __name__ == '__main__':
+    sys.stdout = Unbuffered(sys.stdout)
+
+    # Check cmd line args
+    if len(sys.argv) not in [2, 3, 4]:
+        print(f'usage: {sys.argv[0]} <dirpath> [<jobs> [<catalog.db>]]')
+        exit(-1)
+    dirpath = sys.argv[1]
+    jobs = int(sys.argv[2]) if len(sys.argv) >= 3 else 8
+
+    t = time.perf_counter()
+    if len(sys.argv) == 4:
+        with Catalog(sys.argv[3]) as catalog:
+            results = sync_all(Repo.from_dir(dirpath), jobs, catalog=catalog)
+    else:
+        results = sync_all(Repo.from_dir(dirpath), jobs)
+    print(f'\nSynchronized {len(results)} repositories'
+          + f' in {time.perf_counter() - t:.2f}s:')
+    failed = 0
+    for res in sorted(results, key=lambda x: x.repo.repo_id):
+        print(res)
+        if res.error and not parse_bool(res.repo.skip_if_unavailable):
+            failed += 1
+    if failed:
+        exit(-1)
@@ -3,17 +3,96 @@
 
 import os
 import re
+import sys
+import functools
 from lxml import etree
 
+#-------------------------------------------------------------------------------
+# rpmvercmp - compare version strings the way rpm does
+#-------------------------------------------------------------------------------
+
+# rpm splits version strings into maximal runs of digits or ASCII letters; any
+# other character is a separator, except '~' and '^' which have a meaning of
+# their own.
+seg_pat = re.compile(r'~|\^|[0-9]+|[a-zA-Z]+')
+
+# Rank of each kind of segment, when they're compared with each other: a tilde
+# sorts before everything, even the end of the string, and a caret sorts after
+# the end of the string but before anything else. Numbers are newer than
+# letters.
+TILDE, END, CARET, ALPHA, DIGITS = range(5)
+
+@functools.lru_cache(maxsize=1 << 16)
+def vercmp_key(s):
+    """Return a tuple that sorts like the version string s under rpmvercmp.
+
+    The tokenization is cached, since many packages share the same version or
+    release strings.
+    """
+    key = []
+    for t in seg_pat.findall(s or ''):
+        if t == '~':
+            key.append((TILDE,))
+        elif t == '^':
+            key.append((CARET,))
+        elif t[0].isdigit():
+            key.append((DIGITS, int(t)))
+        else:
+            key.append((ALPHA, t))
+    key.append((END,))
+    return tuple(key)
+
+def rpmvercmp(a, b):
+    """Compare two version strings, return -1, 0 or 1 like rpm's rpmvercmp."""
+    if a == b:
+        return 0
+    ka = vercmp_key(a)
+    kb = vercmp_key(b)
+    return (ka > kb) - (ka < kb)
+
 #-------------------------------------------------------------------------------
 # Version - 
 #-------------------------------------------------------------------------------
 
+@functools.total_ordering
 class Version():
+    __slots__ = ('epoch', 'ver', 'rel', 'cached_key')
+
     def __init__(self, epoch, ver, rel):
-        self.epoch = epoch
+        # Epochs and releases are shared by many packages
+        self.epoch = sys.intern(epoch) if epoch else epoch
         self.ver = ver
-        self.rel = rel
+        self.rel = sys.intern(rel) if rel else rel
+        self.cached_key = None
+
+    @property
+    def key(self):
+        """The sort key for this epoch:version-release, computed only once."""
+        if self.cached_key is None:
+            self.cached_key = (int(self.epoch or 0), vercmp_key(self.ver),
+                               vercmp_key(self.rel))
+        return self.cached_key
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.key == other.key
+
+    def __lt__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def evr(self):
+        """Return the version as an epoch:version-release string."""
+        s = f'{self.epoch}:' if self.epoch and self.epoch != '0' else ''
+        s += f'{self.ver}'
+        if self.rel:
+            s += f'-{self.rel}'
+        return s
 
     def __str__(self):
         return f'version: epoch={self.epoch}, ver={self.ver}, rel={self.rel}\n'
@@ -0,0 +1,376 @@
+#!/usr/bin/python
+# zchunk.py - incremental download of zchunk (.zck) data sets
+
+"""A zchunk file is a header followed by independently compressed chunks, and
+the header lists the checksum of every chunk. When the primary data set of a
+repository changes, most of its chunks stay the same, so with a previous
+version of the file in the cache, only the header and the chunks we don't
+already have need to be downloaded, with HTTP range requests. The new file is
+then put together from the old chunks and the new ones, and verified against
+the checksum given by repomd.xml like any other download.
+
+zchunk compresses with zstd: the optional zstandard module is needed to read
+the files. Without it, the repository code keeps using the .gz data sets.
+
+"""
+
+import os
+import glob
+import bisect
+import hashlib
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from lfs.download import save_chunks, timeout
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Ranges of missing chunks separated by less than this are fetched together
+merge_gap = 16*1024
+
+# Above this fraction of the file to download, a plain download is simpler
+max_fetch_ratio = 0.5
+
+# Number of previous files from the cache searched for reusable chunks
+max_seeds = 8
+
+#-------------------------------------------------------------------------------
+# Header parsing
+#-------------------------------------------------------------------------------
+
+lead_id = b'\0ZCK1'
+
+# Checksum types: (hashlib name, digest length)
+checksum_types = {
+    0: ('sha1', 20),
+    1: ('sha256', 32),
+    2: ('sha512', 64),
+    3: ('sha512', 16),      # SHA-512 truncated to 128 bits
+}
+
+# Preface flags
+FLAG_STREAMS = 1
+FLAG_OPTIONAL = 2
+FLAG_UNCOMPRESSED = 4
+
+# Compression types
+COMP_NONE = 0
+COMP_ZSTD = 2
+
+class NeedMore(Exception):
+    """The buffer ends before the end of the header."""
+
+class Reader():
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def bytes(self, n):
+        if self.pos + n > len(self.buf):
+            raise NeedMore()
+        b = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return bytes(b)
+
+    def int(self):
+        """Read a compressed integer: 7 bits per byte, least significant
+        first, the high bit is set on the last byte."""
+        n = shift = 0
+        while True:
+            if self.pos >= len(self.buf):
+                raise NeedMore()
+            c = self.buf[self.pos]
+            self.pos += 1
+            n |= (c & 0x7f) << shift
+            if c & 0x80:
+                return n
+            shift += 7
+
+def digest(type, data):
+    name, length = checksum_types[type]
+    return hashlib.new(name, data).digest()[:length]
+
+class Chunk():
+    __slots__ = ('digest', 'offset', 'length', 'open_length')
+
+    def __init__(self, digest, offset, length, open_length):
+        self.digest = digest
+        self.offset = offset
+        self.length = length
+        self.open_length = open_length
+
+class ZckHeader():
+    """The header of a zchunk file: lead, preface, index and signatures.
+
+    chunks is the list of chunks in file order, the dictionary first, with
+    their absolute offset in the file.
+    """
+    def __init__(self, buf):
+        r = Reader(buf)
+        if r.bytes(len(lead_id)) != lead_id:
+            raise RuntimeError('Not a zchunk file')
+        self.checksum_type = r.int()
+        if self.checksum_type not in checksum_types:
+            raise RuntimeError(f'Unknown zchunk checksum type {self.checksum_type}')
+        digest_length = checksum_types[self.checksum_type][1]
+        header_length = r.int()
+        digest_pos = r.pos
+        self.header_digest = r.bytes(digest_length)
+        # header_size is the total size, lead included, i.e. the offset of
+        # the first chunk.
+        self.header_size = r.pos + header_length
+        if len(buf) < self.header_size:
+            raise NeedMore()
+
+        # The header checksum covers the whole header but itself
+        if digest(self.checksum_type, bytes(buf[:digest_pos])
+                  + bytes(buf[r.pos:self.header_size])) != self.header_digest:
+            raise RuntimeError('zchunk header checksum mismatch')
+
+        # Preface
+        self.data_digest = r.bytes(digest_length)
+        self.flags = r.int()
+        self.compression = r.int()
+        if self.flags & (FLAG_STREAMS | FLAG_UNCOMPRESSED):
+            raise RuntimeError(f'Unsupported zchunk flags {self.flags}')
+        if self.compression not in [COMP_NONE, COMP_ZSTD]:
+            raise RuntimeError(f'Unsupported zchunk compression {self.compression}')
+        if self.flags & FLAG_OPTIONAL:
+            for i in range(r.int()):
+                r.int()
+                r.bytes(r.int())
+
+        # Index, the first chunk is the dictionary
+        r.int()
+        self.chunk_checksum_type = r.int()
+        if self.chunk_checksum_type not in checksum_types:
+            raise RuntimeError('Unknown zchunk chunk checksum type'
+                               + f' {self.chunk_checksum_type}')
+        chunk_digest_length = checksum_types[self.chunk_checksum_type][1]
+        self.chunks = []
+        offset = self.header_size
+        for i in range(r.int()):
+            d = r.bytes(chunk_digest_length)
+            length = r.int()
+            open_length = r.int()
+            self.chunks.append(Chunk(d, offset, length, open_length))
+            offset += length
+        self.data_size = offset - self.header_size
+        # Signatures aren't used
+
+    @property
+    def hex_digest(self):
+        return self.header_digest.hex()
+
+def header_from_file(filepath):
+    """Return the ZckHeader of a local file, or None if it's not readable."""
+    try:
+        with open(filepath, 'rb') as f:
+            buf = f.read(64*1024)
+            while True:
+                try:
+                    return ZckHeader(buf)
+                except NeedMore:
+                    more = f.read(len(buf))
+                    if not more:
+                        return None
+                    buf += more
+    except (OSError, RuntimeError):
+        return None
+
+#-------------------------------------------------------------------------------
+# ZckDecompressor - streaming decompression, for datastream.py
+#-------------------------------------------------------------------------------
+
+class ZckDecompressor():
+    """Decompress a zchunk file fed in pieces, like zlib's decompressobj."""
+    def __init__(self):
+        if zstandard is None:
+            raise RuntimeError('zchunk files need the zstandard module')
+        self.eof = False
+        self.unused_data = b''
+        self.buf = bytearray()
+        self.header = None
+        self.next = 0
+        self.dctx = None
+
+    def decompress(self, data):
+        self.buf += data
+        if self.header is None:
+            try:
+                self.header = ZckHeader(self.buf)
+            except NeedMore:
+                return b''
+            del self.buf[:self.header.header_size]
+
+        out = []
+        chunks = self.header.chunks
+        while self.next < len(chunks) and len(self.buf) >= chunks[self.next].length:
+            c = chunks[self.next]
+            data = bytes(self.buf[:c.length])
+            del self.buf[:c.length]
+            if self.next == 0:
+                self.set_dict(c, data)
+            elif self.header.compression == COMP_NONE:
+                out.append(data)
+            elif c.length:
+                out.append(self.dctx.decompress(data,
+                                                max_output_size=c.open_length))
+            self.next += 1
+        if self.next == len(chunks):
+            self.eof = True
+            self.unused_data = bytes(self.buf)
+        return b''.join(out)
+
+    def set_dict(self, c, data):
+        if self.header.compression == COMP_NONE:
+            return
+        if c.length:
+            raw = zstandard.ZstdDecompressor().decompress(
+                data, max_output_size=c.open_length)
+            d = zstandard.ZstdCompressionDict(raw)
+            self.dctx = zstandard.ZstdDecompressor(dict_data=d)
+        else:
+            self.dctx = zstandard.ZstdDecompressor()
+
+#-------------------------------------------------------------------------------
+# Range requests
+#-------------------------------------------------------------------------------
+
+def get_range(urls, start, end, session=None):
+    """Return bytes start..end-1 from the first mirror that provides them."""
+    http = session or requests
+    error = None
+    for url in urls:
+        try:
+            response = http.get(url, timeout=timeout,
+                                headers={'Range': f'bytes={start}-{end - 1}'})
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RuntimeError(f'{url}: range requests not supported')
+            if len(response.content) != end - start:
+                raise RuntimeError(f'{url}: short range')
+            return response.content
+        except (requests.RequestException, RuntimeError) as e:
+            error = e
+    raise RuntimeError(f'Could not get bytes {start}-{end - 1}: {error}')
+
+def fetch_header(ds, urls, session=None):
+    """Download the header of a zchunk data set, and verify it."""
+    size = getattr(ds, 'header_size', None) or 64*1024
+    buf = b''
+    while True:
+        buf += get_range(urls, len(buf), min(size, ds.size), session)
+        try:
+            header = ZckHeader(buf)
+            break
+        except NeedMore:
+            if len(buf) >= ds.size:
+                raise RuntimeError(f'{ds.location}: truncated zchunk header')
+            size *= 2
+    expected = getattr(ds, 'header_checksum', None)
+    if expected and header.hex_digest != expected.value:
+        raise RuntimeError(f'{ds.location}: zchunk header checksum mismatch')
+    return header, buf[:header.header_size]
+
+def merge_ranges(chunks):
+    """Return a list of [start, end) ranges covering the chunks."""
+    ranges = []
+    for c in chunks:
+        if ranges and c.offset - ranges[-1][1] <= merge_gap:
+            ranges[-1][1] = c.offset + c.length
+        else:
+            ranges.append([c.offset, c.offset + c.length])
+    return ranges
+
+#-------------------------------------------------------------------------------
+# fetch - retrieve a zchunk data set into the cache, reusing cached chunks
+#-------------------------------------------------------------------------------
+
+def find_seeds(cache, ds):
+    """Return the cached files of the same type, most recently used first."""
+    basename = ds.location.rsplit('/', maxsplit=1)[-1]
+    suffix = basename.split('-', maxsplit=1)[-1]
+    paths = glob.glob(os.path.join(cache.dirpath, '*', f'*-{suffix}'))
+    seeds = []
+    for path in paths:
+        try:
+            seeds.append((os.stat(path).st_mtime, path))
+        except FileNotFoundError:
+            # Just evicted
+            pass
+    seeds.sort(reverse=True)
+    return [path for _, path in seeds[:max_seeds]]
+
+def fetch(cache, ds, urls, session=None, jobs=4):
+    """Return the path of the cached file for ds, a zchunk data set.
+
+    Chunks found in previous versions of the file are copied from the cache,
+    only the other ones are downloaded. Without a usable previous version,
+    the whole file is downloaded (see RepoCache.fetch()). Raise a
+    RuntimeError if the file can't be retrieved, or doesn't match.
+    """
+    filepath = cache.get(ds)
+    if filepath:
+        print(f'  In cache: "{filepath}"')
+        return filepath
+    if isinstance(urls, str):
+        urls = [urls]
+
+    # Index the chunks we already have, by checksum
+    header, header_data = fetch_header(ds, urls, session)
+    have = {}
+    for path in find_seeds(cache, ds):
+        h = header_from_file(path)
+        if h and h.chunk_checksum_type == header.chunk_checksum_type:
+            for c in h.chunks:
+                have.setdefault(c.digest, (path, c.offset))
+
+    missing = [c for c in header.chunks if c.digest not in have]
+    ranges = merge_ranges(missing)
+    fetch_size = sum(end - start for start, end in ranges)
+    if not have or fetch_size > max_fetch_ratio * ds.size:
+        return cache.fetch(ds, urls, session)
+
+    print(f'  zchunk: {len(header.chunks) - len(missing)}/{len(header.chunks)}'
+          + f' chunks in cache, downloading {fetch_size}/{ds.size} bytes')
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        data = list(ex.map(lambda r: get_range(urls, r[0], r[1], session),
+                           ranges))
+    starts = [start for start, end in ranges]
+
+    def assemble():
+        yield header_data
+        files = {}
+        try:
+            for c in header.chunks:
+                if c.digest in have:
+                    path, offset = have[c.digest]
+                    if path not in files:
+                        files[path] = open(path, 'rb')
+                    f = files[path]
+                    f.seek(offset)
+                    yield f.read(c.length)
+                else:
+                    i = bisect.bisect_right(starts, c.offset) - 1
+                    pos = c.offset - starts[i]
+                    yield data[i][pos:pos + c.length]
+        finally:
+            for f in files.values():
+                f.close()
+
+    filepath = cache.path_for(ds)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    try:
+        save_chunks(assemble(), filepath, [ds.checksum], ds.size,
+                    name=ds.location)
+    except RuntimeError as e:
+        print(f'  zchunk: {e}, downloading the whole file')
+        return cache.fetch(ds, urls, session)
+    cache.evict(keep=filepath)
+    return filepath
+
+if __name__ == '__main__':
+    print("""This module is not meant to run directly.""")
@@ -0,0 +1,154 @@
+# zchunk_t.py
+
+import hashlib
+import unittest
+import zchunk
+from zchunk import (Reader, NeedMore, ZckHeader, ZckDecompressor, Chunk,
+                    merge_ranges, lead_id, COMP_NONE, COMP_ZSTD, merge_gap)
+
+def encode_int(n):
+    """The inverse of Reader.int()"""
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f)
+        n >>= 7
+    out.append(n | 0x80)
+    return bytes(out)
+
+def make_zck(pieces, compression=COMP_ZSTD):
+    """Return a zchunk file with one chunk per piece, sha256 everywhere."""
+    if compression == COMP_ZSTD:
+        cctx = zchunk.zstandard.ZstdCompressor()
+        chunks = [cctx.compress(p) for p in pieces]
+    else:
+        chunks = list(pieces)
+    # An empty dictionary chunk first
+    chunks.insert(0, b'')
+    pieces = [b''] + list(pieces)
+    sha = lambda data: hashlib.sha256(data).digest()
+
+    index = encode_int(1) + encode_int(len(chunks))
+    for c, p in zip(chunks, pieces):
+        index += sha(c) + encode_int(len(c)) + encode_int(len(p))
+    data = b''.join(chunks)
+    rest = (sha(data) + encode_int(0) + encode_int(compression)
+            + encode_int(len(index)) + index + encode_int(0))
+    lead = lead_id + encode_int(1) + encode_int(len(rest))
+    return lead + sha(lead + rest) + rest + data
+
+# -----------------------------------------------------------------------------
+# ReaderTest
+# -----------------------------------------------------------------------------
+
+class ReaderTest(unittest.TestCase):
+    """Test the compressed integers."""
+
+    def test_int(self):
+        """Round trip, and the end of the buffer"""
+        values = [0, 1, 127, 128, 300, 16383, 16384, 2**40]
+        r = Reader(b''.join(encode_int(n) for n in values))
+        self.assertEqual(values, [r.int() for n in values])
+        with self.assertRaises(NeedMore):
+            r.int()
+        with self.assertRaises(NeedMore):
+            Reader(b'\x01\x02').int()
+        self.assertEqual(b'ab', Reader(b'xab', 1).bytes(2))
+        with self.assertRaises(NeedMore):
+            Reader(b'ab').bytes(3)
+
+# -----------------------------------------------------------------------------
+# ZckHeaderTest
+# -----------------------------------------------------------------------------
+
+class ZckHeaderTest(unittest.TestCase):
+    """Test header parsing."""
+
+    def test_header(self):
+        """Chunk offsets and lengths"""
+        pieces = [b'a' * 100, b'b' * 10, b'']
+        buf = make_zck(pieces, COMP_NONE)
+        h = ZckHeader(buf)
+        self.assertEqual(COMP_NONE, h.compression)
+        self.assertEqual(4, len(h.chunks))
+        self.assertEqual(len(buf) - 110, h.header_size)
+        self.assertEqual(110, h.data_size)
+        self.assertEqual([h.header_size, h.header_size, h.header_size + 100,
+                          h.header_size + 110],
+                         [c.offset for c in h.chunks])
+        self.assertEqual([0, 100, 10, 0], [c.length for c in h.chunks])
+        self.assertEqual(hashlib.sha256(b'b' * 10).digest(),
+                         h.chunks[2].digest)
+
+    def test_truncated(self):
+        """A partial header asks for more"""
+        buf = make_zck([b'abc'], COMP_NONE)
+        h = ZckHeader(buf)
+        for n in [3, 10, h.header_size - 1]:
+            with self.assertRaises(NeedMore):
+                ZckHeader(buf[:n])
+        ZckHeader(buf[:h.header_size])
+
+    def test_errors(self):
+        """Not a zchunk file, or a corrupt header"""
+        buf = bytearray(make_zck([b'abc'], COMP_NONE))
+        with self.assertRaises(RuntimeError):
+            ZckHeader(b'\0ZCK2' + bytes(buf[5:]))
+        buf[-10] ^= 1
+        with self.assertRaises(RuntimeError):
+            ZckHeader(buf)
+
+# -----------------------------------------------------------------------------
+# ZckDecompressorTest
+# -----------------------------------------------------------------------------
+
+@unittest.skipIf(zchunk.zstandard is None, 'zstandard is not installed')
+class ZckDecompressorTest(unittest.TestCase):
+    """Test streaming decompression."""
+
+    pieces = [b'<package>%d</package>' % i * 50 for i in range(20)]
+
+    def decompress(self, buf, step, trailer=b''):
+        d = ZckDecompressor()
+        data = buf + trailer
+        out = b''.join(d.decompress(data[i:i + step])
+                       for i in range(0, len(data), step))
+        self.assertTrue(d.eof)
+        self.assertEqual(trailer, d.unused_data)
+        return out
+
+    def test_decompress(self):
+        """Fed at once or in small pieces"""
+        buf = make_zck(self.pieces)
+        for step in [len(buf), 1000, 7]:
+            self.assertEqual(b''.join(self.pieces), self.decompress(buf, step))
+
+    def test_uncompressed(self):
+        """Chunks stored as is"""
+        buf = make_zck(self.pieces, COMP_NONE)
+        self.assertEqual(b''.join(self.pieces), self.decompress(buf, 100))
+
+    def test_unused_data(self):
+        """What follows the last chunk is left over"""
+        buf = make_zck(self.pieces)
+        self.assertEqual(b''.join(self.pieces),
+                         self.decompress(buf, len(buf) + 5, b'extra'))
+
+# -----------------------------------------------------------------------------
+# MergeRangesTest
+# -----------------------------------------------------------------------------
+
+class MergeRangesTest(unittest.TestCase):
+    """Test the grouping of missing chunks into range requests."""
+
+    def test_merge(self):
+        """Close chunks are fetched together"""
+        chunks = [Chunk(None, 100, 10, 0), Chunk(None, 110, 20, 0),
+                  Chunk(None, 130 + merge_gap, 5, 0),
+                  Chunk(None, 136 + 2 * merge_gap, 1, 0)]
+        self.assertEqual([[100, 135 + merge_gap],
+                          [136 + 2 * merge_gap, 137 + 2 * merge_gap]],
+                         merge_ranges(chunks))
+        self.assertEqual([], merge_ranges([]))
+
+if __name__ == '__main__':
+    unittest.main()